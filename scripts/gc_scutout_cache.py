@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import logging
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from scutout import __version__, __date__
+from scutout import logger
+from scutout.cache import CutoutCache
+
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Garbage-collect a scutout processed cutout cache: remove stale tmp entries and evict least recently used cutouts above a max size.")
+
+	parser.add_argument('-cache_dir','--cache_dir', dest='cache_dir', required=True, type=str, help='Cutout cache directory')
+	parser.add_argument('-max_size','--max_size', dest='max_size', required=False, type=float, default=0, help='Max cache size in MB, least recently used cutouts are evicted above it (default=0, no eviction)')
+	parser.add_argument('-tmp_max_age','--tmp_max_age', dest='tmp_max_age', required=False, type=float, default=24, help='Age in hours above which tmp entries left by killed runs are removed (default=24)')
+	parser.add_argument('-loglevel','--loglevel', dest='loglevel', required=False, type=str, default='INFO', help='Logging level (default=INFO)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	log_level_str= args.loglevel.upper()
+	log_level = getattr(logging, log_level_str, None)
+	if not isinstance(log_level, int):
+		logger.error('Invalid log level given: ' + log_level_str)
+		return 1
+	logger.setLevel(log_level)
+
+	#===========================
+	#==   COLLECT CACHE
+	#===========================
+	if not os.path.isdir(args.cache_dir):
+		logger.error("Cache directory %s not existing!" % (args.cache_dir))
+		return 1
+
+	cache= CutoutCache(args.cache_dir)
+	size_before= cache.get_size()
+	nremoved= cache.gc(max_size=args.max_size*1024*1024,tmp_max_age=args.tmp_max_age*3600)
+	size_after= cache.get_size()
+	logger.info("Removed %d cache entries, cache size %.1f MB -> %.1f MB" % (nremoved,size_before/1024./1024.,size_after/1024./1024.))
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
+
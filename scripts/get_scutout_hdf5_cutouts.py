@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import logging
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## ASTRO MODULES
+from astropy.io import fits
+
+## MODULES
+from scutout import __version__, __date__
+from scutout import logger
+from scutout.hdf5_store import Hdf5CutoutStore, has_h5py
+
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Extract source cutouts stored in a scutout HDF5 output file as FITS files (<outdir>/<OBJNAME>/<OBJNAME>_<survey>.fits).")
+
+	parser.add_argument('-input','--input', dest='input', required=True, type=str, help='HDF5 cutout file produced by run_scutout.py')
+	parser.add_argument('-objnames','--objnames', dest='objnames', required=False, type=str, default='', help='Names of sources to be extracted, separated by commas (default=all sources)')
+	parser.add_argument('-outdir','--outdir', dest='outdir', required=False, type=str, default='', help='Output directory (default=current dir)')
+	parser.add_argument('-loglevel','--loglevel', dest='loglevel', required=False, type=str, default='INFO', help='Logging level (default=INFO)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	log_level_str= args.loglevel.upper()
+	log_level = getattr(logging, log_level_str, None)
+	if not isinstance(log_level, int):
+		logger.error('Invalid log level given: ' + log_level_str)
+		return 1
+	logger.setLevel(log_level)
+
+	if not has_h5py:
+		logger.error("h5py module is not available!")
+		return 1
+	if not os.path.isfile(args.input):
+		logger.error("Input file %s not existing!" % (args.input))
+		return 1
+
+	#===========================
+	#==   EXTRACT CUTOUTS
+	#===========================
+	store= Hdf5CutoutStore(args.input)
+	objnames= args.objnames.split(',') if args.objnames else store.get_sources()
+	outdir= os.path.abspath(args.outdir) if args.outdir else os.getcwd()
+
+	nfailed= 0
+	for objname in objnames:
+		try:
+			surveys= store.get_surveys(objname)
+		except KeyError:
+			logger.warn("Source %s not found in file %s!" % (objname,args.input))
+			nfailed+= 1
+			continue
+
+		source_dir= os.path.join(outdir,objname)
+		if not os.path.isdir(source_dir):
+			os.makedirs(source_dir)
+
+		for survey in surveys:
+			data, header= store.get(objname,survey)
+			filename= os.path.join(source_dir,objname + '_' + survey + '.fits')
+			fits.PrimaryHDU(data,header).writeto(filename,overwrite=True)
+
+	logger.info("Extracted cutouts of %d sources in %s (%d not found)" % (len(objnames)-nfailed,outdir,nfailed))
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import logging
+
+## COMMAND-LINE ARG MODULES
+import argparse
+
+## MODULES
+from scutout import __version__, __date__
+from scutout import logger
+from scutout.manifest import merge_manifests
+
+
+###########################
+##     ARGS
+###########################
+def get_args():
+	"""This function parses and return arguments passed in"""
+	parser = argparse.ArgumentParser(description="Merge run manifests produced by scutout shards into a single run summary.")
+
+	parser.add_argument('-inputs','--inputs', dest='inputs', required=True, nargs='+', type=str, help='Shard manifest files to be merged')
+	parser.add_argument('-output','--output', dest='output', required=False, type=str, default='manifest.jsonl', help='Merged manifest file (default=manifest.jsonl)')
+	parser.add_argument('--force', dest='force', action='store_true', help='Merge manifests even if produced with different config options')
+	parser.set_defaults(force=False)
+	parser.add_argument('-loglevel','--loglevel', dest='loglevel', required=False, type=str, default='INFO', help='Logging level (default=INFO)')
+
+	args = parser.parse_args()
+
+	return args
+
+
+##############
+##   MAIN   ##
+##############
+def main():
+	"""Main function"""
+
+	#===========================
+	#==   PARSE ARGS
+	#===========================
+	try:
+		args= get_args()
+	except Exception as ex:
+		logger.error("Failed to get and parse options (err=%s)",str(ex))
+		return 1
+
+	log_level_str= args.loglevel.upper()
+	log_level = getattr(logging, log_level_str, None)
+	if not isinstance(log_level, int):
+		logger.error('Invalid log level given: ' + log_level_str)
+		return 1
+	logger.setLevel(log_level)
+
+	#===========================
+	#==   MERGE MANIFESTS
+	#===========================
+	logger.info("Merging %d manifests ..." % (len(args.inputs)))
+	status= merge_manifests(args.inputs,args.output,force=args.force)
+	if status<0:
+		logger.error("Failed to merge manifests!")
+		return 1
+
+	return 0
+
+###################
+##   MAIN EXEC   ##
+###################
+if __name__ == "__main__":
+	sys.exit(main())
+
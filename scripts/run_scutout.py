@@ -28,7 +28,8 @@ import collections
 from scutout import __version__, __date__
 from scutout import logger
 from scutout.config import Config
-from scutout.cutout_extractor import CutoutFinder
+from scutout.cutout_extractor import CutoutFinder, has_mpi
+from scutout.hdf5_store import has_h5py
 
 #### GET SCRIPT ARGS ####
 def str2bool(v):
@@ -50,6 +51,16 @@ def get_args():
 	parser.add_argument('-filename','--filename', dest='filename', required=True, type=str, default='', help='List of source position to be searched for cutout (ascii format)') 
 	parser.add_argument('-config','--config', dest='config', required=True, type=str, default='', help='Configuration file (INI format)') 
 	parser.add_argument('-loglevel','--loglevel', dest='loglevel', required=False, type=str, default='INFO', help='Logging level (default=INFO)') 
+	parser.add_argument('-nworkers','--nworkers', dest='nworkers', required=False, type=int, default=0, help='Number of worker processes used to process sources in parallel (default=value given in config file)') 
+	parser.add_argument('-shard','--shard', dest='shard', required=False, type=str, default='', help='Process only the sky shard i/N (i=0,...,N-1) of the input source list, e.g. 0/4 (default=process all sources)') 
+	parser.add_argument('-queue','--queue', dest='queue', required=False, type=str, default='', help='SQLite work queue file shared by cooperating runs. Input sources are added to the queue and then leased from it (default=no queue)') 
+	parser.add_argument('--mpi', dest='mpi', action='store_true', help='Run in MPI master/worker mode, e.g. with mpirun -np N (requires mpi4py)') 
+	parser.set_defaults(mpi=False)
+	parser.add_argument('--pipeline', dest='pipeline', action='store_true', help='Overlap raw cutout extraction, processing and writing of different sources in a pipeline of nworkers workers per stage') 
+	parser.set_defaults(pipeline=False)
+	parser.add_argument('--resume', dest='resume', action='store_true', help='Skip sources completed in a previous run with the same config, as recorded in the run manifest') 
+	parser.set_defaults(resume=False)
+	parser.add_argument('-manifest','--manifest', dest='manifest', required=False, type=str, default='', help='Run manifest file (default=manifest.jsonl or manifest_shard<i>of<N>.jsonl in work dir)') 
 	
 	# ...
 	# ...
@@ -93,6 +104,23 @@ def main():
 		logger.error("Configuration file name is empty!")
 		return 1
 
+	if args.mpi and not has_mpi:
+		logger.error("MPI mode requested but mpi4py module is not available!")
+		return 1
+	if (args.mpi + bool(args.queue) + args.pipeline)>1:
+		logger.error("Only one among MPI, work queue and pipeline modes can be used!")
+		return 1
+
+	shard= None
+	if args.shard:
+		try:
+			shard= tuple([int(item) for item in args.shard.split('/')])
+			if len(shard)!=2 or shard[1]<=0 or shard[0]<0 or shard[0]>=shard[1]:
+				raise ValueError('index must be in range [0,N)')
+		except Exception as ex:
+			logger.error("Invalid shard option %s given, expected i/N with 0<=i<N (err=%s)!" % (args.shard,str(ex)))
+			return 1
+
 	
 	#===========================
 	#==   PARSE CONFIG
@@ -105,12 +133,20 @@ def main():
 		logger.error("Failed to parse and validate config file " + config_filename + "!")
 		return 1
 
+	# - Override config options with script args
+	if args.nworkers>0:
+		config.nworkers= args.nworkers
+
+	if config.output_format=='hdf5' and not has_h5py:
+		logger.error("HDF5 output format requested but h5py module is not available!")
+		return 1
+
 	
 	#===========================
 	#==   RUN CUTOUT SEARCH
 	#===========================
 	logger.info("Run cutout search ...")
-	finder= CutoutFinder(filename,config)
+	finder= CutoutFinder(filename,config,shard=shard,manifest_file=args.manifest,queue_file=args.queue,use_mpi=args.mpi,use_pipeline=args.pipeline,resume=args.resume)
 
 	status= finder.run_search()
 	if status<0:
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+## ASTRO MODULES
+from astropy.coordinates import SkyCoord
+
+## MODULES
+from scutout.utils import Utils
+
+##############################
+##     GLOBAL VARS
+##############################
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION= 1
+
+# - Eviction removes entries down to this fraction of the max cache size, so that the cache is not scanned again at the next store
+EVICT_SIZE_FRACTION= 0.9
+
+
+###########################
+##     CLASS DEFINITIONS
+###########################
+class CutoutCache(object):
+	""" Content-addressed cache of processed cutouts, shared across runs.
+	    Each entry is a directory named after the cutout key, holding one FITS file per survey plus a meta.json file.
+	    Entries are written in a tmp dir and then renamed, so that concurrent runs never see partial entries.
+	    The entry meta file is touched when accessed, giving the LRU order used for eviction.
+	    The total cache size is kept in a size index file, updated at each store and set to the actual size when the cache is scanned for eviction,
+	    so that the cache tree is scanned only when the max size is exceeded. Index updates are serialized by a lock on a side lock file.
+	"""
+
+	def __init__(self,cache_dir,max_size=0):
+		""" Return a cutout cache object (max_size in bytes, 0=unlimited) """
+
+		self.cache_dir= os.path.abspath(cache_dir)
+		self.max_size= max_size
+		self.tmp_dir= os.path.join(self.cache_dir,'tmp')
+		self.size_index_file= os.path.join(self.cache_dir,'size.idx')
+		self.lock_file= self.size_index_file + '.lock'
+
+	#==============================
+	#     CUTOUT KEY
+	#==============================
+	@staticmethod
+	def get_key(tiles,ra,dec,cutout_size,config_hash):
+		""" Return cache key from input tile identities (path, size, mtime), source position & cutout size and processing options hash """
+
+		tile_ids= []
+		for tile in sorted(set([os.path.abspath(str(tile)) for tile in tiles])):
+			try:
+				st= os.stat(tile)
+			except OSError:
+				# - Missing tiles are never cached
+				return None
+			tile_ids.append((tile,st.st_size,st.st_mtime_ns))
+
+		key_data= {
+			'version': CACHE_VERSION,
+			'tiles': tile_ids,
+			'ra': repr(float(ra)),
+			'dec': repr(float(dec)),
+			'cutout_size': repr(float(cutout_size)),
+			'config_hash': config_hash,
+		}
+
+		return hashlib.sha1(json.dumps(key_data,sort_keys=True).encode('utf-8')).hexdigest()
+
+	def __get_entry_dir(self,key):
+		""" Return entry directory for given key """
+		return os.path.join(self.cache_dir,key[:2],key)
+
+	#==============================
+	#     FETCH ENTRY
+	#==============================
+	def fetch(self,key):
+		""" Return entry meta info (with absolute path of cached files) if key is cached, None otherwise """
+
+		entry_dir= self.__get_entry_dir(key)
+		meta_file= os.path.join(entry_dir,'meta.json')
+
+		try:
+			with open(meta_file,'r') as f:
+				meta= json.load(f)
+			files= {survey: os.path.join(entry_dir,filename) for survey, filename in meta['files'].items()}
+			if not all([os.path.isfile(filename) for filename in files.values()]):
+				return None
+
+			# - Mark entry as recently used
+			os.utime(meta_file,None)
+
+		except (OSError,ValueError,KeyError):
+			return None
+
+		meta['files']= files
+
+		return meta
+
+	#==============================
+	#     STORE ENTRY
+	#==============================
+	def store(self,key,files,**meta_info):
+		""" Store cutout files (dictionary of survey -> filename) under given key """
+
+		entry_dir= self.__get_entry_dir(key)
+		if os.path.isdir(entry_dir):
+			return 0
+
+		# - Write entry in a private tmp dir, then move it in place
+		entry_tmp_dir= os.path.join(self.tmp_dir,'%s.%s.%d' % (key,socket.gethostname(),os.getpid()))
+
+		try:
+			os.makedirs(entry_tmp_dir)
+
+			meta= {'key': key, 'files': {}, 'ctime': time.time()}
+			meta.update(meta_info)
+			for survey, filename in files.items():
+				filename_cached= survey + '.fits'
+				filename_cached_fullpath= os.path.join(entry_tmp_dir,filename_cached)
+				shutil.copyfile(filename,filename_cached_fullpath)
+				os.chmod(filename_cached_fullpath,0o444)
+				meta['files'][survey]= filename_cached
+
+			with open(os.path.join(entry_tmp_dir,'meta.json'),'w') as f:
+				json.dump(meta,f,default=str)
+
+			entry_size= sum([os.path.getsize(os.path.join(entry_tmp_dir,filename)) for filename in os.listdir(entry_tmp_dir)])
+
+			os.makedirs(os.path.dirname(entry_dir),exist_ok=True)
+			os.rename(entry_tmp_dir,entry_dir)
+
+		except OSError as e:
+			shutil.rmtree(entry_tmp_dir,ignore_errors=True)
+			if os.path.isdir(entry_dir):
+				# - Stored meanwhile by another process
+				return 0
+			logger.warn("Failed to store cutouts in cache %s (err=%s)!" % (self.cache_dir,str(e)))
+			return -1
+
+		# - Update cache size index, evicting least recently used entries if over size
+		if self.max_size>0:
+			if self.__add_size(entry_size)>self.max_size:
+				self.evict(int(self.max_size*EVICT_SIZE_FRACTION))
+
+		return 0
+
+	#==============================
+	#     SIZE INDEX
+	#==============================
+	def __lock(self):
+		""" Acquire exclusive lock on cache size index (blocking). Return the lock file object. """
+		os.makedirs(self.cache_dir,exist_ok=True)
+		f= open(self.lock_file,'a')
+		fcntl.flock(f,fcntl.LOCK_EX)
+		return f
+
+	def __unlock(self,f):
+		""" Release lock on cache size index """
+		fcntl.flock(f,fcntl.LOCK_UN)
+		f.close()
+
+	def __read_size_index(self):
+		""" Return cache size stored in size index, or None if not available """
+		try:
+			with open(self.size_index_file,'r') as f:
+				return int(f.read())
+		except (OSError,ValueError):
+			return None
+
+	def __write_size_index(self,size):
+		""" Write cache size in size index (atomically replaced) """
+		size_index_tmp= '%s.%s.%d' % (self.size_index_file,socket.gethostname(),os.getpid())
+		with open(size_index_tmp,'w') as f:
+			f.write(str(size))
+		os.replace(size_index_tmp,self.size_index_file)
+
+	def __add_size(self,nbytes):
+		""" Add nbytes to cache size index (scanning the cache if there is no index yet). Return the updated cache size. """
+
+		f= self.__lock()
+		try:
+			size= self.__read_size_index()
+			if size is None:
+				size= self.get_size()
+			else:
+				size+= nbytes
+			self.__write_size_index(size)
+		finally:
+			self.__unlock(f)
+
+		return size
+
+	#==============================
+	#     LIST ENTRIES
+	#==============================
+	def get_entries(self):
+		""" Return list of cache entries (last access time, size in bytes, entry dir) sorted by last access """
+
+		entries= []
+		if not os.path.isdir(self.cache_dir):
+			return entries
+
+		for prefix in os.listdir(self.cache_dir):
+			prefix_dir= os.path.join(self.cache_dir,prefix)
+			if prefix_dir==self.tmp_dir or not os.path.isdir(prefix_dir):
+				continue
+			for key in os.listdir(prefix_dir):
+				entry_dir= os.path.join(prefix_dir,key)
+				try:
+					atime= os.stat(os.path.join(entry_dir,'meta.json')).st_mtime
+					size= sum([os.path.getsize(os.path.join(entry_dir,filename)) for filename in os.listdir(entry_dir)])
+				except OSError:
+					# - Entry removed meanwhile or incomplete
+					continue
+				entries.append((atime,size,entry_dir))
+
+		entries.sort()
+
+		return entries
+
+	def get_size(self):
+		""" Return total size of cache entries in bytes """
+		return sum([entry[1] for entry in self.get_entries()])
+
+	#==============================
+	#     EVICT ENTRIES
+	#==============================
+	def evict(self,max_size):
+		""" Remove least recently used entries until total size is below max_size (bytes), and set the size index to the remaining size. Return number of removed entries. """
+
+		f= self.__lock()
+		try:
+			entries= self.get_entries()
+			total_size= sum([entry[1] for entry in entries])
+
+			nremoved= 0
+			for atime, size, entry_dir in entries:
+				if total_size<=max_size:
+					break
+				logger.debug("Evicting cache entry %s (size=%d bytes) ..." % (entry_dir,size))
+				self.__remove_dir(entry_dir)
+				total_size-= size
+				nremoved+= 1
+
+			self.__write_size_index(total_size)
+		finally:
+			self.__unlock(f)
+
+		return nremoved
+
+	#==============================
+	#     GARBAGE COLLECTION
+	#==============================
+	def gc(self,max_size=None,tmp_max_age=86400.):
+		""" Remove stale tmp entries (left by killed runs) older than tmp_max_age seconds and evict entries above max_size (bytes, default to cache max size). Return number of removed entries. """
+
+		nremoved= 0
+
+		# - Remove stale tmp entries
+		if os.path.isdir(self.tmp_dir):
+			now= time.time()
+			for name in os.listdir(self.tmp_dir):
+				path= os.path.join(self.tmp_dir,name)
+				try:
+					age= now - os.stat(path).st_mtime
+				except OSError:
+					continue
+				if age>tmp_max_age:
+					logger.debug("Removing stale cache tmp entry %s ..." % (path))
+					self.__remove_dir(path)
+					nremoved+= 1
+
+		# - Evict LRU entries (or just refresh the size index)
+		if max_size is None:
+			max_size= self.max_size
+		if max_size>0:
+			nremoved+= self.evict(max_size)
+		elif os.path.isdir(self.cache_dir):
+			f= self.__lock()
+			try:
+				self.__write_size_index(self.get_size())
+			finally:
+				self.__unlock(f)
+
+		# - Remove empty prefix dirs (also left by eviction)
+		if os.path.isdir(self.cache_dir):
+			for prefix in os.listdir(self.cache_dir):
+				prefix_dir= os.path.join(self.cache_dir,prefix)
+				if prefix_dir!=self.tmp_dir and os.path.isdir(prefix_dir) and not os.listdir(prefix_dir):
+					try:
+						os.rmdir(prefix_dir)
+					except OSError:
+						pass
+
+		return nremoved
+
+	def __remove_dir(self,path):
+		""" Remove cache dir """
+		shutil.rmtree(path,ignore_errors=True)
+
+
+
+class RawCutoutCache(object):
+	""" In-memory cache of the raw cutouts extracted from survey tiles in this process, indexed by tile and sky bounding box.
+	    Cutouts fully contained in a previously extracted cutout of the same tile are sliced from it instead of being read from the tile.
+	    Total data size is bounded, least recently used cutouts being dropped first.
+	"""
+
+	def __init__(self,max_size):
+		""" Return a raw cutout cache object (max_size in bytes) """
+
+		self.max_size= max_size
+		self.size= 0
+		self.entries= OrderedDict()
+		self.lock= threading.Lock()
+		self.nhits= 0
+		self.nmisses= 0
+
+	#==============================
+	#     GET CUTOUT
+	#==============================
+	def get(self,tile,ra,dec,cutout_size):
+		""" Return (data,header) of a cutout of size cutout_size (deg) around (ra,dec) sliced from a cached cutout of given tile, or (None,None) if not contained in any """
+
+		# - Select candidates of same tile whose bounding box may contain the requested one
+		with self.lock:
+			candidates= [
+				(key,entry) for key, entry in self.entries.items()
+				if key[0]==tile and entry['size']>=cutout_size
+			]
+
+		position= SkyCoord(ra=ra,dec=dec,unit='deg',frame='fk5')
+		for key, entry in candidates:
+			# - Quick reject (containment needs center offsets below the half-size difference along both axes), then slice if contained
+			if position.separation(entry['center']).deg>(entry['size']-cutout_size)/2.*1.5:
+				continue
+			data, header= Utils.sliceContainedCutout(entry['data'],entry['header'],ra,dec,cutout_size)
+			if data is None:
+				continue
+			with self.lock:
+				if key in self.entries:
+					self.entries.move_to_end(key)
+				self.nhits+= 1
+			return data, header
+
+		with self.lock:
+			self.nmisses+= 1
+
+		return None, None
+
+	#==============================
+	#     ADD CUTOUT
+	#==============================
+	def add(self,tile,ra,dec,cutout_size,data,header):
+		""" Add cutout of size cutout_size (deg) around (ra,dec) extracted from tile, dropping least recently used cutouts above max size """
+
+		nbytes= data.nbytes
+		if nbytes>self.max_size:
+			return
+
+		key= (tile,ra,dec,cutout_size)
+		entry= {
+			'center': SkyCoord(ra=ra,dec=dec,unit='deg',frame='fk5'),
+			'size': cutout_size,
+			'data': data,
+			'header': header,
+		}
+
+		with self.lock:
+			if key in self.entries:
+				self.size-= self.entries.pop(key)['data'].nbytes
+			self.entries[key]= entry
+			self.size+= nbytes
+			while self.size>self.max_size:
+				key_old, entry_old= self.entries.popitem(last=False)
+				self.size-= entry_old['data'].nbytes
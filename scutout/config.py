@@ -9,6 +9,8 @@ import sys
 import string
 import logging
 import io
+import json
+import hashlib
 
 ## CONFIG PARSER MODULES
 try:
@@ -61,6 +63,33 @@ class Config(object):
 		# - Run options		
 		self.workdir= os.getcwd()
 		self.keep_tmpfiles= True
+		self.nworkers= 1
+		self.max_chunk_size= 10
+		self.nthreads= 1
+		self.queue_lease_timeout= 600 # in seconds
+		self.queue_max_attempts= 3
+		self.pipeline_queue_size= 2
+		self.max_memory= 0 # in MB
+		self.source_order= 'input'
+		self.source_timeout= 0 # in seconds
+		self.stage_timeout= 0 # in seconds
+		self.timeout_fallback_mode= ''
+		self.cache_dir= ''
+		self.cache_max_size= 0 # in MB
+		self.raw_cutout_cache_size= 0 # in MB
+		self.coalesce_tolerance= 0 # in arcsec
+		self.coalesce_radius_tolerance= 0.01 # relative
+		self.cluster_sources= False
+		self.cluster_max_size= 3600 # in arcsec
+		self.stage_cache_dir= ''
+		self.stage_cache_max_size= 0 # in MB
+		self.output_format= 'fits'
+		self.output_file= 'cutouts.h5'
+		self.scratch_dir= ''
+
+		# - Processing variants (configs of [CUTOUT_SEARCH:<name>] sections)
+		self.variants= []
+		self.variant_name= ''
 		
 		# - Cutout search
 		self.surveys= []
@@ -74,12 +103,15 @@ class Config(object):
 		self.convolve= True
 		self.crop_mode= 'none'
 		self.crop_size= 200 # in pixels
+		self.data_type= 'float32'
 
 		# - Background calculation
 		self.bkg_estimator= 'sigmaclip'
 		self.bkg_inner_radius_factor= 1.1
 		self.bkg_outer_radius_factor= 1.2
 		self.bkg_max_nan_thr= 0.1
+		self.bkg_mode= 'annulus'
+		self.bkg_mesh_size= 64 # in pixels
 
 
 		# - FIRST survey options
@@ -456,6 +488,51 @@ class Config(object):
 
 		return 0
 
+	#==============================
+	#     SET PROCESSING VARIANTS
+	#==============================
+	def __set_variants(self):
+		""" Create a config per processing variant section [CUTOUT_SEARCH:<name>] (and optional [BKG_SUBTRACTION:<name>]), overriding the options of the base sections. Variant outputs are written in <workdir>/<name>.
+		    If variants are defined, the base sections only provide the default options of the variants (no outputs are produced with the base options, unless an empty variant section is given).
+		"""
+
+		variant_sections= ['CUTOUT_SEARCH','BKG_SUBTRACTION']
+		base_sections= [section for section in self.parser.sections() if ':' not in section]
+
+		self.variants= []
+		for section in self.parser.sections():
+			if not section.startswith('CUTOUT_SEARCH:'):
+				continue
+			name= section.split(':',1)[1].strip()
+			if not name or name in [variant.variant_name for variant in self.variants] or os.sep in name:
+				logger.error("Invalid or duplicated variant name given in section [%s]!" % (section))
+				return -1
+
+			# - Copy base sections and override them with variant sections
+			variant= Config()
+			for base_section in base_sections:
+				variant.parser.add_section(base_section)
+				for option, value in self.parser.items(base_section,raw=True):
+					variant.parser.set(base_section,option,value)
+			for variant_section in variant_sections:
+				section_name= variant_section + ':' + name
+				if not self.parser.has_section(section_name):
+					continue
+				if not variant.parser.has_section(variant_section):
+					variant.parser.add_section(variant_section)
+				for option, value in self.parser.items(section_name,raw=True):
+					variant.parser.set(variant_section,option,value)
+
+			variant.__set_options()
+			variant.variant_name= name
+			variant.workdir= os.path.join(os.path.abspath(self.workdir),name)
+			self.variants.append(variant)
+
+		if self.variants:
+			logger.info("Found %d processing variants: %s" % (len(self.variants),','.join([variant.variant_name for variant in self.variants])))
+
+		return 0
+
 	#==============================
 	#     PARSE CONFIG FILE
 	#==============================
@@ -470,6 +547,119 @@ class Config(object):
 		
 		if self.parser.has_option('RUN', 'keep_tmpfiles'):
 			self.keep_tmpfiles= self.parser.getboolean('RUN', 'keep_tmpfiles')		
+
+		if self.parser.has_option('RUN', 'nworkers'):
+			option_value= self.parser.get('RUN', 'nworkers')	
+			if option_value:
+				self.nworkers= int(option_value)
+
+		if self.parser.has_option('RUN', 'max_chunk_size'):
+			option_value= self.parser.get('RUN', 'max_chunk_size')	
+			if option_value:
+				self.max_chunk_size= int(option_value)
+
+		if self.parser.has_option('RUN', 'nthreads'):
+			option_value= self.parser.get('RUN', 'nthreads')	
+			if option_value:
+				self.nthreads= int(option_value)
+
+		if self.parser.has_option('RUN', 'queue_lease_timeout'):
+			option_value= self.parser.get('RUN', 'queue_lease_timeout')	
+			if option_value:
+				self.queue_lease_timeout= float(option_value)
+
+		if self.parser.has_option('RUN', 'queue_max_attempts'):
+			option_value= self.parser.get('RUN', 'queue_max_attempts')	
+			if option_value:
+				self.queue_max_attempts= int(option_value)
+
+		if self.parser.has_option('RUN', 'pipeline_queue_size'):
+			option_value= self.parser.get('RUN', 'pipeline_queue_size')	
+			if option_value:
+				self.pipeline_queue_size= int(option_value)
+
+		if self.parser.has_option('RUN', 'max_memory'):
+			option_value= self.parser.get('RUN', 'max_memory')	
+			if option_value:
+				self.max_memory= float(option_value)
+
+		if self.parser.has_option('RUN', 'source_order'):
+			option_value= self.parser.get('RUN', 'source_order')	
+			if option_value:
+				self.source_order= option_value
+
+		if self.parser.has_option('RUN', 'source_timeout'):
+			option_value= self.parser.get('RUN', 'source_timeout')	
+			if option_value:
+				self.source_timeout= float(option_value)
+
+		if self.parser.has_option('RUN', 'stage_timeout'):
+			option_value= self.parser.get('RUN', 'stage_timeout')	
+			if option_value:
+				self.stage_timeout= float(option_value)
+
+		if self.parser.has_option('RUN', 'timeout_fallback_mode'):
+			option_value= self.parser.get('RUN', 'timeout_fallback_mode')	
+			if option_value:
+				self.timeout_fallback_mode= option_value
+
+		if self.parser.has_option('RUN', 'cache_dir'):
+			option_value= self.parser.get('RUN', 'cache_dir')	
+			if option_value:
+				self.cache_dir= option_value
+
+		if self.parser.has_option('RUN', 'cache_max_size'):
+			option_value= self.parser.get('RUN', 'cache_max_size')	
+			if option_value:
+				self.cache_max_size= float(option_value)
+
+		if self.parser.has_option('RUN', 'raw_cutout_cache_size'):
+			option_value= self.parser.get('RUN', 'raw_cutout_cache_size')	
+			if option_value:
+				self.raw_cutout_cache_size= float(option_value)
+
+		if self.parser.has_option('RUN', 'coalesce_tolerance'):
+			option_value= self.parser.get('RUN', 'coalesce_tolerance')	
+			if option_value:
+				self.coalesce_tolerance= float(option_value)
+
+		if self.parser.has_option('RUN', 'coalesce_radius_tolerance'):
+			option_value= self.parser.get('RUN', 'coalesce_radius_tolerance')	
+			if option_value:
+				self.coalesce_radius_tolerance= float(option_value)
+
+		if self.parser.has_option('RUN', 'cluster_sources'):
+			self.cluster_sources= self.parser.getboolean('RUN', 'cluster_sources')
+
+		if self.parser.has_option('RUN', 'cluster_max_size'):
+			option_value= self.parser.get('RUN', 'cluster_max_size')	
+			if option_value:
+				self.cluster_max_size= float(option_value)
+
+		if self.parser.has_option('RUN', 'stage_cache_dir'):
+			option_value= self.parser.get('RUN', 'stage_cache_dir')	
+			if option_value:
+				self.stage_cache_dir= option_value
+
+		if self.parser.has_option('RUN', 'stage_cache_max_size'):
+			option_value= self.parser.get('RUN', 'stage_cache_max_size')	
+			if option_value:
+				self.stage_cache_max_size= float(option_value)
+
+		if self.parser.has_option('RUN', 'output_format'):
+			option_value= self.parser.get('RUN', 'output_format')	
+			if option_value:
+				self.output_format= option_value
+
+		if self.parser.has_option('RUN', 'output_file'):
+			option_value= self.parser.get('RUN', 'output_file')	
+			if option_value:
+				self.output_file= option_value
+
+		if self.parser.has_option('RUN', 'scratch_dir'):
+			option_value= self.parser.get('RUN', 'scratch_dir')	
+			if option_value:
+				self.scratch_dir= option_value
 		#if self.parser.has_option('RUN', 'keep_inputs'):
 		#	self.keep_inputs= self.parser.getboolean('RUN', 'keep_inputs')
 		#if self.parser.has_option('RUN', 'keep_tmpcutouts'):
@@ -521,6 +711,11 @@ class Config(object):
 			if option_value:
 				self.crop_size= float(option_value)
 
+		if self.parser.has_option('CUTOUT_SEARCH', 'data_type'):
+			option_value= self.parser.get('CUTOUT_SEARCH', 'data_type')
+			if option_value:
+				self.data_type= option_value
+
 		# - Parse background options
 		if self.parser.has_option('BKG_SUBTRACTION', 'bkg_estimator'):
 			option_value= self.parser.get('BKG_SUBTRACTION', 'bkg_estimator')	
@@ -542,6 +737,16 @@ class Config(object):
 			if option_value:
 				self.bkg_max_nan_thr= float(option_value)
 
+		if self.parser.has_option('BKG_SUBTRACTION', 'bkg_mode'):
+			option_value= self.parser.get('BKG_SUBTRACTION', 'bkg_mode')	
+			if option_value:
+				self.bkg_mode= option_value
+
+		if self.parser.has_option('BKG_SUBTRACTION', 'bkg_mesh_size'):
+			option_value= self.parser.get('BKG_SUBTRACTION', 'bkg_mesh_size')	
+			if option_value:
+				self.bkg_mesh_size= int(option_value)
+
 
 		# - Parse FIRST DATA section options
 		if self.parser.has_option('FIRST_DATA', 'metadata'):
@@ -949,6 +1154,13 @@ class Config(object):
 		# ***************************
 		self.__set_options()
 
+		# ***************************
+		# **  SET PROCESSING VARIANTS
+		# ***************************
+		if self.__set_variants()<0:
+			logger.error("Failed to set processing variants!")
+			return -1
+
 		# ***************************
 		# **    VALIDATE CONFIG
 		# ***************************
@@ -984,10 +1196,102 @@ class Config(object):
 				logger.error("Metadata file " + metadata + " is not existing in filesystem!")
 				return -1
 
+		# - Check run options
+		if self.nworkers<=0 or self.max_chunk_size<=0 or self.nthreads<=0:
+			logger.error("Invalid nworkers/max_chunk_size/nthreads given (must be >0)!")
+			return -1
+		if self.queue_lease_timeout<=0 or self.queue_max_attempts<=0:
+			logger.error("Invalid queue_lease_timeout/queue_max_attempts given (must be >0)!")
+			return -1
+		if self.pipeline_queue_size<=0:
+			logger.error("Invalid pipeline_queue_size given (must be >0)!")
+			return -1
+		if self.max_memory<0:
+			logger.error("Invalid max_memory given (must be >=0)!")
+			return -1
+		if self.source_order not in ['input','hilbert']:
+			logger.error("Invalid source order " + self.source_order + " given (valid values are {input,hilbert})!")
+			return -1
+		if self.source_timeout<0 or self.stage_timeout<0:
+			logger.error("Invalid source_timeout/stage_timeout given (must be >=0)!")
+			return -1
+		if self.timeout_fallback_mode not in ['','first','best']:
+			logger.error("Invalid timeout fallback mode " + self.timeout_fallback_mode + " given (valid values are {first,best} or empty)!")
+			return -1
+		if self.cache_max_size<0 or self.raw_cutout_cache_size<0 or self.stage_cache_max_size<0:
+			logger.error("Invalid cache_max_size/raw_cutout_cache_size/stage_cache_max_size given (must be >=0)!")
+			return -1
+		if self.output_format not in ['fits','hdf5']:
+			logger.error("Invalid output format " + self.output_format + " given (valid values are {fits,hdf5})!")
+			return -1
+		if self.coalesce_tolerance<0:
+			logger.error("Invalid coalesce_tolerance given (must be >=0)!")
+			return -1
+		if self.coalesce_radius_tolerance<0:
+			logger.error("Invalid coalesce_radius_tolerance given (must be >=0)!")
+			return -1
+		if self.cluster_max_size<=0:
+			logger.error("Invalid cluster_max_size given (must be >0)!")
+			return -1
+
+		# - Check bkg options
+		if self.bkg_mode not in ['annulus','mesh']:
+			logger.error("Invalid bkg mode " + self.bkg_mode + " given (valid values are {annulus,mesh})!")
+			return -1
+		if self.bkg_mesh_size<=0:
+			logger.error("Invalid bkg mesh size given (must be >0)!")
+			return -1
+
+		# - Check processing data type
+		if self.data_type not in ['float32','float64']:
+			logger.error("Invalid data type " + self.data_type + " given (valid values are {float32,float64})!")
+			return -1
+
+		# - Check processing variants
+		for variant in self.variants:
+			if variant.validate()<0:
+				logger.error("Invalid options given for processing variant " + variant.variant_name + "!")
+				return -1
+
 		# ...
 		
 		return 0
 
+	#==============================
+	#     GET PROCESSING OPTIONS
+	#==============================
+	def get_processing_options(self):
+		""" Return dictionary with options affecting the produced cutouts (run/execution options and parser excluded) """
+
+		run_options= ['parser','config','workdir','keep_tmpfiles','keep_inputs','keep_tmpcutouts','nworkers','max_chunk_size','nthreads','queue_lease_timeout','queue_max_attempts','pipeline_queue_size','max_memory','source_order','source_timeout','stage_timeout','timeout_fallback_mode','cache_dir','cache_max_size','raw_cutout_cache_size','coalesce_tolerance','coalesce_radius_tolerance','stage_cache_dir','stage_cache_max_size','output_format','output_file','scratch_dir','variants','variant_name']
+
+		options= {}
+		for key, value in vars(self).items():
+			if key in run_options or key.startswith('_'):
+				continue
+			options[key]= value
+
+		# - Cluster members are cropped from super-cutouts (bkg subtracted after regrid, cutout size crop if crop is disabled), so their
+		#   cutouts differ from single-source ones. Cluster options are kept only if clustering is enabled, leaving unclustered hashes unchanged.
+		if not self.cluster_sources:
+			options.pop('cluster_sources',None)
+			options.pop('cluster_max_size',None)
+
+		# - Keep only the options of searched surveys
+		options['survey_options']= {survey: self.survey_options[survey] for survey in self.surveys if survey in self.survey_options}
+
+		# - Add the options of processing variants (which define the produced cutouts)
+		if self.variants:
+			options['variants']= {variant.variant_name: variant.get_processing_options() for variant in self.variants}
+
+		return options
+
+	def get_hash(self):
+		""" Return hash of processing options, used to check that different runs/shards are compatible """
+		options= self.get_processing_options()
+		options_str= json.dumps(options,sort_keys=True,default=str)
+		return hashlib.sha1(options_str.encode('utf-8')).hexdigest()
+
 	#==============================
 	#     PRINT OPTIONS
 	#==============================
@@ -12,6 +12,19 @@ import numpy as np
 import errno
 import fnmatch
 import shutil
+import time
+import socket
+import asyncio
+import signal
+import copy
+import json
+import hashlib
+import sqlite3
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import cv2 as cv
 import enlighten
 
@@ -24,15 +37,400 @@ from astropy.convolution import Gaussian2DKernel, convolve
 import montage_wrapper as montage
 import radio_beam
 
+## MPI MODULES (optional)
+try:
+	from mpi4py import MPI
+	has_mpi= True
+except ImportError:
+	has_mpi= False
+
 ## GRAPHICS MODULES
 #import matplotlib.pyplot as plt
 
 ## MODULES
 from scutout import logger
 from scutout.utils import Utils
+from scutout.manifest import Manifest
+from scutout.work_queue import WorkQueue
+from scutout.cache import CutoutCache, RawCutoutCache
+from scutout.hdf5_store import Hdf5CutoutStore
 
 logger = logging.getLogger(__name__)
 
+MPI_TAG_WORK= 1
+MPI_TAG_RESULT= 2
+MPI_TAG_STOP= 3
+
+# - Raw cutouts extracted in this process (created on first use)
+raw_cutout_cache= None
+
+
+##############################
+##     WORKER FUNCTIONS
+##############################
+def get_raw_cutout_cache(config):
+	""" Return raw cutout cache of this process, or None if disabled """
+	global raw_cutout_cache
+	if config.raw_cutout_cache_size<=0:
+		return None
+	if raw_cutout_cache is None:
+		raw_cutout_cache= RawCutoutCache(config.raw_cutout_cache_size*1024*1024)
+	return raw_cutout_cache
+
+
+def get_source_radius(config,radius):
+	""" Return source radius (arcsec) used for cutouts, given the radius read from input table """
+	if radius<=0 or config.use_same_radius:
+		return config.source_radius
+	return radius
+
+
+def get_output_store(config):
+	""" Return HDF5 store of final cutouts (file relative to work dir), or None if cutouts are written as FITS files """
+	if config.output_format!='hdf5':
+		return None
+	return Hdf5CutoutStore(os.path.join(os.path.abspath(config.workdir),config.output_file))
+
+
+def get_scratch_dir(config):
+	""" Return scratch dir of the run (in scratch_dir, by default the node tmp dir), holding the source work dirs in HDF5 output mode.
+	    The dir name is derived from the work dir, so that all processes of a run on a node use the same dir.
+	"""
+	scratch_root= config.scratch_dir if config.scratch_dir else tempfile.gettempdir()
+	run_id= hashlib.sha1(os.path.abspath(config.workdir).encode('utf-8')).hexdigest()[:12]
+	return os.path.join(os.path.abspath(scratch_root),'scutout_' + run_id)
+
+
+def remove_scratch_dir(config,obj_name):
+	""" Remove the scratch work dir of a source (and of its processing variants) in HDF5 output mode, and the run scratch dir once empty """
+
+	for variant in [config] + list(config.variants):
+		if variant.output_format!='hdf5':
+			continue
+		scratch_dir= get_scratch_dir(variant)
+		shutil.rmtree(os.path.join(scratch_dir,obj_name),ignore_errors=True)
+		try:
+			os.rmdir(scratch_dir)
+		except OSError: # other sources still running
+			pass
+
+
+def get_output_sizes(outputs):
+	""" Return size in bytes of output files, or of the stored data for outputs in HDF5 files (-1 for missing outputs) """
+
+	sizes= [-1]*len(outputs)
+	store_outputs= {}
+	for index, output in enumerate(outputs):
+		store_output= Hdf5CutoutStore.split_output_name(output)
+		if store_output is None:
+			try:
+				sizes[index]= os.path.getsize(output)
+			except OSError:
+				pass
+		else:
+			store_outputs.setdefault(store_output[0],[]).append((index,store_output[1],store_output[2]))
+
+	# - Open each HDF5 file once
+	for filename, items in store_outputs.items():
+		store_sizes= Hdf5CutoutStore(filename).get_sizes([(obj_name,survey) for index, obj_name, survey in items])
+		for item, size in zip(items,store_sizes):
+			sizes[item[0]]= size
+
+	return sizes
+
+
+def make_source_result(source,status='done',errmsg=''):
+	""" Return result dictionary for given source (ra,dec,obj_name,radius) """
+	ra, dec, obj_name, radius= source
+	return {'obj_name': obj_name, 'ra': ra, 'dec': dec, 'status': status, 'errmsg': errmsg, 'elapsed': 0., 'outputs': [], 'output_sizes': [], 'tiles': [], 'cached': False, 'tile_reads_saved': 0, 'coalesced_with': '', 'cluster': '', 'reused_stages': []}
+
+
+def process_source(config,source):
+	""" Extract cutouts for a single source (ra,dec,obj_name,radius) and return a result dictionary.
+	    If source or stage timeouts are configured, the source is processed in a watched child process.
+	"""
+
+	if config.source_timeout>0 or config.stage_timeout>0:
+		return process_source_watched(config,source)
+
+	return run_source(config,source)
+
+
+def run_source(config,source,stage_callback=None):
+	""" Extract cutouts for a single source in this process and return a result dictionary.
+	    If processing variants are configured, the source is processed with each variant in turn, the stages they have in common
+	    (e.g. raw cutout extraction) being run once and taken from the stage cache by the next variants.
+	"""
+
+	ra, dec, obj_name, radius= source
+	result= make_source_result(source)
+	t0= time.time()
+	
+	logger.info("Searching cutout for source %s (%f,%f) ..." % (obj_name,ra,dec))
+
+	# - Without a stage cache dir, variants share stage products through a source stage cache removed when done
+	configs= [config]
+	stage_cache_dir= ''
+	if config.variants:
+		configs= config.variants
+		if not config.stage_cache_dir:
+			stage_cache_dir= os.path.join(os.path.abspath(config.workdir),'stage_cache',obj_name)
+			configs= [copy.copy(variant) for variant in config.variants]
+			for variant in configs:
+				variant.stage_cache_dir= stage_cache_dir
+			
+	try:
+		for index, variant in enumerate(configs):
+			if variant.variant_name:
+				logger.info("Processing variant %s of source %s ..." % (variant.variant_name,obj_name))
+			cs= CutoutHelper(variant,ra,dec,obj_name,radius)
+			cs.stage_callback= stage_callback
+			status= cs.run()
+			if index==0:
+				result['tiles']= cs.get_tile_files()
+				result['cached']= cs.cache_hit
+			else:
+				result['cached']= result['cached'] and cs.cache_hit
+			result['tile_reads_saved']+= cs.tile_reads_saved
+			result['reused_stages'].extend([stage for stage in cs.reused_stages if stage not in result['reused_stages']])
+			if status<0:
+				errmsg= 'Failed to extract cutout for source ' + obj_name + ', skip to next...'
+				logger.warn(errmsg)
+				result['status']= 'failed'
+				result['errmsg']= 'Cutout extraction failed'
+				if variant.variant_name:
+					result['errmsg']+= ' (variant ' + variant.variant_name + ')'
+				break
+			result['outputs'].extend(cs.output_files)
+
+		if result['status']=='done':
+			result['output_sizes']= get_output_sizes(result['outputs'])
+		else:
+			result['outputs']= []
+
+	except Exception as e:
+		#logger.error('Unknown error in source {0}. Trace: {1}'.format(obj_name, e.message))
+		logger.error('Unknown error in source {0}. Trace: {1}'.format(obj_name, str(e)))
+		result['status']= 'failed'
+		result['errmsg']= str(e)
+		result['outputs']= []
+
+	if stage_cache_dir:
+		shutil.rmtree(stage_cache_dir,ignore_errors=True)
+		try:
+			os.rmdir(os.path.dirname(stage_cache_dir))
+		except OSError: # other sources still running
+			pass
+
+	# - Remove scratch work dirs left by failed sources
+	remove_scratch_dir(config,obj_name)
+
+	result['elapsed']= time.time()-t0
+
+	return result
+
+
+def run_source_child(config,source,conn):
+	""" Entry point of watched child process: run source in a new process group (including Montage subprocesses), sending stages and result to the parent """
+
+	os.setpgrp()
+
+	def stage_callback(stage):
+		conn.send(('stage',stage))
+
+	result= run_source(config,source,stage_callback)
+	conn.send(('result',result))
+	conn.close()
+
+
+def run_source_watched(config,source):
+	""" Run source in a child process, killing its process group if the source or current stage exceed their wall-clock limits """
+
+	parent_conn, child_conn= multiprocessing.Pipe(duplex=False)
+	process= multiprocessing.Process(target=run_source_child,args=(config,source,child_conn))
+	t0= time.time()
+	process.start()
+	child_conn.close()
+
+	stage= 'init'
+	stage_t0= t0
+	result= None
+
+	while True:
+		# - Wait for a message from child until the closest deadline
+		now= time.time()
+		deadlines= []
+		if config.source_timeout>0:
+			deadlines.append(t0+config.source_timeout)
+		if config.stage_timeout>0:
+			deadlines.append(stage_t0+config.stage_timeout)
+		
+		if parent_conn.poll(max(min(deadlines)-now,0.)):
+			try:
+				msg, value= parent_conn.recv()
+			except EOFError: # child exited without sending result
+				break
+			if msg=='stage':
+				stage= value
+				stage_t0= time.time()
+				continue
+			result= value
+			break
+
+		# - Deadline reached: kill child process group
+		errmsg= 'Timeout in stage %s after %.1f s' % (stage,time.time()-t0)
+		logger.warn("Source %s: %s, killing its processes ..." % (source[2],errmsg))
+		try:
+			os.killpg(process.pid,signal.SIGKILL)
+		except OSError: # child did not set its process group yet
+			process.kill()
+		result= make_source_result(source,'timeout',errmsg)
+		remove_scratch_dir(config,source[2])
+		break
+
+	process.join()
+	parent_conn.close()
+
+	if result is None:
+		result= make_source_result(source,'failed','Source process exited with code %s' % (str(process.exitcode)))
+	result['elapsed']= time.time()-t0
+
+	return result
+
+
+def process_source_watched(config,source):
+	""" Process source with a watchdog, retrying timed out sources with the fallback multi input image mode (if configured) """
+
+	result= run_source_watched(config,source)
+
+	fallback_mode= config.timeout_fallback_mode
+	if result['status']=='timeout' and fallback_mode and fallback_mode!=config.multi_input_img_mode:
+		logger.info("Retrying timed out source %s with multi input image mode %s ..." % (source[2],fallback_mode))
+		fallback_config= copy.copy(config)
+		fallback_config.multi_input_img_mode= fallback_mode
+		fallback_config.variants= [copy.copy(variant) for variant in config.variants]
+		for variant in fallback_config.variants:
+			variant.multi_input_img_mode= fallback_mode
+		fallback_result= run_source_watched(fallback_config,source)
+		fallback_result['elapsed']+= result['elapsed']
+		fallback_result['errmsg']= (fallback_result['errmsg'] + ' ' if fallback_result['errmsg'] else '') + '(retried with %s mode after: %s)' % (fallback_mode,result['errmsg'])
+		result= fallback_result
+
+	return result
+
+
+def process_sources(config,sources):
+	""" Extract cutouts for a chunk of sources and return the list of result dictionaries """
+	return [process_source(config,source) for source in sources]
+
+
+def process_cluster(config,cluster):
+	""" Extract super-cutouts covering a cluster of sources (name,sources) and crop the cutouts of each source from them.
+	    Return the list of source results. Sources are processed individually if the cluster processing fails.
+	"""
+
+	name, sources= cluster
+	t0= time.time()
+
+	logger.info("Processing cluster %s of %d sources with super-cutouts ..." % (name,len(sources)))
+
+	try:
+		helper= CutoutHelper(config,sources[0][0],sources[0][1],name,_members=sources)
+		status= helper.run()
+	except Exception as e:
+		logger.error('Unknown error in cluster {0}. Trace: {1}'.format(name, str(e)))
+		status= -1
+
+	if status<0:
+		logger.warn("Super-cutout processing of cluster %s failed, processing its %d sources individually ..." % (name,len(sources)))
+		return [process_source(config,source) for source in sources]
+
+	elapsed= (time.time()-t0)/len(sources)
+	results= []
+	for source in sources:
+		obj_name= source[2]
+		if obj_name in helper.member_errors:
+			logger.warn("Failed to crop cutouts of source %s from super-cutouts of cluster %s (err=%s), processing it individually ..." % (obj_name,name,helper.member_errors[obj_name]))
+			results.append(process_source(config,source))
+			continue
+
+		result= make_source_result(source)
+		result['cluster']= name
+		result['tiles']= helper.get_tile_files()
+		result['outputs']= helper.member_outputs[obj_name]
+		result['output_sizes']= get_output_sizes(result['outputs'])
+		result['tile_reads_saved']= helper.tile_reads_saved
+		result['elapsed']= elapsed
+		results.append(result)
+
+	return results
+
+
+def extract_source(config,source):
+	""" Pipeline stage: extract raw cutouts of a source. Return (helper,result), with helper set to None if extraction failed. """
+
+	ra, dec, obj_name, radius= source
+	result= make_source_result(source)
+	helper= None
+
+	logger.info("Searching cutout for source %s (%f,%f) ..." % (obj_name,ra,dec))
+
+	try:
+		helper= CutoutHelper(config,ra,dec,obj_name,radius)
+		status= helper.extract()
+		result['tiles']= helper.get_tile_files()
+		result['cached']= helper.cache_hit
+		result['tile_reads_saved']= helper.tile_reads_saved
+		if status<0:
+			logger.warn('Failed to extract raw cutouts for source ' + obj_name + ', skip to next...')
+			result['status']= 'failed'
+			result['errmsg']= 'Raw cutout extraction failed'
+			helper= None
+	except Exception as e:
+		logger.error('Unknown error in source {0}. Trace: {1}'.format(obj_name, str(e)))
+		result['status']= 'failed'
+		result['errmsg']= str(e)
+		helper= None
+
+	if helper is None:
+		remove_scratch_dir(config,obj_name)
+
+	return helper, result
+
+
+def process_source_cutouts(config,source,state):
+	""" Pipeline stage: process raw cutouts of a source (run in worker processes).
+	    Only the process phase state of the helper (file paths, stage cache keys) is exchanged with the worker, which rebuilds the helper from config and source.
+	    Return (status,errmsg,state) with the updated state.
+	"""
+
+	ra, dec, obj_name, radius= source
+
+	try:
+		helper= CutoutHelper(config,ra,dec,obj_name,radius)
+		helper.set_process_state(state)
+		if helper.process()<0:
+			logger.warn('Failed to process cutouts for source ' + obj_name + ', skip to next...')
+			return -1, 'Cutout processing failed', None
+	except Exception as e:
+		logger.error('Unknown error in source {0}. Trace: {1}'.format(obj_name, str(e)))
+		return -1, str(e), None
+
+	return 0, '', helper.get_process_state()
+
+
+def finalize_source(helper):
+	""" Pipeline stage: write final cutouts of a source. Return (status,errmsg). """
+
+	try:
+		if helper.finalize()<0:
+			return -1, 'Cutout writing failed'
+	except Exception as e:
+		logger.error('Unknown error in source {0}. Trace: {1}'.format(helper.sname, str(e)))
+		return -1, str(e)
+
+	return 0, ''
+
 
 ###########################
 ##     CLASS DEFINITIONS
@@ -40,13 +438,39 @@ logger = logging.getLogger(__name__)
 class CutoutFinder(object):
 	""" Class to extract source cutout from object list file """
 
-	def __init__(self,_filename,_config):
-		""" Return a cutout finder object """
+	def __init__(self,_filename,_config,shard=None,manifest_file='',queue_file='',use_mpi=False,use_pipeline=False,resume=False):
+		""" Return a cutout finder object. If a shard (index,nshards) is given only the sources in that sky shard are processed.
+		    If a queue file is given, sources are added to a shared SQLite work queue and leased from it.
+		    If use_mpi is enabled, rank 0 reads the sources and distributes them to the other ranks.
+		    If use_pipeline is enabled, extraction, processing and writing of different sources are overlapped.
+		    If resume is enabled, sources completed in a previous run with the same config (from run manifest) are skipped.
+		"""
 
 		self.filename= _filename
 		self.config= _config
+		self.shard= shard
+		self.manifest_file= manifest_file
+		self.manifest= None
+		self.queue_file= queue_file
+		self.queue= None
+		self.queue_owner= '%s:%d' % (socket.gethostname(),os.getpid())
+		self.use_mpi= use_mpi
+		self.use_pipeline= use_pipeline
+		self.resume= resume
+		self.comm= None
+		self.rank= 0
+		self.nranks= 1
+		if self.use_mpi:
+			self.comm= MPI.COMM_WORLD
+			self.rank= self.comm.Get_rank()
+			self.nranks= self.comm.Get_size()
 		self.table= None
 		self.table_size= 0
+		self.sources= []
+		self.input_names= []
+		self.source_groups= {}
+		self.clusters= []
+		self.results= []
 	
 	#==============================
 	#     READ INPUT FILE TABLE
@@ -70,53 +494,812 @@ class CutoutFinder(object):
 		print(self.table)
 		print(self.table.colnames)
 
+		# - Set source list (ra,dec,obj_name,radius)
+		has_radius_col= 'RADIUS' in self.table.colnames
+		self.sources= []
+
+		for item in self.table:	
+			radius= -1
+			if has_radius_col:
+				radius= float(item['RADIUS'])
+			self.sources.append( (float(item['RA']),float(item['DEC']),str(item['OBJNAME']),radius) )
+
+		self.input_names= [source[2] for source in self.sources]
+
+		# - Select sources in given sky shard
+		if self.shard is not None:
+			shard_index, nshards= self.shard
+			ra= [source[0] for source in self.sources]
+			dec= [source[1] for source in self.sources]
+			shard_indices= Utils.getSkyShardIndices(ra,dec,nshards)
+			self.sources= [source for source, index in zip(self.sources,shard_indices) if index==shard_index]
+			logger.info("Selected %d/%d sources in sky shard %d/%d ..." % (len(self.sources),self.table_size,shard_index,nshards))
+
+		# - Reorder sources along a Hilbert curve on the sky, so that consecutive sources fall on the same survey tiles
+		if self.config.source_order=='hilbert' and self.sources:
+			logger.info("Sorting sources along a Hilbert curve on the sky ...")
+			ra= [source[0] for source in self.sources]
+			dec= [source[1] for source in self.sources]
+			sort_indices= np.argsort(Utils.getHilbertIndex(ra,dec),kind='stable')
+			self.sources= [self.sources[index] for index in sort_indices]
+
+		return 0
+
+	#==============================
+	#     SKIP COMPLETED SOURCES
+	#==============================
+	def __skip_completed_sources(self):
+		""" Remove from source list the sources completed in a previous run with the same config, whose outputs still exist with the recorded sizes.
+		    Return True if the previous manifest can be extended.
+		"""
+
+		manifest_file= self.__get_manifest_file()
+		if not os.path.isfile(manifest_file):
+			logger.info("No previous run manifest %s found, processing all sources ..." % (manifest_file))
+			return False
+
+		manifest= Manifest(manifest_file)
+		if manifest.read()<0:
+			logger.warn("Failed to read previous run manifest %s, processing all sources ..." % (manifest_file))
+			return False
+
+		if manifest.header.get('config_hash')!=self.config.get_hash():
+			logger.warn("Previous run manifest %s was produced with different config options, processing all sources ..." % (manifest_file))
+			return False
+
+		completed= manifest.get_completed()
+
+		# - Get current output sizes at once (HDF5 output files are opened only once)
+		outputs= [output for record in completed.values() for output in record['outputs']]
+		output_sizes= dict(zip(outputs,get_output_sizes(outputs)))
+
+		def is_completed(obj_name):
+			record= completed.get(obj_name)
+			if record is None:
+				return False
+			sizes= record.get('output_sizes',[])
+			if len(sizes)!=len(record['outputs']):
+				return False
+			for output, size in zip(record['outputs'],sizes):
+				if output_sizes[output]!=size:
+					return False
+			return True
+
+		nsources= len(self.sources)
+		self.sources= [source for source in self.sources if not is_completed(source[2])]
+		logger.info("Skipping %d sources already completed in previous run (%d sources left to be processed) ..." % (nsources-len(self.sources),len(self.sources)))
+
+		return True
+
+	#==============================
+	#     COALESCE SOURCES
+	#==============================
+	def __coalesce_sources(self):
+		""" Group sources lying within the coalesce tolerance of a leader source and with the same cutout radius (within the relative radius tolerance).
+		    Only group leaders are processed, their outputs being then linked to the other group members.
+		"""
+
+		tolerance= self.config.coalesce_tolerance # in arcsec
+		ra= [source[0] for source in self.sources]
+		dec= [source[1] for source in self.sources]
+		radii= [get_source_radius(self.config,source[3]) for source in self.sources]
+
+		leaders= Utils.getPositionGroups(ra,dec,tolerance/3600.,radii,self.config.coalesce_radius_tolerance)
+
+		self.source_groups= {}
+		sources= []
+		for source, leader in zip(self.sources,leaders):
+			leader_name= self.sources[leader][2]
+			if leader_name==source[2]:
+				sources.append(source)
+			else:
+				self.source_groups.setdefault(leader_name,[]).append(source)
+
+		nmembers= len(self.sources)-len(sources)
+		self.sources= sources
+		logger.info("Coalesced %d sources within %s arcsec of another source (%d sources left to be processed) ..." % (nmembers,str(tolerance),len(self.sources)))
+
+	#==============================
+	#     CLUSTER SOURCES
+	#==============================
+	def __cluster_sources(self):
+		""" Group sources with overlapping cutouts (friends-of-friends) into clusters processed with shared super-cutouts.
+		    Clusters are kept only if their super-cutout is within the max cluster size and smaller than the summed area of the source cutouts.
+		"""
+
+		ra= [source[0] for source in self.sources]
+		dec= [source[1] for source in self.sources]
+		sizes= np.array([2*get_source_radius(self.config,source[3])*self.config.cutout_factor/3600. for source in self.sources])
+		labels= Utils.getFoFGroups(ra,dec,sizes)
+
+		groups= {}
+		for index, label in enumerate(labels):
+			groups.setdefault(label,[]).append(index)
+
+		self.clusters= []
+		clustered= set()
+		for label in sorted(groups.keys()):
+			indices= groups[label]
+			if len(indices)<2:
+				continue
+			ra_c, dec_c, size= Utils.getClusterFootprint([ra[i] for i in indices],[dec[i] for i in indices],sizes[indices])
+			if size*3600>self.config.cluster_max_size:
+				logger.info("Super-cutout of cluster of %d sources around source %s too large (%.1f arcsec), processing them individually ..." % (len(indices),self.sources[indices[0]][2],size*3600))
+				continue
+			if size**2>=np.sum(sizes[indices]**2):
+				continue
+			self.clusters.append(('cluster_' + self.sources[indices[0]][2],[self.sources[i] for i in indices]))
+			clustered.update(indices)
+
+		self.sources= [source for index, source in enumerate(self.sources) if index not in clustered]
+		logger.info("Grouped %d sources in %d clusters processed with super-cutouts (%d sources processed individually) ..." % (len(clustered),len(self.clusters),len(self.sources)))
+
+	#==============================
+	#     RUN CLUSTERS
+	#==============================
+	def __run_clusters(self,pbar):
+		""" Process source clusters, in a pool of worker processes if more than one worker is configured """
+
+		nworkers= self.config.nworkers
+		logger.info("Processing %d source clusters with %d worker processes ..." % (len(self.clusters),nworkers))
+		if self.config.source_timeout>0 or self.config.stage_timeout>0:
+			logger.warn("Source/stage timeouts are not applied to super-cutouts of clusters!")
+
+		if nworkers<=1:
+			for cluster in self.clusters:
+				self.__add_results(process_cluster(self.config,cluster),pbar)
+			return
+
+		with ProcessPoolExecutor(max_workers=nworkers) as executor:
+			futures= {executor.submit(process_cluster,self.config,cluster): cluster for cluster in self.clusters}
+			for future in as_completed(futures):
+				cluster= futures[future]
+				try:
+					results= future.result()
+				except Exception as e:
+					logger.error("Worker failed while processing cluster %s (err=%s)!" % (cluster[0],str(e)))
+					results= [make_source_result(source,'failed','Worker failure: ' + str(e)) for source in cluster[1]]
+				self.__add_results(results,pbar)
+
+	def __fan_out_result(self,result):
+		""" Return results of the members of the group led by the source of given result, linking leader outputs to member directories """
+
+		leader_name= result['obj_name']
+		member_results= []
+
+		for source in self.source_groups.get(leader_name,[]):
+			member_name= source[2]
+			member_result= make_source_result(source,status=result['status'],errmsg=result['errmsg'])
+			member_result['coalesced_with']= leader_name
+
+			if result['status']=='done':
+				for filename in result['outputs']:
+					# - Link member cutouts to leader ones in HDF5 output files
+					store_output= Hdf5CutoutStore.split_output_name(filename)
+					if store_output is not None:
+						try:
+							output_member= Hdf5CutoutStore(store_output[0]).link(member_name,store_output[2],leader_name,ra=source[0],dec=source[1])
+						except Exception as e:
+							member_result['status']= 'failed'
+							member_result['errmsg']= 'Failed to link outputs of source ' + leader_name + ' (err=' + str(e) + ')'
+							break
+						member_result['outputs'].append(output_member)
+						continue
+
+					# - Outputs are named <source name>_<survey>.fits, in the source dir of the work dir (or of the variant output root)
+					member_dir= os.path.join(os.path.dirname(os.path.dirname(filename)),member_name)
+					Utils.mkdir(member_dir)
+					filename_member= member_name + os.path.basename(filename)[len(leader_name):]
+					filename_member_fullpath= os.path.join(member_dir,filename_member)
+					if Utils.linkOrCopy(filename,filename_member_fullpath)<0:
+						member_result['status']= 'failed'
+						member_result['errmsg']= 'Failed to link outputs of source ' + leader_name
+						break
+					member_result['outputs'].append(filename_member_fullpath)
+
+				if member_result['status']=='done':
+					member_result['output_sizes']= get_output_sizes(member_result['outputs'])
+				else:
+					member_result['outputs']= []
+
+			member_results.append(member_result)
+
+		return member_results
+
+	#==============================
+	#     CREATE MANIFEST
+	#==============================
+	def __get_manifest_file(self):
+		""" Return run manifest path (by default in work dir) """
+
+		manifest_file= self.manifest_file
+		if not manifest_file:
+			manifest_base= 'manifest.jsonl'
+			if self.shard is not None:
+				manifest_base= 'manifest_shard%dof%d.jsonl' % self.shard
+			if self.queue_file:
+				manifest_base= 'manifest_%s.jsonl' % (self.queue_owner.replace(':','_'))
+			manifest_file= os.path.join(os.path.abspath(self.config.workdir),manifest_base)
+
+		return manifest_file
+
+	def __create_manifest(self,append=False):
+		""" Create run manifest, or append to existing one when resuming """
+
+		manifest_file= self.__get_manifest_file()
+		if Utils.mkdir(os.path.dirname(manifest_file))<0:
+			return -1
+
+		logger.info("Writing run manifest to file %s ..." % (manifest_file))
+		self.manifest= Manifest(manifest_file)
+		status= self.manifest.create(
+			self.config.get_hash(),
+			append=append,
+			input=os.path.abspath(self.filename),
+			shard=self.shard,
+			nsources=len(self.sources),
+			options=self.config.get_processing_options()
+		)
+		return status
+
+	#==============================
+	#     ADD SOURCE RESULT
+	#==============================
+	def __add_results(self,results,pbar):
+		""" Store source results (and results of coalesced group members) in manifest and update progress bar """
+		if self.source_groups:
+			results= list(results)
+			for result in list(results):
+				results.extend(self.__fan_out_result(result))
+		self.results.extend(results)
+		for result in results:
+			self.manifest.add(result)
+		pbar.update(len(results))
+
+	#==============================
+	#     RUN SERIAL SEARCH
+	#==============================
+	def __run_serial(self,pbar):
+		""" Process sources one after another in this process """
+
+		for source in self.sources:
+			result= process_source(self.config,source)
+			self.__add_results([result],pbar)
+
+	#==============================
+	#     ESTIMATE SOURCE MEMORY
+	#==============================
+	def __estimate_source_memory(self):
+		""" Return the estimated peak memory (bytes) of each source from survey pixel scales (coverage metadata), cutout size and data type """
+
+		pixscales= []
+		for survey in self.config.surveys:
+			pixscale= Utils.getSurveyPixelScale(self.config.survey_options[survey]['metadata'])
+			if pixscale is None:
+				logger.warn("Pixel scale of survey %s not available, not included in source memory estimate ..." % (survey))
+				continue
+			pixscales.append(pixscale)
+
+		itemsize= np.dtype(self.config.data_type).itemsize
+		source_memory= []
+
+		for ra, dec, obj_name, radius in self.sources:
+			cutout_size= 2*get_source_radius(self.config,radius)*self.config.cutout_factor/3600.
+			source_memory.append(Utils.estimateCutoutMemory(cutout_size,pixscales,self.config.regrid,itemsize))
+
+		return source_memory
+
+	def __get_chunks(self,chunk_size,memory_budget):
+		""" Split sources in chunks of given size, returning (chunk,memory estimate) pairs. Sources exceeding the memory budget are put in their own chunks. """
+
+		if memory_budget<=0:
+			return [(self.sources[index:index+chunk_size],0) for index in range(0,len(self.sources),chunk_size)]
+
+		# - Sources in a chunk are processed sequentially, so the chunk peak memory is the max among sources
+		chunks= []
+		chunk= []
+		chunk_memory= 0
+
+		for source, memory in zip(self.sources,self.__estimate_source_memory()):
+			if memory>memory_budget:
+				logger.warn("Estimated memory of source %s (%.1f MB) exceeds the memory budget, it will be processed alone ..." % (source[2],memory/1024.**2))
+				if chunk:
+					chunks.append((chunk,chunk_memory))
+					chunk, chunk_memory= [], 0
+				chunks.append(([source],memory))
+				continue
+
+			chunk.append(source)
+			chunk_memory= max(chunk_memory,memory)
+			if len(chunk)>=chunk_size:
+				chunks.append((chunk,chunk_memory))
+				chunk, chunk_memory= [], 0
+
+		if chunk:
+			chunks.append((chunk,chunk_memory))
+
+		return chunks
+
+	#==============================
+	#     RUN PARALLEL SEARCH
+	#==============================
+	def __run_parallel(self,pbar):
+		""" Process sources in a pool of worker processes, submitting chunks of sources.
+		    If a memory budget is set, chunks are admitted only while the summed memory estimate of the running chunks stays within the budget.
+		    If a worker process dies (e.g. killed by the OS for running out of memory), the pool is broken: the chunks in progress are
+		    recorded as failed and the next chunks are processed in a new pool.
+		"""
+
+		nworkers= self.config.nworkers
+		nsources= len(self.sources)
+		chunk_size= max(1,min(self.config.max_chunk_size,nsources//(4*nworkers)))
+		max_pending= 2*nworkers
+		memory_budget= self.config.max_memory*1024.**2
+		if memory_budget>0:
+			# - Do not queue chunks in the pool beyond the running ones, so that the admitted memory is actually in use
+			max_pending= nworkers
+			logger.info("Admitting sources within a memory budget of %s MB ..." % (str(self.config.max_memory)))
+
+		chunks= self.__get_chunks(chunk_size,memory_budget)
+		logger.info("Processing %d sources with %d worker processes (chunk size=%d) ..." % (nsources,nworkers,chunk_size))
+
+		pending= {}
+
+		def collect(futures):
+			broken= False
+			for future in futures:
+				chunk, chunk_memory= pending.pop(future)
+				try:
+					results= future.result()
+				except BrokenProcessPool as e:
+					logger.error("Worker process terminated abruptly while processing chunk of %d sources (err=%s)!" % (len(chunk),str(e)))
+					results= [make_source_result(source,'failed','Worker process terminated abruptly (e.g. out of memory)') for source in chunk]
+					broken= True
+				except Exception as e:
+					logger.error("Worker failed while processing chunk of %d sources (err=%s)!" % (len(chunk),str(e)))
+					results= [make_source_result(source,'failed','Worker failure: ' + str(e)) for source in chunk]
+				self.__add_results(results,pbar)
+			return broken
+
+		def restart_pool(executor):
+			# - All chunks in progress fail with the broken pool: record them and start a new pool for the next chunks
+			logger.warn("Worker pool broken, restarting it ...")
+			wait(list(pending.keys()))
+			collect(list(pending.keys()))
+			executor.shutdown(wait=False)
+			return ProcessPoolExecutor(max_workers=nworkers)
+
+		def can_admit(chunk_memory):
+			if len(pending)>=max_pending:
+				return False
+			if memory_budget<=0:
+				return True
+			memory_used= sum([item[1] for item in pending.values()])
+			return memory_used+chunk_memory<=memory_budget
+
+		executor= ProcessPoolExecutor(max_workers=nworkers)
+		try:
+			for chunk, chunk_memory in chunks:
+				# - Wait for running chunks to complete until there is room for the next one (an oversize chunk runs alone)
+				while pending and not can_admit(chunk_memory):
+					done, not_done= wait(list(pending.keys()),return_when=FIRST_COMPLETED)
+					if collect(done):
+						executor= restart_pool(executor)
+
+				try:
+					future= executor.submit(process_sources,self.config,chunk)
+				except BrokenProcessPool:
+					executor= restart_pool(executor)
+					future= executor.submit(process_sources,self.config,chunk)
+				pending[future]= (chunk,chunk_memory)
+
+			done, not_done= wait(list(pending.keys()))
+			collect(done)
+		finally:
+			executor.shutdown()
+
+	#==============================
+	#     RUN PIPELINE SEARCH
+	#==============================
+	def __run_pipeline(self,pbar):
+		""" Process sources in a pipeline of stages connected by bounded queues, so that I/O and computation overlap:
+		    raw cutout extraction (I/O threads) -> bkg subtraction/regrid/convolution/crop (worker processes) -> output writing (I/O threads)
+		"""
+
+		nworkers= self.config.nworkers
+		logger.info("Processing %d sources in pipeline mode with %d workers per stage (queue size=%d) ..." % (len(self.sources),nworkers,self.config.pipeline_queue_size))
+		if self.config.source_timeout>0 or self.config.stage_timeout>0:
+			logger.warn("Source/stage timeouts are not applied in pipeline mode!")
+
+		io_executor= ThreadPoolExecutor(max_workers=2*nworkers)
+		cpu_executor= ProcessPoolExecutor(max_workers=nworkers)
+		nresults= len(self.results)
+		try:
+			asyncio.run(self.__run_pipeline_stages(pbar,io_executor,cpu_executor))
+		finally:
+			io_executor.shutdown()
+			cpu_executor.shutdown()
+
+		# - Sort results (completed out of order by concurrent stages) in source order, keeping coalesced members after their leader
+		source_index= {source[2]: index for index, source in enumerate(self.sources)}
+		self.results[nresults:]= sorted(self.results[nresults:],key=lambda result: source_index.get(result['obj_name'],source_index.get(result['coalesced_with'],len(source_index))))
+
+	async def __run_pipeline_stages(self,pbar,io_executor,cpu_executor):
+		""" Run pipeline stage tasks until all sources are processed """
+
+		loop= asyncio.get_running_loop()
+		nworkers= self.config.nworkers
+		process_queue= asyncio.Queue(maxsize=self.config.pipeline_queue_size)
+		write_queue= asyncio.Queue(maxsize=self.config.pipeline_queue_size)
+		source_iter= iter(self.sources)
+
+		def set_failed(result,errmsg,t0):
+			remove_scratch_dir(self.config,result['obj_name'])
+			result['status']= 'failed'
+			result['errmsg']= errmsg
+			result['elapsed']= time.time()-t0
+			self.__add_results([result],pbar)
+
+		async def read_stage():
+			# - Sources are taken from the shared iterator by all readers
+			for source in source_iter:
+				t0= time.time()
+				try:
+					helper, result= await loop.run_in_executor(io_executor,extract_source,self.config,source)
+				except Exception as e:
+					set_failed(make_source_result(source),str(e),t0)
+					continue
+				if helper is None:
+					result['elapsed']= time.time()-t0
+					self.__add_results([result],pbar)
+					continue
+				await process_queue.put((source,helper,result,t0))
+
+		async def process_stage():
+			while True:
+				item= await process_queue.get()
+				if item is None:
+					break
+				source, helper, result, t0= item
+				try:
+					status, errmsg, state= await loop.run_in_executor(cpu_executor,process_source_cutouts,self.config,source,helper.get_process_state())
+				except Exception as e:
+					status, errmsg= -1, 'Worker failure: ' + str(e)
+				if status<0:
+					set_failed(result,errmsg,t0)
+					continue
+				helper.set_process_state(state)
+				await write_queue.put((helper,result,t0))
+
+		async def write_stage():
+			while True:
+				item= await write_queue.get()
+				if item is None:
+					break
+				helper, result, t0= item
+				status, errmsg= await loop.run_in_executor(io_executor,finalize_source,helper)
+				if status<0:
+					set_failed(result,errmsg,t0)
+					continue
+				result['outputs']= helper.output_files
+				result['output_sizes']= get_output_sizes(helper.output_files)
+				result['reused_stages']= helper.reused_stages
+				result['elapsed']= time.time()-t0
+				self.__add_results([result],pbar)
+
+		# - Start stage tasks and stop each stage once the previous one has completed
+		readers= [asyncio.ensure_future(read_stage()) for i in range(nworkers)]
+		processors= [asyncio.ensure_future(process_stage()) for i in range(nworkers)]
+		writers= [asyncio.ensure_future(write_stage()) for i in range(nworkers)]
+
+		await asyncio.gather(*readers)
+		for task in processors:
+			await process_queue.put(None)
+		await asyncio.gather(*processors)
+		for task in writers:
+			await write_queue.put(None)
+		await asyncio.gather(*writers)
+
+	#==============================
+	#     INIT WORK QUEUE
+	#==============================
+	def __init_queue(self):
+		""" Open work queue and add input sources to it. Return number of unfinished sources in queue. """
+
+		self.queue= WorkQueue(self.queue_file,lease_timeout=self.config.queue_lease_timeout,max_attempts=self.config.queue_max_attempts)
+		if self.queue.open()<0:
+			return -1
+		if self.queue.add_sources(self.sources,self.config.get_hash())<0:
+			return -1
+
+		try:
+			counts= self.queue.get_counts()
+		except sqlite3.OperationalError as e:
+			logger.error("Failed to get work queue status (err=%s)!" % (str(e)))
+			return -1
+
+		return counts.get('pending',0) + counts.get('leased',0)
+
+	#==============================
+	#     RUN QUEUE SEARCH
+	#==============================
+	def __run_queue(self,pbar):
+		""" Lease sources from the work queue and process them in a pool of worker processes until the queue is exhausted """
+
+		nworkers= self.config.nworkers
+		poll_time= min(30.,self.config.queue_lease_timeout/4.)
+		logger.info("Processing sources from work queue %s with %d worker processes (owner=%s) ..." % (self.queue_file,nworkers,self.queue_owner))
+
+		pending= {}
+		leasing= True
+
+		def complete(source_id,source,result):
+			try:
+				self.queue.complete(source_id,self.queue_owner,result)
+			except sqlite3.OperationalError as e:
+				logger.error("Failed to store result of source %s in work queue (err=%s), it will be leased again when its lease expires!" % (source[2],str(e)))
+			self.__add_results([result],pbar)
+
+		# - Queue operations are retried with backoff by the queue itself. If they still fail, stop leasing and finish the sources in progress
+		#   (sources whose results could not be stored are leased again by other processes when their leases expire).
+		#   If a worker process dies the pool is broken: stop leasing and complete the sources in progress as failed.
+		with ProcessPoolExecutor(max_workers=nworkers) as executor:
+			while True:
+				# - Lease new sources for idle workers
+				if leasing and len(pending)<nworkers:
+					try:
+						leased= self.queue.lease(self.queue_owner,nworkers-len(pending))
+					except sqlite3.OperationalError as e:
+						logger.error("Failed to lease sources from work queue (err=%s), stop leasing new sources ..." % (str(e)))
+						leased= []
+						leasing= False
+
+					for index, (source_id, source) in enumerate(leased):
+						try:
+							future= executor.submit(process_source,self.config,source)
+						except BrokenProcessPool as e:
+							logger.error("Worker pool broken (err=%s), stop leasing new sources ..." % (str(e)))
+							leasing= False
+							for failed_id, failed_source in leased[index:]:
+								complete(failed_id,failed_source,make_source_result(failed_source,'failed','Worker process terminated abruptly (e.g. out of memory)'))
+							break
+						pending[future]= (source_id,source)
+
+				# - Nothing left to lease: wait for sources leased by other processes (they may expire and be leased again)
+				if not pending:
+					if not leasing:
+						break
+					try:
+						nleased= self.queue.get_counts().get('leased',0)
+					except sqlite3.OperationalError as e:
+						logger.error("Failed to get work queue status (err=%s), stop processing queue ..." % (str(e)))
+						break
+					if nleased<=0:
+						break
+					time.sleep(poll_time)
+					continue
+
+				# - Collect completed sources, renewing leases of sources still in progress
+				done, not_done= wait(list(pending.keys()),timeout=poll_time,return_when=FIRST_COMPLETED)
+				try:
+					self.queue.renew(self.queue_owner)
+				except sqlite3.OperationalError as e:
+					logger.warn("Failed to renew leases in work queue (err=%s), sources in progress may be leased again by other processes ..." % (str(e)))
+
+				for future in done:
+					source_id, source= pending.pop(future)
+					try:
+						result= future.result()
+					except BrokenProcessPool as e:
+						if leasing:
+							logger.error("Worker process terminated abruptly (err=%s), stop leasing new sources ..." % (str(e)))
+						leasing= False
+						result= make_source_result(source,'failed','Worker process terminated abruptly (e.g. out of memory)')
+					except Exception as e:
+						logger.error("Worker failed while processing source %s (err=%s)!" % (source[2],str(e)))
+						result= make_source_result(source,'failed','Worker failure: ' + str(e))
+					complete(source_id,source,result)
+
+		try:
+			counts= self.queue.get_counts()
+			logger.info("Work queue status: %s" % (', '.join(['%s=%d' % (k,v) for k,v in sorted(counts.items())])))
+		except sqlite3.OperationalError as e:
+			logger.warn("Failed to get work queue status (err=%s)!" % (str(e)))
+		self.queue.close()
+
+	#==============================
+	#     RUN MPI MASTER
+	#==============================
+	def __run_mpi_master(self,pbar):
+		""" Hand out sources one at a time to worker ranks as they become idle and collect their results """
+
+		nworkers= self.nranks-1
+		logger.info("Processing %d sources with %d MPI worker ranks ..." % (len(self.sources),nworkers))
+
+		status= MPI.Status()
+		nsent= 0
+		nactive= 0
+
+		# - Give a source to each worker (or stop workers exceeding the number of sources)
+		for rank in range(1,self.nranks):
+			if nsent<len(self.sources):
+				self.comm.send(self.sources[nsent],dest=rank,tag=MPI_TAG_WORK)
+				nsent+= 1
+				nactive+= 1
+			else:
+				self.comm.send(None,dest=rank,tag=MPI_TAG_STOP)
+
+		# - Collect results and hand out the remaining sources
+		while nactive>0:
+			result= self.comm.recv(source=MPI.ANY_SOURCE,tag=MPI_TAG_RESULT,status=status)
+			rank= status.Get_source()
+			self.__add_results([result],pbar)
+
+			if nsent<len(self.sources):
+				self.comm.send(self.sources[nsent],dest=rank,tag=MPI_TAG_WORK)
+				nsent+= 1
+			else:
+				self.comm.send(None,dest=rank,tag=MPI_TAG_STOP)
+				nactive-= 1
+
+	def __stop_mpi_workers(self):
+		""" Send stop message to all worker ranks (used if master fails before distributing sources) """
+		if self.use_mpi:
+			for rank in range(1,self.nranks):
+				self.comm.send(None,dest=rank,tag=MPI_TAG_STOP)
+
+	#==============================
+	#     RUN MPI WORKER
+	#==============================
+	def __run_mpi_worker(self):
+		""" Process sources received from rank 0 until a stop message is received, returning per-source results """
+
+		status= MPI.Status()
+		nprocessed= 0
+
+		while True:
+			source= self.comm.recv(source=0,tag=MPI.ANY_TAG,status=status)
+			if status.Get_tag()==MPI_TAG_STOP:
+				break
+			result= process_source(self.config,source)
+			self.comm.send(result,dest=0,tag=MPI_TAG_RESULT)
+			nprocessed+= 1
+
+		logger.info("MPI rank %d processed %d sources" % (self.rank,nprocessed))
+
 		return 0
 
+	#==============================
+	#     PRINT RUN SUMMARY
+	#==============================
+	def __print_summary(self):
+		""" Print summary of processed and failed sources """
+
+		failed= [result for result in self.results if result['status']!='done']
+		elapsed= sum(result['elapsed'] for result in self.results)
+		logger.info("Processed %d sources: %d completed, %d failed (total source processing time=%.1f s)" % (len(self.results),len(self.results)-len(failed),len(failed),elapsed))
+		if self.config.cache_dir:
+			ncached= len([result for result in self.results if result.get('cached')])
+			logger.info("Cutout cache hits: %d/%d sources (cache=%s)" % (ncached,len(self.results),self.config.cache_dir))
+		if self.config.raw_cutout_cache_size>0:
+			nsaved= sum(result.get('tile_reads_saved',0) for result in self.results)
+			logger.info("Raw cutout cache saved %d tile reads" % (nsaved))
+		if self.config.stage_cache_dir or self.config.variants:
+			nreused= {stage: len([result for result in self.results if stage in result.get('reused_stages',[])]) for stage in CutoutHelper.STAGE_OPTIONS}
+			logger.info("Stage cache reuse: %s (cache=%s)" % (', '.join(['%s=%d/%d' % (stage,n,len(self.results)) for stage, n in nreused.items()]),self.config.stage_cache_dir or 'per source'))
+
+		if failed:
+			logger.warn("Failed sources:")
+			for result in failed:
+				logger.warn("  %s: %s (%s)" % (result['obj_name'],result['status'],result['errmsg']))
+
+		# - Report tile reuse among consecutive sources (within the number of concurrent workers) in processing and input order
+		tiles= {result['obj_name']: result.get('tiles',[]) for result in self.results}
+		window= max(self.config.nworkers,self.nranks-1,1)
+		names= [source[2] for source in self.sources if source[2] in tiles]
+		input_names= [name for name in self.input_names if name in tiles]
+		reuse_ratio= Utils.getTileReuseRatio([tiles[name] for name in names],window)
+		input_reuse_ratio= Utils.getTileReuseRatio([tiles[name] for name in input_names],window)
+		logger.info("Tile reuse ratio: %.3f (source order=%s, input order ratio=%.3f)" % (reuse_ratio,self.config.source_order,input_reuse_ratio))
+
 	#==============================
 	#     RUN SEARCH
 	#==============================
 	def run_search(self):
 		""" Run search """
 
+		#**********************
+		#     MPI WORKERS
+		#**********************
+		if self.use_mpi and self.nranks<2:
+			logger.warn("MPI mode requested but running with a single rank, processing sources serially ...")
+			self.use_mpi= False
+
+		if self.use_pipeline and self.config.variants:
+			logger.warn("Processing variants are not supported in pipeline mode, processing sources without pipeline ...")
+			self.use_pipeline= False
+
+		if self.use_mpi and self.rank>0:
+			return self.__run_mpi_worker()
+
 		#**********************
 		#     READ TABLE
 		#**********************
 		if self.__read_table()<0:
 			logger.error("Failed to read input table, search failed!")
+			self.__stop_mpi_workers()
 			return -1
 
 		#**********************
-		#     SEARCH CUTOUTS
+		#   RESUME PREVIOUS RUN
 		#**********************
-		has_radius_col= 'RADIUS' in self.table.colnames
+		append_manifest= False
+		if self.resume:
+			append_manifest= self.__skip_completed_sources()
 
-		manager = enlighten.get_manager()
-		pbar = manager.counter(total=len(self.table), desc='Processing sources', unit='sources')
+		#**********************
+		#  COALESCE DUPLICATES
+		#**********************
+		if self.config.coalesce_tolerance>0:
+			self.__coalesce_sources()
 
-		for item in self.table:	
-			ra= item['RA']
-			dec= item['DEC']
-			obj_name= item['OBJNAME']
-			radius= -1
-			if has_radius_col:
-				radius= item['RADIUS']
-	
-			logger.info("Searching cutout for source %s (%f,%f) ..." % (obj_name,ra,dec))
-			
-			try:
-				cs= CutoutHelper(self.config,ra,dec,obj_name,radius)
-				status= cs.run()
-				if status<0:
-					errmsg= 'Failed to extract cutout for source ' + obj_name + ', skip to next...'
-					logger.warn(errmsg)
-					continue
+		#**********************
+		#   CLUSTER SOURCES
+		#**********************
+		if self.config.cluster_sources:
+			if self.use_mpi or self.queue_file or self.use_pipeline or self.config.variants or self.config.output_format=='hdf5':
+				logger.warn("Source clustering is not supported in MPI/queue/pipeline modes, with processing variants and with HDF5 output, processing sources individually ...")
+				self.config.cluster_sources= False # cluster options are part of the config hash
+			else:
+				self.__cluster_sources()
 
-			except Exception as e:
-				#logger.error('Unknown error in source {0}. Trace: {1}'.format(obj_name, e.message))
-				logger.error('Unknown error in source {0}. Trace: {1}'.format(obj_name, str(e)))
-				continue
+		#**********************
+		#   INIT WORK QUEUE
+		#**********************
+		nsources= len(self.sources) + sum([len(members) for members in self.source_groups.values()]) + sum([len(cluster[1]) for cluster in self.clusters])
+		if self.queue_file:
+			nsources= self.__init_queue()
+			if nsources<0:
+				logger.error("Failed to initialize work queue!")
+				self.__stop_mpi_workers()
+				return -1
 
-			pbar.update()
+		#**********************
+		#   CREATE MANIFEST
+		#**********************
+		if self.__create_manifest(append_manifest)<0:
+			logger.error("Failed to create run manifest!")
+			self.__stop_mpi_workers()
+			return -1
+
+		#**********************
+		#     SEARCH CUTOUTS
+		#**********************
+		manager = enlighten.get_manager()
+		pbar = manager.counter(total=nsources, desc='Processing sources', unit='sources')
+
+		self.results= []
+		if self.clusters:
+			self.__run_clusters(pbar)
+
+		if self.use_mpi:
+			self.__run_mpi_master(pbar)
+		elif self.queue_file:
+			self.__run_queue(pbar)
+		elif self.use_pipeline:
+			self.__run_pipeline(pbar)
+		elif self.config.nworkers>1:
+			self.__run_parallel(pbar)
+		else:
+			self.__run_serial(pbar)
+
+		manager.stop()
+		self.manifest.close()
+
+		#**********************
+		#     PRINT SUMMARY
+		#**********************
+		self.__print_summary()
 
 		return 0
 
@@ -127,8 +1310,21 @@ class CutoutFinder(object):
 class CutoutHelper(object):
 	""" Class to extract source cutout from RA/DEC position """
 
-	def __init__(self,_config,_ra,_dec,_obj_name,_radius=-1):
-		""" Return a cutout helper object """
+	# - Config options read by each processing stage. Stages form a chain (each reads the outputs of the previous enabled stage),
+	#   so a stage cache key is computed from the previous stage key and the options of the stage itself.
+	STAGE_OPTIONS= OrderedDict([
+		('extract', ['surveys','multi_input_img_mode','convert_to_jypix_units','data_type']),
+		('subtract_bkg', ['bkg_estimator','bkg_inner_radius_factor','bkg_outer_radius_factor','bkg_max_nan_thr','bkg_mode','bkg_mesh_size','data_type']),
+		('regrid', ['data_type']),
+		('convolve', ['data_type']),
+		('crop', ['crop_mode','crop_size','data_type']),
+	])
+
+	# - Attributes read and updated by the process phase (the others are set from config and source in the constructor or only used by the other phases)
+	PROCESS_STATE= ['img_files','input_files','tile_files','cache_hit','stage_key','reused_stages','flux_scales']
+
+	def __init__(self,_config,_ra,_dec,_obj_name,_radius=-1,_members=None):
+		""" Return a cutout helper object. If a list of member sources (ra,dec,obj_name,radius) is given, a super-cutout covering the member cutouts is extracted and member cutouts are cropped from it. """
 
 		self.config= _config
 		self.ra= _ra
@@ -144,13 +1340,61 @@ class CutoutHelper(object):
 
 		self.source_radius/= 3600. # in degrees
 		self.cutout_size/= 3600. # in degrees
+
+		# - Super-cutout of a source cluster (coverage search radius set to enclose the whole cutout)
+		self.members= _members
+		self.member_outputs= {}
+		self.member_errors= {}
+		self.raw_img_files= {}
+		self.flux_scales= {}
+		if self.members:
+			member_sizes= [2*get_source_radius(self.config,member[3])*self.config.cutout_factor/3600. for member in self.members]
+			self.ra, self.dec, self.cutout_size= Utils.getClusterFootprint([member[0] for member in self.members],[member[1] for member in self.members],member_sizes)
+			self.source_radius= self.cutout_size/np.sqrt(2.)
 		
 
 		self.sname= _obj_name
-		self.topdir= self.config.workdir + '/' + self.sname
+		self.topdir= os.path.join(os.path.abspath(self.config.workdir),self.sname)
+		if self.config.output_format=='hdf5':
+			# - Final cutouts are written in the HDF5 file, intermediate files in a scratch dir always removed after the source
+			self.topdir= os.path.join(get_scratch_dir(self.config),self.sname)
 		self.tmpdir= self.topdir + '/tmpfiles'
 		self.surveys= self.config.surveys
 		self.img_files= {}
+		self.input_files= {}
+		self.tile_files= {}
+		self.output_files= []
+		self.coverage_tables= {}
+		self.tile_reads_saved= 0
+		self.stage_callback= None
+		self.dtype= np.dtype(self.config.data_type)
+
+		# - Processed cutout cache
+		self.cache= None
+		self.cache_key= None
+		self.cache_hit= False
+		self.cached_files= {}
+		if self.config.cache_dir and not self.members:
+			self.cache= CutoutCache(self.config.cache_dir,max_size=self.config.cache_max_size*1024*1024)
+
+		# - Stage product cache
+		self.stage_cache= None
+		self.stage_key= None
+		self.reused_stages= []
+		if self.config.stage_cache_dir and not self.members:
+			self.stage_cache= CutoutCache(self.config.stage_cache_dir,max_size=self.config.stage_cache_max_size*1024*1024)
+
+	#==============================
+	#     PROCESS PHASE STATE
+	#==============================
+	def get_process_state(self):
+		""" Return dictionary of the attributes read and updated by the process phase (file paths and stage cache keys), exchanged with worker processes in pipeline mode """
+		return {name: copy.copy(getattr(self,name)) for name in self.PROCESS_STATE}
+
+	def set_process_state(self,state):
+		""" Set the process phase attributes from a state dictionary (see get_process_state) """
+		for name, value in state.items():
+			setattr(self,name,value)
 
 	#==============================
 	#     INITIALIZE
@@ -158,16 +1402,149 @@ class CutoutHelper(object):
 	def __initialize(self):
 		""" Initialize search """
 
-		# - Create source work directories
+		# - Create source work directories (all files are then accessed with absolute paths, no chdir)
 		logger.info('Creating source work directory ' + self.topdir + ' ...')
-		Utils.mkdir(self.tmpdir)
-		
-		# - Enter tmp directory
-		logger.info('Entering source work tmp directory ' + self.tmpdir + ' ...')
-		os.chdir(self.tmpdir)
+		if Utils.mkdir(self.tmpdir)<0:
+			return -1
+
+		return 0
+
+	#==============================
+	#     SET PROCESSING STAGE
+	#==============================
+	def __set_stage(self,stage):
+		""" Notify the current processing stage (used by the watchdog to apply stage timeouts) """
+		if self.stage_callback is not None:
+			self.stage_callback(stage)
+
+	#==============================
+	#     GET TILE FILES
+	#==============================
+	def get_tile_files(self):
+		""" Return list of survey tiles read to extract the cutouts, in survey order """
+		tiles= []
+		for survey in self.surveys:
+			tiles.extend(self.tile_files.get(survey,[]))
+		return tiles
+
+	#==============================
+	#     GET COVERING TILES
+	#==============================
+	def __get_covering_tiles(self):
+		""" Return list of all survey tiles covering the source (computed in coverage step) """
+		tiles= []
+		for survey in self.surveys:
+			table= self.coverage_tables[survey]
+			if len(table)>0:
+				tiles.extend(table['fname'])
+		return tiles
+
+	#==============================
+	#     LOOKUP CUTOUT CACHE
+	#==============================
+	def __lookup_cache(self):
+		""" Compute cache key from the survey tiles covering the source and look for processed cutouts in cache """
+
+		# - Key on all covering tiles, as the tiles used depend on the multi input image mode (part of processing options)
+		self.cache_key= CutoutCache.get_key(self.__get_covering_tiles(),self.ra,self.dec,self.cutout_size,self.config.get_hash())
+		if self.cache_key is None:
+			return
+
+		meta= self.cache.fetch(self.cache_key)
+		if meta is None:
+			return
+
+		logger.info("Found processed cutouts for source %s in cache (key=%s) ..." % (self.sname,self.cache_key))
+		self.cache_hit= True
+		self.cached_files= meta['files']
+		self.tile_files= meta.get('tiles',{})
+
+	#==============================
+	#     STAGE CACHE KEY
+	#==============================
+	def __get_stage_key(self,stage,parent_key):
+		""" Return stage cache key from the previous stage key and the options read by the stage. The extract stage is keyed on the covering tiles and source geometry. """
+
+		key_data= {
+			'stage': stage,
+			'parent': parent_key,
+			'options': {option: getattr(self.config,option) for option in self.STAGE_OPTIONS[stage]},
+		}
+		if stage!='extract':
+			return hashlib.sha1(json.dumps(key_data,sort_keys=True,default=str).encode('utf-8')).hexdigest()
+
+		# - Intermediate file names and bkg/crop radii depend on source name and radius
+		key_data['obj_name']= self.sname
+		key_data['source_radius']= repr(float(self.source_radius))
+		key_data['survey_options']= {survey: self.config.survey_options.get(survey) for survey in self.surveys}
+		options_hash= hashlib.sha1(json.dumps(key_data,sort_keys=True,default=str).encode('utf-8')).hexdigest()
+
+		return CutoutCache.get_key(self.__get_covering_tiles(),self.ra,self.dec,self.cutout_size,options_hash)
+
+	#==============================
+	#     RUN STAGE
+	#==============================
+	def __run_stage(self,stage,func):
+		""" Run processing stage, or restore its products from stage cache if the stage inputs and options are unchanged """
+
+		self.__set_stage(stage)
+
+		# - Without a key (no stage cache, or previous stage not cacheable) just run the stage
+		key= None
+		if self.stage_cache is not None and (stage=='extract' or self.stage_key is not None):
+			key= self.__get_stage_key(stage,self.stage_key)
+		self.stage_key= key
+
+		if key is not None:
+			meta= self.stage_cache.fetch(key)
+			if meta is not None and self.__restore_stage(stage,meta)==0:
+				return 0
+
+		status= func()
+		if status<0:
+			return status
+
+		# - Store stage products (file paths are stored relative to tmp dir and restored there)
+		if key is not None and self.img_files:
+			self.stage_cache.store(
+				key,self.img_files,
+				stage=stage,obj_name=self.sname,
+				paths={survey: os.path.relpath(filename,self.tmpdir) for survey, filename in self.img_files.items()},
+				tiles=self.tile_files,
+				inputs=self.input_files
+			)
+
+		return 0
+
+	def __restore_stage(self,stage,meta):
+		""" Link stage products taken from stage cache in tmp dir """
+
+		logger.info("Reusing %s stage products of source %s from stage cache (key=%s) ..." % (stage,self.sname,meta['key']))
+
+		img_files= {}
+		for survey, filename in meta['files'].items():
+			img_file= os.path.join(self.tmpdir,meta['paths'][survey])
+			Utils.mkdir(os.path.dirname(img_file))
+			if Utils.linkOrCopy(filename,img_file)<0:
+				logger.warn("Failed to link cached stage product %s, running %s stage ..." % (filename,stage))
+				return -1
+			img_files[survey]= img_file
+
+		self.img_files= img_files
+		if stage=='extract':
+			self.tile_files= meta.get('tiles',{})
+			self.input_files= meta.get('inputs',{})
+		self.reused_stages.append(stage)
 
 		return 0
 
+	#==============================
+	#     GET OUTPUT BITPIX
+	#==============================
+	def __get_bitpix(self):
+		""" Return FITS BITPIX corresponding to processing data type """
+		return -8*self.dtype.itemsize
+
 	#==============================
 	#     EXTRACT RAW CUTOUT
 	#==============================
@@ -183,32 +1560,10 @@ class CutoutHelper(object):
 		raw_cutout_dir= self.tmpdir + '/raw_cutouts'	
 		Utils.mkdir(raw_cutout_dir) 
 
-		# - Get survey data options		
-		survey_opts= self.config.survey_options[survey]
-		#print("Survey %s options" % survey)
-		#print(survey_opts)
-		metadata_tbl= survey_opts['metadata']
-		#print("Survey %s metadata=%s" % (survey,metadata_tbl))
-		
-		# - Search in which survey file the source is located using Montage mCoverageCheck routine
+		# - Get survey coverage table (computed in coverage step)
+		table= self.coverage_tables[survey]
 		coverage_tbl= 'coverage_' + survey + '.tbl'
 		coverage_tbl_fullpath= self.tmpdir + '/' + coverage_tbl
-		logger.info('Making coverage table %s (r=%s arcsec) ...' % (coverage_tbl,str(self.source_radius*3600)))
-		#logger.info('Making coverage table ' + coverage_tbl_fullpath + ' (r=' + str(self.source_radius) + ') ...')
-		montage.mCoverageCheck(
-			in_table=metadata_tbl,
-			out_table=coverage_tbl_fullpath,
-			mode='circle',
-			ra=self.ra, dec=self.dec,
-			radius=self.source_radius
-		)
-
-		# - Read coverage table to check if an image was found
-		try:
-			table= ascii.read(coverage_tbl_fullpath)
-		except Exception as ex:
-			logger.error('Failed to read coverage table!')
-			return -1
 
 		nimgs= len(table)
 		if nimgs<=0:
@@ -216,6 +1571,7 @@ class CutoutHelper(object):
 			return 0
 
 		imgfile_fullpath= table[0]['fname']		
+		use_mosaic= False
 
 		if nimgs>1:
 			logger.info("More than 1 image found covering source coordinates, using mode %s ..." % self.config.multi_input_img_mode)
@@ -233,9 +1589,10 @@ class CutoutHelper(object):
 			elif self.config.multi_input_img_mode=='mosaic':
 				mosaic_file= 'mosaic_' + survey + '.fits'
 				mosaic_file_fullpath= os.path.join(input_img_dir,mosaic_file)
-				status= Utils.makeMosaic(coverage_tbl_fullpath,output=mosaic_file_fullpath)	
+				status= Utils.makeMosaic(coverage_tbl_fullpath,output=mosaic_file_fullpath,bitpix=self.__get_bitpix())	
 				if status==0:
 					imgfile_fullpath= mosaic_file_fullpath
+					use_mosaic= True
 				else:
 					logger.warn("Failed to compute mosaic from images listed in file %s, taking best one out of them ..." % (coverage_tbl))
 					try:
@@ -249,6 +1606,13 @@ class CutoutHelper(object):
 				imgfile_fullpath= table[0]['fname']
 		
 			
+		# - Store survey input image (used for bkg mesh estimation) and survey tiles read
+		if not use_mosaic:
+			self.input_files[survey]= imgfile_fullpath
+			self.tile_files[survey]= [imgfile_fullpath]
+		else:
+			self.tile_files[survey]= [str(fname) for fname in table['fname']]
+
 		#imgfile= table[0]['fname']
 		#imgfile_fullpath= imgfile
 		#imgfile_base= os.path.basename(imgfile_fullpath)
@@ -264,20 +1628,39 @@ class CutoutHelper(object):
 		cutout_file_fullpath= self.tmpdir + '/' + cutout_file
 		raw_cutout_file= ''
 		raw_cutout_file_fullpath= ''
-		montage.mSubimage(
-			#in_image=imgfile_local_fullpath, 
-			in_image=imgfile_fullpath, 
-			out_image=cutout_file_fullpath, 
-			ra=self.ra, dec=self.dec, xsize=self.cutout_size
-		)
-		self.img_files[survey]= cutout_file_fullpath
+
+		# - Slice cutout from a larger cutout of the same tile extracted before in this process, if any (not for per-source mosaics)
+		raw_cache= None if use_mosaic else get_raw_cutout_cache(self.config)
+		cached_data= None
+		if raw_cache is not None:
+			cached_data, cached_header= raw_cache.get(imgfile_fullpath,self.ra,self.dec,self.cutout_size)
+
+		if cached_data is not None:
+			logger.info("Slicing raw cutout from a previously extracted cutout of tile %s ..." % (imgfile_fullpath))
+			Utils.write_fits(cached_data,cutout_file_fullpath,cached_header)
+			self.img_files[survey]= cutout_file_fullpath
+			self.tile_reads_saved+= 1
+
+		else:
+			montage.mSubimage(
+				#in_image=imgfile_local_fullpath, 
+				in_image=imgfile_fullpath, 
+				out_image=cutout_file_fullpath, 
+				ra=self.ra, dec=self.dec, xsize=self.cutout_size
+			)
+			self.img_files[survey]= cutout_file_fullpath
 		
-		# - Fix image axis or scale in case BZERO!=0 or BSCALE!=0
-		logger.info("Fixing possible degenerate axis and non-null BSCALE factor in image %s ..." % (cutout_file))
-		status= Utils.fixImgAxisAndUnits(cutout_file_fullpath,cutout_file_fullpath)
-		if status<0:
-			logger.error("Failed to adjust axis/scale of image " + cutout_file_fullpath + "!")
-			return -1
+			# - Fix image axis or scale in case BZERO!=0 or BSCALE!=0
+			logger.info("Fixing possible degenerate axis and non-null BSCALE factor in image %s ..." % (cutout_file))
+			status= Utils.fixImgAxisAndUnits(cutout_file_fullpath,cutout_file_fullpath,dtype=self.dtype)
+			if status<0:
+				logger.error("Failed to adjust axis/scale of image " + cutout_file_fullpath + "!")
+				return -1
+
+			# - Keep fixed raw cutout for next sources
+			if raw_cache is not None:
+				data, header= Utils.read_fits(cutout_file_fullpath)
+				raw_cache.add(imgfile_fullpath,self.ra,self.dec,self.cutout_size,data,header)
 
 		# - Convert to Jy/pixel units?
 		#band= -1
@@ -292,7 +1675,7 @@ class CutoutHelper(object):
 			raw_cutout_file_fullpath= cutout_file_fullpath
 
 			logger.info('Converting image %s in Jy/pixel units ...' % (raw_cutout_file))
-			Utils.convertImgToJyPixel(cutout_file_fullpath,cutout_file_scaled_fullpath,survey,table[0]['bunit'])
+			Utils.convertImgToJyPixel(cutout_file_fullpath,cutout_file_scaled_fullpath,survey,table[0]['bunit'],dtype=self.dtype)
 			self.img_files[survey]= cutout_file_scaled_fullpath
 			
 		
@@ -314,6 +1697,167 @@ class CutoutHelper(object):
 
 		return 0
 
+	#==============================
+	#     COMPUTE SURVEY COVERAGE
+	#==============================
+	def __compute_coverage(self,survey):
+		""" Find survey images covering the source using Montage mCoverageCheck routine """
+
+		# - Get survey data options		
+		survey_opts= self.config.survey_options[survey]
+		metadata_tbl= survey_opts['metadata']
+		
+		# - Search in which survey file the source is located
+		coverage_tbl= 'coverage_' + survey + '.tbl'
+		coverage_tbl_fullpath= self.tmpdir + '/' + coverage_tbl
+		logger.info('Making coverage table %s (r=%s arcsec) ...' % (coverage_tbl,str(self.source_radius*3600)))
+		montage.mCoverageCheck(
+			in_table=metadata_tbl,
+			out_table=coverage_tbl_fullpath,
+			mode='circle',
+			ra=self.ra, dec=self.dec,
+			radius=self.source_radius
+		)
+
+		# - Read coverage table to check if an image was found
+		try:
+			table= ascii.read(coverage_tbl_fullpath)
+		except Exception as ex:
+			logger.error('Failed to read coverage table!')
+			return -1
+
+		self.coverage_tables[survey]= table
+
+		return 0
+
+	#==============================
+	#     RUN SURVEY TASKS
+	#==============================
+	def __run_survey_tasks(self,func,task_name):
+		""" Run given function for all surveys, concurrently in a thread pool if more than one thread is configured """
+
+		# - Surveys are processed concurrently (mostly waiting on disk & Montage subprocesses),
+		#   otherwise sequentially stopping at first failure
+		nthreads= min(self.config.nthreads,len(self.surveys))
+		if nthreads>1:
+			with ThreadPoolExecutor(max_workers=nthreads) as executor:
+				statuses= list(executor.map(func,self.surveys))
+		else:
+			statuses= (func(survey) for survey in self.surveys)
+
+		for survey, status in zip(self.surveys,statuses):
+			if status<0:
+				logger.error(task_name + ' for source ' + self.sname + ' for survey ' + survey + ' failed!')
+				return -1
+
+		return 0
+
+	#==============================
+	#     EXTRACT ALL RAW CUTOUTS
+	#==============================
+	def __extract_raw_cutouts(self):
+		""" Find cutouts for all surveys """
+
+		def extract(survey):
+			logger.info('Searching cutout for source ' + self.sname + ' for survey ' + survey + ' ...')
+			return self.__extract_raw_cutout(survey)
+
+		if self.__run_survey_tasks(extract,'Raw cutout extraction')<0:
+			return -1
+
+		# - Sort results in survey order, independently of thread completion order
+		self.img_files= {survey: self.img_files[survey] for survey in self.surveys if survey in self.img_files}
+		self.input_files= {survey: self.input_files[survey] for survey in self.surveys if survey in self.input_files}
+
+		return 0
+
+	#==============================
+	#     ESTIMATE BKG FROM MESH
+	#==============================
+	def __estimate_bkg_from_mesh(self,survey,filename,ra,dec):
+		""" Estimate bkg at given position from the cached bkg mesh of the survey input tile. Return None if not available. """
+
+		# - Check input tile is available (not for mosaics)
+		if survey not in self.input_files:
+			logger.info("No single input tile available for survey %s, falling back to annulus bkg ..." % (survey))
+			return None
+
+		# - Get bkg from mesh (cached next to survey metadata)
+		metadata_tbl= self.config.survey_options[survey]['metadata']
+		cache_dir= os.path.join(os.path.dirname(os.path.abspath(metadata_tbl)),'bkg_meshes')
+		bkg, rms= Utils.estimateBkgFromMesh(self.input_files[survey],ra,dec,self.config.bkg_mesh_size,cache_dir)
+		if bkg is None or not np.isfinite(bkg[0]):
+			logger.warn("Failed to get bkg from mesh of tile %s, falling back to annulus bkg ..." % (self.input_files[survey]))
+			return None
+
+		# - Convert bkg from tile to cutout units
+		header= fits.getheader(filename)
+		conv_factor= header['JYPIXCF'] if 'JYPIXCF' in header else 1
+		logger.info("Bkg from mesh of tile %s: bkg=%s, rms=%s (tile units), conv factor=%s" % (self.input_files[survey],str(bkg[0]),str(rms[0]),str(conv_factor)))
+
+		return bkg[0]*conv_factor
+
+	def __estimate_bkg(self,survey,filename,ra,dec,R1,R2):
+		""" Estimate bkg of cutout image at given position, from survey tile bkg mesh or in annulus (R1,R2 in arcsec) around position """
+
+		# - Compute bkg from survey tile bkg mesh?
+		bkg= None
+		if self.config.bkg_mode=='mesh':
+			bkg= self.__estimate_bkg_from_mesh(survey,filename,ra,dec)
+
+		# - Compute bkg in annulus around source
+		if bkg is None:
+			logger.info("Computing bkg for image %s (R1=%s, R2=%s) ..." % (Utils.getBaseFileNoExt(filename),str(R1),str(R2)))			
+			bkg= Utils.estimateBkgFromAnnulus(
+				filename=filename,
+				ra=ra,dec=dec,
+				R1=R1,R2=R2,
+				method=self.config.bkg_estimator,
+				max_nan_thr=self.config.bkg_max_nan_thr,
+				dtype=self.dtype
+			)
+
+		return bkg
+
+	def __estimate_member_bkgs(self,survey):
+		""" Estimate bkg of cluster members on the raw super-cutout of given survey, from survey tile bkg mesh or in annuli around members computed in a single pass over the image. Return dictionary of member bkgs. """
+
+		filename= self.raw_img_files[survey]
+		members= [member for member in self.members if member[2] not in self.member_errors]
+
+		# - Compute bkg from survey tile bkg mesh?
+		bkgs= {}
+		if self.config.bkg_mode=='mesh':
+			for ra, dec, obj_name, radius in members:
+				bkg= self.__estimate_bkg_from_mesh(survey,filename,ra,dec)
+				if bkg is not None:
+					bkgs[obj_name]= bkg
+			members= [member for member in members if member[2] not in bkgs]
+
+		if not members:
+			return bkgs
+
+		# - Compute bkg in annuli around all remaining members
+		logger.info("Computing bkg for %d members in image %s ..." % (len(members),Utils.getBaseFileNoExt(filename)))
+		data, header= Utils.read_fits(filename,dtype=self.dtype)
+		radii= np.array([get_source_radius(self.config,member[3]) for member in members])
+		annuli_bkgs, nan_fract= Utils.estimateBkgFromAnnuli(
+			data, WCS(header),
+			ra=np.array([member[0] for member in members]),
+			dec=np.array([member[1] for member in members]),
+			R1=radii*self.config.bkg_inner_radius_factor,
+			R2=radii*self.config.bkg_outer_radius_factor,
+			method=self.config.bkg_estimator,
+			max_nan_thr=self.config.bkg_max_nan_thr
+		)
+		if annuli_bkgs is None:
+			annuli_bkgs= np.full(len(members),-1.)
+
+		for index, member in enumerate(members):
+			bkgs[member[2]]= annuli_bkgs[index]
+
+		return bkgs
+
 	#==============================
 	#     SUBTRACT BKG
 	#==============================
@@ -331,24 +1875,18 @@ class CutoutHelper(object):
 			bkgsub_cutout_fullpath= self.tmpdir + '/' + bkgsub_cutout
 			self.img_files[survey]= bkgsub_cutout_fullpath
 	
-			# - Compute bkg in annulus around source
-			logger.info("Computing bkg for image %s (R1=%s, R2=%s) ..." % (filename_base,str(self.bkg_inner_radius),str(self.bkg_outer_radius)))			
-			bkg= Utils.estimateBkgFromAnnulus(
-				filename=filename,
-				ra=self.ra,dec=self.dec,
-				R1=self.bkg_inner_radius,R2=self.bkg_outer_radius,
-				method=self.config.bkg_estimator,
-				max_nan_thr=self.config.bkg_max_nan_thr
-			)
+			# - Compute bkg around source
+			bkg= self.__estimate_bkg(survey,filename,self.ra,self.dec,self.bkg_inner_radius,self.bkg_outer_radius)
 
 			# - Read fits image
-			data, header= Utils.read_fits(filename)
+			data, header= Utils.read_fits(filename,dtype=self.dtype)
 	
 			# - Subtract bkg?
 			good_bkg= (bkg>0 and np.isfinite(bkg))
 			if good_bkg:
 				logger.info("Subtracting bkg=%s from image %s ..." % (str(bkg),filename_base))			
-				data_nobkg= data - bkg
+				data_nobkg= data
+				data_nobkg-= bkg
 			else:
 				logger.warn("Computed bkg is not valid (negative/nan/inf), won't subtract bkg from image %s ..." % (filename_base))
 				data_nobkg= data			
@@ -383,12 +1921,14 @@ class CutoutHelper(object):
 		# - Get list of raw cutout images to be re-projected
 		raw_cutouts= []
 		reproj_cutouts= []
+		reproj_surveys= []
 		dx_orig= []
 		dy_orig= []
 
 		for survey, path in self.img_files.items(): 
 			reproj_cutout= Utils.getBaseFileNoExt(path) + '_reproj.fits'
 			reproj_cutout_fullpath= self.tmpdir + '/' + reproj_cutout
+			reproj_surveys.append(survey)
 			raw_cutouts.append(path)
 			reproj_cutouts.append(reproj_cutout_fullpath)
 			self.img_files[survey]= reproj_cutout_fullpath
@@ -402,7 +1942,7 @@ class CutoutHelper(object):
 				in_images=raw_cutouts, 
 				out_images=reproj_cutouts, 
 				header=None, 
-				bitpix=None, 
+				bitpix=self.__get_bitpix(), 
 				north_aligned=True,
 				common=True	
 			)
@@ -416,16 +1956,18 @@ class CutoutHelper(object):
 		# - Overwrite previous image
 		
 		for index in range(len(raw_cutouts)):
-			data, header= Utils.read_fits(raw_cutouts[index])
+			header= fits.getheader(raw_cutouts[index])
 			dx= abs(header['CDELT1'])
 			dy= abs(header['CDELT2'])
 		
-			data_reproj, header_reproj= Utils.read_fits(reproj_cutouts[index])
+			data_reproj, header_reproj= Utils.read_fits(reproj_cutouts[index],dtype=self.dtype)
 			dx_reproj= abs(header_reproj['CDELT1'])
 			dy_reproj= abs(header_reproj['CDELT2'])
 
 			flux_scale= (dx_reproj/dx)*(dy_reproj/dy)
-			data_reproj_scaled= flux_scale*data_reproj
+			self.flux_scales[reproj_surveys[index]]= flux_scale
+			data_reproj_scaled= data_reproj
+			data_reproj_scaled*= flux_scale
 	
 			logger.info("Scaling re-projected image %s to conserve flux (conv factor=%s) ..." % (raw_cutouts[index],str(flux_scale)))
 
@@ -462,6 +2004,7 @@ class CutoutHelper(object):
 		raw_cutouts= []
 		conv_cutouts= []
 		beam_list= []
+		beam_pars= []
 		pixsize_x= []
 		pixsize_y= []
 		data_list= []
@@ -475,7 +2018,7 @@ class CutoutHelper(object):
 			self.img_files[survey]= conv_cutout_fullpath
 			
 			# - Get image beam
-			data, header= Utils.read_fits(path)
+			data, header= Utils.read_fits(path,dtype=self.dtype)
 			wcs = WCS(header)
 			data_list.append(data)
 			header_list.append(header)
@@ -494,12 +2037,14 @@ class CutoutHelper(object):
 				bmin= header['BMIN'] # in deg
 				pa= header['BPA'] if 'BPA' in header else 0 # in deg
 				beam= radio_beam.Beam(bmaj*u.deg,bmin*u.deg,pa*u.deg)
+				beam_pars.append((bmaj,bmin,pa))
 			else:
 				logger.warn("No BMAJ/BMIN keyword present in file " + path + ", trying to retrieve from survey name...")
 				beamArea= Utils.getSurveyBeamArea(survey,ra,dec)
 				bmaj= np.sqrt(beamArea*4.*np.log(2)/np.pi)
 				if beamArea>0:
 					beam= radio_beam.Beam(bmaj*u.deg,bmaj*u.deg)
+					beam_pars.append((bmaj,bmaj,0.))
 				else:
 					logger.error("No BMAJ keyword present in file " + path + ", cannot compute conversion factor!")
 					return -1
@@ -507,8 +2052,16 @@ class CutoutHelper(object):
 			beam_list.append(beam)
 		
 		# - Compute common beam
-		beams= radio_beam.Beams(beams=beam_list)
-		common_beam= radio_beam.commonbeam.common_manybeams_mve(beams)
+		#   If one beam contains all the others (e.g. all beams circular) take it as common beam, 
+		#   otherwise solve for the minimum volume ellipse
+		common_beam_index= Utils.findContainingBeam(beam_pars)
+		if common_beam_index>=0:
+			logger.info("Beam no. %d contains all the others, taking it as common beam ..." % (common_beam_index))
+			common_beam= beam_list[common_beam_index]
+		else:
+			beams= radio_beam.Beams(beams=beam_list)
+			common_beam= radio_beam.commonbeam.common_manybeams_mve(beams)
+		common_beam_pars= (common_beam.major.to_value(u.deg),common_beam.minor.to_value(u.deg),common_beam.pa.to_value(u.deg))
 		common_beam_bmaj= common_beam.major.to(u.arcsec).value
 		common_beam_bmin= common_beam.minor.to(u.arcsec).value
 		common_beam_pa= common_beam.pa.to(u.deg).value
@@ -519,6 +2072,13 @@ class CutoutHelper(object):
 		
 		for index in range(len(raw_cutouts)):
 
+			# - Image already at common resolution?
+			if Utils.isBeamContained(beam_pars[index],common_beam_pars):
+				logger.info("Image %s is already at common resolution, no convolution needed ..." % (raw_cutouts[index]))
+				data_list[index][np.isnan(data_list[index])]=0.0
+				Utils.write_fits(data_list[index],conv_cutouts[index],header_list[index])
+				continue
+
 			# - Find convolving beam 
 			logger.debug("Finding convolving beam ...")
 			try:
@@ -586,8 +2146,14 @@ class CutoutHelper(object):
 			kernel=conv_kernel.array
 
 			# - Convolve image and write fits
+			#   Use two 1D passes if kernel is separable (circular or axis-aligned conv beam)
 			data_list[index][np.isnan(data_list[index])]=0.0
-			data_conv=cv.filter2D(np.float64(data_list[index]),-1,kernel,borderType=cv.BORDER_CONSTANT)
+			sep_kernel= Utils.getSeparableKernel(kernel)
+			if sep_kernel is not None:
+				logger.debug("Convolution kernel is separable, applying two 1D filters ...")
+				data_conv=cv.sepFilter2D(data_list[index],-1,sep_kernel[0],sep_kernel[1],borderType=cv.BORDER_CONSTANT)
+			else:
+				data_conv=cv.filter2D(data_list[index],-1,kernel,borderType=cv.BORDER_CONSTANT)
 			logger.info("Kernel size: %d x %d" % (kernel.shape[0],kernel.shape[1]))
 			Utils.write_fits(data_conv,conv_cutouts[index],header_list[index])
 
@@ -635,7 +2201,8 @@ class CutoutHelper(object):
 				source_size=source_size,
 				nanfill=True,
 				nanfill_mode='imgmin',
-				nanfill_val=0
+				nanfill_val=0,
+				dtype=self.dtype
 			)
 
 			# - Move conv cutout in subdir
@@ -657,12 +2224,102 @@ class CutoutHelper(object):
 
 		return 0
 		
+	#==============================
+	#     CROP CLUSTER MEMBERS
+	#==============================
+	def __crop_members(self):
+		""" Crop the cutouts of each cluster member from the processed super-cutouts into the member directory, subtracting member bkg if enabled """
+
+		for survey, filename in self.img_files.items():
+			data, header= Utils.read_fits(filename,dtype=self.dtype)
+
+			# - Estimate member bkgs on raw super-cutout at once
+			member_bkgs= {}
+			if self.config.subtract_bkg:
+				member_bkgs= self.__estimate_member_bkgs(survey)
+
+			for ra, dec, obj_name, radius in self.members:
+				if obj_name in self.member_errors:
+					continue
+				radius= get_source_radius(self.config,radius)
+				member_dir= os.path.join(os.path.abspath(self.config.workdir),obj_name)
+				Utils.mkdir(member_dir)
+				outfile= os.path.join(member_dir,obj_name + '_' + survey + '.fits')
+
+				# - Crop as done for single sources (or to the source cutout size if crop is disabled)
+				crop_mode= self.config.crop_mode
+				crop_size= self.config.crop_size
+				source_size= radius/3600.
+				if crop_mode=='none':
+					crop_mode= 'pixel'
+					crop_size= 2*radius*self.config.cutout_factor/3600.*u.deg
+					source_size= -1
+
+				status= Utils.cropImage(
+					filename=filename,
+					ra=ra,dec=dec,
+					crop_mode=crop_mode,
+					crop_size=crop_size,
+					outfile=outfile,
+					source_size=source_size,
+					nanfill=True,
+					nanfill_mode='imgmin',
+					nanfill_val=0,
+					dtype=self.dtype,
+					data=data,
+					header=header
+				)
+				if status<0:
+					self.member_errors[obj_name]= 'Failed to crop cutout for survey ' + survey
+					continue
+
+				# - Subtract member bkg, estimated on raw super-cutout and scaled as done by regrid (convolution preserves a constant bkg)
+				if self.config.subtract_bkg:
+					bkg= member_bkgs[obj_name]
+					if bkg>0 and np.isfinite(bkg):
+						logger.info("Subtracting bkg=%s from cutout of source %s ..." % (str(bkg),obj_name))
+						member_data, member_header= Utils.read_fits(outfile,dtype=self.dtype)
+						member_data-= bkg*self.flux_scales.get(survey,1.)
+						Utils.write_fits(member_data,outfile,member_header)
+					else:
+						logger.warn("Computed bkg is not valid (negative/nan/inf), won't subtract bkg from cutout of source %s ..." % (obj_name))
+
+				self.member_outputs.setdefault(obj_name,[]).append(outfile)
+
+		# - Remove outputs of failed members
+		for obj_name in self.member_errors:
+			for outfile in self.member_outputs.pop(obj_name,[]):
+				os.remove(outfile)
+
 	#==============================
 	#     RUN CUTOUT EXTRACTION
 	#==============================
 	def run(self):
 		""" Run search for single source """
 		
+		#**********************
+		#   EXTRACT CUTOUTS
+		#**********************
+		if self.extract()<0:
+			return -1
+
+		#**********************
+		#   PROCESS CUTOUTS
+		#**********************
+		if self.process()<0:
+			return -1
+
+		#**********************
+		#   WRITE OUTPUTS
+		#**********************
+		return self.finalize()
+
+	#==============================
+	#     EXTRACT PHASE
+	#==============================
+	def extract(self):
+		""" Create work dirs and extract raw cutouts from survey data (I/O bound) """
+		
 		#**********************
 		#        INIT
 		#**********************
@@ -670,22 +2327,57 @@ class CutoutHelper(object):
 			logger.error("Failed to initialize source cutout search!")
 			return -1
 		
+		#*************************************
+		#   FIND SURVEY IMAGES
+		#*************************************
+		self.__set_stage('extract')
+		if self.__run_survey_tasks(self.__compute_coverage,'Coverage search')<0:
+			return -1
+
+		# - Super-cutouts must lie in a single survey image (unless mosaicking), otherwise members at image borders would lose data
+		if self.members and self.config.multi_input_img_mode!='mosaic':
+			for survey in self.surveys:
+				if len(self.coverage_tables[survey])>1:
+					logger.warn("Super-cutout of cluster %s spans %d images of survey %s!" % (self.sname,len(self.coverage_tables[survey]),survey))
+					return -1
+
+		#*************************************
+		#   LOOKUP CUTOUT CACHE
+		#*************************************
+		if self.cache is not None:
+			self.__lookup_cache()
+			if self.cache_hit:
+				return 0
+
 		#*************************************
 		#   EXTRACT CUTOUT FROM SURVEY DATA
 		#*************************************
-		for survey in self.surveys:
-			logger.info('Searching cutout for source ' + self.sname + ' for survey ' + survey + ' ...')
-			status= self.__extract_raw_cutout(survey)
-			if status<0:
-				logger.error('Raw cutout extraction for source ' + self.sname + ' for survey ' + survey + ' failed!')
-				return -1
+		if self.__run_stage('extract',self.__extract_raw_cutouts)<0:
+			return -1
+
+		# - Keep raw super-cutouts to compute the bkg of members
+		if self.members:
+			self.raw_img_files= dict(self.img_files)
+
+		return 0
+
+	#==============================
+	#     PROCESS PHASE
+	#==============================
+	def process(self):
+		""" Subtract bkg, regrid, convolve and crop raw cutouts (CPU bound) """
+
+		# - Nothing to be done for cutouts taken from cache
+		if self.cache_hit:
+			return 0
 
 		#*************************************
 		#   SUBTRACT BACKGROUND
 		#*************************************
-		if self.config.subtract_bkg:
+		# - For super-cutouts bkg is subtracted from each member cutout
+		if self.config.subtract_bkg and not self.members:
 			logger.info('Subtracting bkg from raw cutouts ...')
-			status= self.__subtract_bkg()
+			status= self.__run_stage('subtract_bkg',self.__subtract_bkg)
 			if status<0:
 				logger.error('Failed to subtract bkg from raw cutouts for source ' + self.sname + '!')
 				return -1
@@ -695,7 +2387,7 @@ class CutoutHelper(object):
 		#*************************************
 		if self.config.regrid:
 			logger.info('Regridding raw cutouts ...')
-			status= self.__regrid_cutouts()
+			status= self.__run_stage('regrid',self.__regrid_cutouts)
 			if status<0:
 				logger.error('Failed to regrid raw cutouts for source ' + self.sname + '!')
 				return -1
@@ -705,7 +2397,7 @@ class CutoutHelper(object):
 		#*************************************
 		if self.config.convolve:
 			logger.info('Convolving raw cutouts to the same resolution ...')
-			status= self.__convolve_to_same_resolution()
+			status= self.__run_stage('convolve',self.__convolve_to_same_resolution)
 			if status<0:
 				logger.error('Failed to convolve raw cutouts for source ' + self.sname + '!')
 				return -1
@@ -713,28 +2405,76 @@ class CutoutHelper(object):
 		#*************************************
 		#       CROP CUTOUTS
 		#*************************************
-		if self.config.crop_mode!='none':
+		if self.config.crop_mode!='none' and not self.members:
 			logger.info('Cropping cutouts in ' + self.config.crop_mode +  ' mode')
-			status= self.__crop()
+			status= self.__run_stage('crop',self.__crop)
 			if status<0:
 				logger.error('Failed to crop cutouts for source ' + self.sname + '!')
 				return -1
+
+		return 0
+
+	#==============================
+	#     FINALIZE PHASE
+	#==============================
+	def finalize(self):
+		""" Copy final cutouts in source main dir and remove tmp files """
 	
 		#*************************************
 		#     COPY FINAL FILES IN MAIN DIR
 		#*************************************
 		# - Copy final files in main directory
-		logger.debug("Copying final image cutouts in main directory ...")
-		for survey, filename in self.img_files.items():
-			filename_base= Utils.getBaseFile(filename)
-			filename_final= self.sname + '_' + survey + '.fits'
-			filename_final_fullpath= self.topdir + '/' + filename_final
-			shutil.copy(filename,filename_final_fullpath)
+		self.__set_stage('finalize')
+		if self.members:
+			logger.debug("Cropping member cutouts from super-cutouts ...")
+			self.__crop_members()
+
+		elif self.config.output_format=='hdf5':
+			logger.debug("Writing final image cutouts in HDF5 output file ...")
+			files= self.cached_files if self.cache_hit else self.img_files
+			try:
+				self.output_files= get_output_store(self.config).add(self.sname,files,ra=self.ra,dec=self.dec)
+			except Exception as e:
+				logger.error("Failed to write cutouts of source %s in HDF5 output file (err=%s)!" % (self.sname,str(e)))
+				remove_scratch_dir(self.config,self.sname)
+				return -1
 
-		# - Remove tmp file directory?
-		if not self.config.keep_tmpfiles:
+		elif self.cache_hit:
+			logger.debug("Linking cached image cutouts in main directory ...")
+			for survey, filename in self.cached_files.items():
+				filename_final= self.sname + '_' + survey + '.fits'
+				filename_final_fullpath= self.topdir + '/' + filename_final
+				if Utils.linkOrCopy(filename,filename_final_fullpath)<0:
+					logger.error("Failed to link cached cutout %s in main directory!" % (filename))
+					return -1
+				self.output_files.append(filename_final_fullpath)
+
+		else:
+			logger.debug("Copying final image cutouts in main directory ...")
+			for survey, filename in self.img_files.items():
+				filename_base= Utils.getBaseFile(filename)
+				filename_final= self.sname + '_' + survey + '.fits'
+				filename_final_fullpath= self.topdir + '/' + filename_final
+				if os.path.lexists(filename_final_fullpath):
+					# - Outputs of previous runs may be read-only links to cache
+					os.remove(filename_final_fullpath)
+				# - Copy content only, as stage products restored from cache are read-only
+				shutil.copyfile(filename,filename_final_fullpath)
+				self.output_files.append(filename_final_fullpath)
+
+		# - Store final cutouts in cache
+		if not self.cache_hit and self.cache is not None and self.cache_key is not None and self.img_files:
+			self.cache.store(self.cache_key,self.img_files,obj_name=self.sname,tiles=self.tile_files)
+
+		# - Remove tmp file directory? (and source dir, if no outputs are written in it). Scratch dirs of HDF5 output mode are always removed.
+		if self.config.output_format=='hdf5':
+			logger.debug("Removing scratch dir " + self.topdir + " ...")
+			remove_scratch_dir(self.config,self.sname)
+		elif not self.config.keep_tmpfiles:
 			logger.debug("Removing tmp file dir " + self.tmpdir + " ...")
 			shutil.rmtree(self.tmpdir, ignore_errors=True)
+			if self.members:
+				shutil.rmtree(self.topdir, ignore_errors=True)
 
 		return 0
 
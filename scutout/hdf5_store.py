@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import fcntl
+import logging
+import numpy as np
+
+## ASTRO MODULES
+from astropy.io import fits
+
+## HDF5 MODULES (optional)
+try:
+	import h5py
+	has_h5py= True
+except ImportError:
+	has_h5py= False
+
+##############################
+##     GLOBAL VARS
+##############################
+logger = logging.getLogger(__name__)
+
+# - Separator between HDF5 file and dataset in output names (<file>::<OBJNAME>/<survey>)
+OUTPUT_NAME_SEP= '::'
+
+
+###########################
+##     CLASS DEFINITIONS
+###########################
+class Hdf5CutoutStore(object):
+	""" Single-file HDF5 container of final cutouts, with a group per source (named after OBJNAME, holding RA/DEC attributes) and a chunked, compressed dataset per survey.
+	    FITS header cards are stored as dataset attributes (plus the full header in the FITS_HEADER attribute).
+	    Groups are indexed by name in HDF5 (latest file format), giving random-access lookup by OBJNAME.
+	    Writers of different processes are serialized by an exclusive lock on a side lock file (<file>.lock), the file being open only while writing a source.
+	"""
+
+	def __init__(self,filename,compression_level=4,chunk_size=256):
+		""" Return a HDF5 cutout store object """
+
+		if not has_h5py:
+			raise ImportError("h5py module is required to write/read HDF5 cutout files!")
+
+		self.filename= os.path.abspath(filename)
+		self.lock_file= self.filename + '.lock'
+		self.compression_level= compression_level
+		self.chunk_size= chunk_size
+
+	#==============================
+	#     OUTPUT NAMES
+	#==============================
+	def get_output_name(self,obj_name,survey):
+		""" Return output name of a source survey cutout """
+		return self.filename + OUTPUT_NAME_SEP + obj_name + '/' + survey
+
+	@staticmethod
+	def split_output_name(output):
+		""" Return (filename,obj_name,survey) of a store output name, or None if output is a plain file """
+
+		if OUTPUT_NAME_SEP not in output:
+			return None
+		filename, dataset= output.rsplit(OUTPUT_NAME_SEP,1)
+		obj_name, survey= dataset.rsplit('/',1)
+
+		return filename, obj_name, survey
+
+	#==============================
+	#     LOCK FILE
+	#==============================
+	def __lock(self,shared=False):
+		""" Acquire lock on store (blocking), exclusive for writers and shared for readers. Return the lock file object. """
+		dirname= os.path.dirname(self.filename)
+		if not os.path.isdir(dirname):
+			os.makedirs(dirname,exist_ok=True)
+		f= open(self.lock_file,'a')
+		fcntl.flock(f,fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+		return f
+
+	def __unlock(self,f):
+		""" Release lock on store """
+		fcntl.flock(f,fcntl.LOCK_UN)
+		f.close()
+
+	def __open(self,mode):
+		""" Open HDF5 file (latest file format, indexing group members by name) """
+		return h5py.File(self.filename,mode,libver='latest')
+
+	#==============================
+	#     ADD SOURCE CUTOUTS
+	#==============================
+	def add(self,obj_name,files,ra=None,dec=None):
+		""" Add cutouts of a source (dictionary of survey -> FITS file), replacing previously stored ones. Return the list of output names. """
+
+		# - Read cutouts before locking the store
+		cutouts= []
+		for survey, filename in files.items():
+			with fits.open(filename,memmap=False) as hdul:
+				cutouts.append((survey,hdul[0].data,hdul[0].header))
+
+		outputs= []
+		f= self.__lock()
+		try:
+			with self.__open('a') as fout:
+				if obj_name in fout:
+					del fout[obj_name]
+				group= fout.create_group(obj_name)
+				if ra is not None and dec is not None:
+					group.attrs['RA']= ra
+					group.attrs['DEC']= dec
+
+				for survey, data, header in cutouts:
+					self.__write_cutout(group,survey,data,header)
+					outputs.append(self.get_output_name(obj_name,survey))
+		finally:
+			self.__unlock(f)
+
+		return outputs
+
+	def __write_cutout(self,group,survey,data,header):
+		""" Write cutout data in a chunked, compressed dataset, with header cards as attributes """
+
+		chunks= None
+		if data.ndim>0:
+			chunks= tuple([min(n,self.chunk_size) for n in data.shape])
+		dset= group.create_dataset(
+			survey,
+			data=data,
+			chunks=chunks,
+			compression='gzip',
+			compression_opts=self.compression_level,
+			shuffle=True
+		)
+
+		dset.attrs['FITS_HEADER']= header.tostring()
+		for card in header.cards:
+			keyword= card.keyword
+			if not keyword or keyword in dset.attrs:
+				continue
+			if keyword in ['COMMENT','HISTORY']:
+				dset.attrs[keyword]= '\n'.join([str(value) for value in header[keyword]])
+				continue
+			value= card.value
+			if not isinstance(value,(str,bool,int,float,np.number)):
+				value= str(value)
+			dset.attrs[keyword]= value
+
+	#==============================
+	#     LINK SOURCE CUTOUT
+	#==============================
+	def link(self,obj_name,survey,target_obj_name,ra=None,dec=None):
+		""" Link survey cutout of a source to the one stored for another source (soft link). Return the output name. """
+
+		f= self.__lock()
+		try:
+			with self.__open('a') as fout:
+				group= fout.require_group(obj_name)
+				if ra is not None and dec is not None:
+					group.attrs['RA']= ra
+					group.attrs['DEC']= dec
+				if survey in group:
+					del group[survey]
+				group[survey]= h5py.SoftLink('/' + target_obj_name + '/' + survey)
+		finally:
+			self.__unlock(f)
+
+		return self.get_output_name(obj_name,survey)
+
+	#==============================
+	#     READ CUTOUTS
+	#==============================
+	def get_sources(self):
+		""" Return list of stored source names """
+		f= self.__lock(shared=True)
+		try:
+			with self.__open('r') as fin:
+				return list(fin.keys())
+		finally:
+			self.__unlock(f)
+
+	def get_surveys(self,obj_name):
+		""" Return list of stored surveys for given source """
+		f= self.__lock(shared=True)
+		try:
+			with self.__open('r') as fin:
+				return list(fin[obj_name].keys())
+		finally:
+			self.__unlock(f)
+
+	def get(self,obj_name,survey):
+		""" Return (data,header) of a stored source survey cutout """
+		f= self.__lock(shared=True)
+		try:
+			with self.__open('r') as fin:
+				dset= fin[obj_name][survey]
+				data= dset[()]
+				header= fits.Header.fromstring(dset.attrs['FITS_HEADER'])
+		finally:
+			self.__unlock(f)
+		return data, header
+
+	def get_sizes(self,cutouts):
+		""" Return stored data size in bytes for a list of (obj_name,survey) cutouts (-1 for missing cutouts) """
+
+		sizes= []
+		if not os.path.isfile(self.filename):
+			return [-1]*len(cutouts)
+
+		f= self.__lock(shared=True)
+		try:
+			with self.__open('r') as fin:
+				for obj_name, survey in cutouts:
+					try:
+						sizes.append(int(fin[obj_name][survey].id.get_storage_size()))
+					except (KeyError,ValueError):
+						sizes.append(-1)
+		finally:
+			self.__unlock(f)
+
+		return sizes
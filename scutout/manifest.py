@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import json
+import datetime
+import logging
+
+##############################
+##     GLOBAL VARS
+##############################
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION= 1
+
+
+###########################
+##     CLASS DEFINITIONS
+###########################
+class Manifest(object):
+	""" Run manifest, stored as a JSON-lines file with a header record (run info & config hash) followed by one record per processed source """
+
+	def __init__(self,filename):
+		""" Return a manifest object """
+
+		self.filename= filename
+		self.header= {}
+		self.records= []
+		self.fout= None
+
+	#==============================
+	#     CREATE MANIFEST
+	#==============================
+	def create(self,config_hash,append=False,**run_info):
+		""" Create manifest file (overwriting existing one unless append is enabled) and write header record """
+
+		self.header= {
+			'type': 'header',
+			'version': MANIFEST_VERSION,
+			'config_hash': config_hash,
+			'start_time': datetime.datetime.now().isoformat(),
+		}
+		self.header.update(run_info)
+		self.records= []
+
+		try:
+			self.fout= open(self.filename,'a' if append else 'w')
+
+			# - Terminate a truncated last record (run killed while writing) before appending
+			if append and self.fout.tell()>0:
+				with open(self.filename,'rb') as f:
+					f.seek(-1,os.SEEK_END)
+					if f.read(1)!=b'\n':
+						self.fout.write('\n')
+		except Exception as e:
+			logger.error("Failed to create manifest file %s (err=%s)!" % (self.filename,str(e)))
+			return -1
+
+		self.__write(self.header)
+
+		return 0
+
+	#==============================
+	#     ADD RECORD
+	#==============================
+	def add(self,record):
+		""" Append a source record to manifest file """
+
+		record= dict(record)
+		record['type']= 'source'
+		self.records.append(record)
+		if self.fout is not None:
+			self.__write(record)
+
+	def __write(self,record):
+		""" Write record as a single JSON line, flushed so that manifest is consistent if run is killed """
+		self.fout.write(json.dumps(record,default=str) + '\n')
+		self.fout.flush()
+
+	def close(self):
+		""" Close manifest file """
+		if self.fout is not None:
+			self.fout.close()
+			self.fout= None
+
+	#==============================
+	#     READ MANIFEST
+	#==============================
+	def read(self):
+		""" Read manifest header and source records from file """
+
+		self.header= {}
+		self.records= []
+
+		try:
+			with open(self.filename,'r') as f:
+				lines= f.readlines()
+		except Exception as e:
+			logger.error("Failed to read manifest file %s (err=%s)!" % (self.filename,str(e)))
+			return -1
+
+		for index, line in enumerate(lines):
+			line= line.strip()
+			if not line:
+				continue
+			try:
+				record= json.loads(line)
+			except ValueError:
+				# - A truncated last line is expected if the run was killed while writing
+				logger.warn("Skipping invalid record at line %d of manifest %s ..." % (index+1,self.filename))
+				continue
+
+			if record.get('type')=='header':
+				self.header= record
+			else:
+				self.records.append(record)
+
+		if not self.header:
+			logger.error("No header record found in manifest %s!" % (self.filename))
+			return -1
+
+		return 0
+
+	#==============================
+	#     COMPLETED SOURCES
+	#==============================
+	def get_completed(self):
+		""" Return dictionary of source records (by source name) whose last record has status done """
+		records= {}
+		for record in self.records:
+			records[record.get('obj_name')]= record
+		return {name: record for name, record in records.items() if record.get('status')=='done'}
+
+	#==============================
+	#     SUMMARY
+	#==============================
+	def get_summary(self):
+		""" Return dictionary with number of sources per status """
+		summary= {}
+		for record in self.records:
+			status= record.get('status','unknown')
+			summary[status]= summary.get(status,0) + 1
+		return summary
+
+
+##############################
+##     MERGE MANIFESTS
+##############################
+def merge_manifests(filenames,outfile,force=False):
+	""" Merge shard manifests into a single run manifest. When the same source appears in more manifests a completed record is preferred, otherwise the last one is kept. """
+
+	# - Read input manifests
+	manifests= []
+	for filename in filenames:
+		manifest= Manifest(filename)
+		if manifest.read()<0:
+			logger.error("Failed to read manifest %s!" % (filename))
+			return -1
+		manifests.append(manifest)
+
+	if not manifests:
+		logger.error("No input manifests given!")
+		return -1
+
+	# - Check all shards were produced with the same processing options
+	config_hashes= sorted(set([manifest.header.get('config_hash') for manifest in manifests]))
+	if len(config_hashes)>1:
+		if not force:
+			logger.error("Manifests were produced with different config options (hashes=%s), cannot merge them!" % (str(config_hashes)))
+			return -1
+		logger.warn("Manifests were produced with different config options (hashes=%s), merging anyway as requested ..." % (str(config_hashes)))
+
+	# - Merge source records
+	records= {}
+	for manifest in manifests:
+		for record in manifest.records:
+			name= record.get('obj_name')
+			prev_record= records.get(name)
+			if prev_record is not None and prev_record.get('status')=='done' and record.get('status')!='done':
+				continue
+			records[name]= record
+
+	# - Write merged manifest
+	merged= Manifest(outfile)
+	status= merged.create(
+		config_hashes[0],
+		merged_from=[os.path.abspath(filename) for filename in filenames],
+		shards=[manifest.header.get('shard') for manifest in manifests]
+	)
+	if status<0:
+		return -1
+
+	for record in records.values():
+		merged.add(record)
+	merged.close()
+
+	# - Print summary
+	summary= merged.get_summary()
+	logger.info("Merged %d manifests into %s: %d sources (%s)" % (len(manifests),outfile,len(records),', '.join(['%s=%d' % (k,v) for k,v in sorted(summary.items())])))
+	failed= [record for record in records.values() if record.get('status')!='done']
+	for record in failed:
+		logger.warn("  %s: %s (%s)" % (record.get('obj_name'),record.get('status'),record.get('errmsg','')))
+
+	return 0
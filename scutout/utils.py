@@ -12,16 +12,16 @@ import numpy as np
 import fnmatch
 import shutil
 import errno
+import hashlib
 
 # ASTRO MODULES
 from astropy.io import fits
 from astropy.io import ascii
 from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
 from astropy.nddata import Cutout2D
-from astropy.stats import sigma_clipped_stats
 from astropy import units as u
 from astropy.coordinates import SkyCoord
-from regions import CircleAnnulusSkyRegion, CircleAnnulusPixelRegion
 import montage_wrapper as montage
 
 # GRAPHICS MODULES
@@ -41,6 +41,9 @@ class Utils(object):
                             None
     """
 
+    # - Bkg meshes computed or read in this process, keyed by tile hash & box size (see getBkgMesh)
+    bkg_meshes = {}
+
     def __init__(self):
         """ Return a Utils object """
 
@@ -71,6 +74,22 @@ class Utils(object):
 
         return 0
 
+    @classmethod
+    def linkOrCopy(cls, src, dst):
+        """ Hard-link file to destination (replacing existing file), falling back to copy if linking is not possible (e.g. different filesystems) """
+        try:
+          if os.path.lexists(dst):
+            os.remove(dst)
+          try:
+            os.link(src, dst)
+          except OSError:
+            shutil.copy(src, dst)
+        except (OSError, IOError) as exc:
+          logger.error('Failed to link or copy file ' + src + ' to ' + dst + ' (err=' + str(exc) + ')!')
+          return -1
+
+        return 0
+
     @classmethod
     def has_patterns_in_string(cls, s, patterns):
         """ Return true if patterns are found in string """
@@ -194,12 +213,39 @@ class Utils(object):
         hdul.writeto(filename, overwrite=True)
 
     @classmethod
-    def read_fits(cls, filename):
-        """ Read FITS image and return data """
+    def toNativeFloat(cls, data, header=None, dtype=np.float32):
+        """ Convert data to native-endian float array (default float32), applying BLANK/BSCALE/BZERO from header in place """
+
+        # - Convert once to native byte order and requested type (astype always makes a copy)
+        output_data = data.astype(np.dtype(dtype).newbyteorder('='))
+        if header is None:
+            return output_data
+
+        # - Flag blank pixels of integer images
+        if 'BLANK' in header:
+            if np.issubdtype(data.dtype, np.integer):
+                output_data[data == header['BLANK']] = np.nan
+            del header['BLANK']
+
+        # - Scale flux in place
+        bscale = header['BSCALE'] if 'BSCALE' in header else 1
+        bzero = header['BZERO'] if 'BZERO' in header else 0
+        if bscale != 1:
+            output_data *= bscale
+            header['BSCALE'] = 1
+        if bzero != 0:
+            output_data += bzero
+            header['BZERO'] = 0
+
+        return output_data
 
-        # - Open file
+    @classmethod
+    def read_fits(cls, filename, dtype=None):
+        """ Read FITS image and return data. If dtype is given data are converted to native-endian dtype at read time """
+
+        # - Open file (scaling is applied by toNativeFloat if a dtype is given)
         try:
-            hdu = fits.open(filename, memmap=False)
+            hdu = fits.open(filename, memmap=False, do_not_scale_image_data=(dtype is not None))
         except Exception as ex:
             errmsg = 'Cannot read image file: ' + filename
             # cls._logger.error(errmsg)
@@ -228,6 +274,10 @@ class Utils(object):
         # - Close file
         hdu.close()
 
+        # - Convert data type?
+        if dtype is not None:
+            output_data = Utils.toNativeFloat(output_data, header, dtype)
+
         return output_data, header
 
     @classmethod
@@ -789,12 +839,75 @@ class Utils(object):
         return True
 
     @classmethod
-    def fixImgAxisAndUnits(cls, filename, outfile):
+    def getBeamCovariance(cls, bmaj, bmin, pa):
+        """ Return the 2x2 second-moment matrix (in FWHM^2 units) of a gaussian beam (pa in deg) """
+        theta = np.deg2rad(pa)
+        c = np.cos(theta)
+        s = np.sin(theta)
+        a2 = bmaj*bmaj
+        b2 = bmin*bmin
+        return np.array([[a2*c*c + b2*s*s, (a2-b2)*s*c], [(a2-b2)*s*c, a2*s*s + b2*c*c]])
+
+    @classmethod
+    def isBeamContained(cls, beam_outer, beam_inner, rtol=1.e-6):
+        """ Check if beam_inner (bmaj,bmin,pa) lies entirely within beam_outer (bmaj,bmin,pa) """
+
+        # - beam_inner is contained if (outer - inner) covariance is positive semi-definite
+        diff = Utils.getBeamCovariance(*beam_outer) - Utils.getBeamCovariance(*beam_inner)
+        tr = diff[0, 0] + diff[1, 1]
+        det = diff[0, 0]*diff[1, 1] - diff[0, 1]*diff[1, 0]
+        eig_min = 0.5*tr - np.sqrt(max(0.25*tr*tr - det, 0.))
+        tol = rtol*beam_outer[0]*beam_outer[0]
+
+        return eig_min >= -tol
+
+    @classmethod
+    def findContainingBeam(cls, beams, rtol=1.e-6):
+        """ Return index of the beam (bmaj,bmin,pa) containing all the others, -1 if none exists """
+
+        nbeams = len(beams)
+        if nbeams <= 0:
+            return -1
+
+        # - All beams circular: the common beam is simply the largest one
+        bmaj = np.array([beam[0] for beam in beams], dtype=np.float64)
+        bmin = np.array([beam[1] for beam in beams], dtype=np.float64)
+        if np.allclose(bmaj, bmin, rtol=rtol, atol=0):
+            return int(np.argmax(bmaj))
+
+        # - Otherwise the only candidate is the beam with largest area, check it contains all others
+        index = int(np.argmax(bmaj*bmin))
+        for i in range(nbeams):
+            if i == index:
+                continue
+            if not Utils.isBeamContained(beams[index], beams[i], rtol):
+                return -1
+
+        return index
+
+    @classmethod
+    def getSeparableKernel(cls, kernel, rtol=1.e-5):
+        """ Return the (kx,ky) 1D factors of a separable 2D kernel, None if kernel is not separable """
+
+        # - A separable kernel is the outer product of its (normalized) marginals
+        ksum = kernel.sum()
+        if ksum == 0:
+            return None
+        kx = kernel.sum(axis=0)
+        ky = kernel.sum(axis=1)/ksum
+        residual = np.abs(np.outer(ky, kx) - kernel).max()
+        if residual > rtol*np.abs(kernel).max():
+            return None
+
+        return kx, ky
+
+    @classmethod
+    def fixImgAxisAndUnits(cls, filename, outfile, dtype=np.float32):
         """ Fix image axis issues and convert units """
 
-        # - Open input file
+        # - Open input file (flux scaling is applied below during type conversion)
         try:
-            hdu = fits.open(filename, memmap=False)
+            hdu = fits.open(filename, memmap=False, do_not_scale_image_data=True)
         except Exception as ex:
             logger.error('Cannot read image file: ' + filename)
             return -1
@@ -851,28 +964,18 @@ class Utils(object):
         # - Close input file
         hdu.close()
 
-        # - Scale flux?
-        bscale = 1
-        bzero = 0
-        if 'BZERO' in output_header:
-            bzero = output_header['BZERO']
-        if 'BSCALE' in output_header:
-            bscale = output_header['BSCALE']
-
+        # - Convert data to native float (float32 by default) and scale flux?
+        bscale = output_header['BSCALE'] if 'BSCALE' in output_header else 1
+        bzero = output_header['BZERO'] if 'BZERO' in output_header else 0
         if bzero != 0 or bscale != 1:
             logger.info("Scaling image " + filename + " flux by bscale=" +
                         str(bscale) + ", bzero=" + str(bzero) + " ...")
-            output_data_scaled = bzero + bscale*output_data
-            output_data = output_data_scaled
-            output_header['BSCALE'] = 1
-            output_header['BZERO'] = 0
+
+        output_data = Utils.toNativeFloat(output_data, output_header, dtype)
 
         # - Add missing BMAJ/BMIN to header?
         # ...
 
-        # - Convert data to float 32
-        output_data = output_data.astype(np.float32)
-
         # - Write "fixed" fits
         Utils.write_fits(output_data, outfile, output_header)
 
@@ -889,11 +992,11 @@ class Utils(object):
         return I_JyBeam
 
     @classmethod
-    def convertImgToJyPixel(cls, filename, outfile, survey='',default_bunit=''):
+    def convertImgToJyPixel(cls, filename, outfile, survey='',default_bunit='', dtype=None):
         """ Convert image units from original to Jy/pixel """
 
         # - Read fits image
-        data, header = Utils.read_fits(filename)
+        data, header = Utils.read_fits(filename, dtype)
         wcs = WCS(header)
 
         # - Read WCS axis name
@@ -1049,12 +1152,17 @@ class Utils(object):
             logger.error('Units ' + units + ' not recognized!')
             return -1
 
-        # - Scale data
-        data_conv = data*convFactor
+        # - Scale data (in place if data were converted at read time)
+        if dtype is not None:
+            data_conv = data
+            data_conv *= convFactor
+        else:
+            data_conv = data*convFactor
         header_conv = header
 
         # - Edit header
         header_conv['BUNIT'] = 'Jy/pixel'
+        header_conv['JYPIXCF'] = (convFactor, 'Conversion factor from original units to Jy/pixel')
 
         # - Write converted fits to file
         Utils.write_fits(data_conv, outfile, header_conv)
@@ -1062,15 +1170,66 @@ class Utils(object):
         return 0
 
     @classmethod
-    def cropImage(cls, filename, ra, dec, crop_mode, crop_size, outfile, source_size=-1, nanfill=True, nanfill_mode='imgmin', nanfill_val=0):
-        """ Crop image around (ra,dec) by crop_size """
+    def sliceContainedCutout(cls, data, header, ra, dec, cutout_size):
+        """ Slice a cutout of size cutout_size (deg) around (ra,dec) from 2D image data, keeping the image pixel grid.
+            Return sliced data (copy) and header, or (None, None) if the cutout is not fully contained in the image.
+        """
+        try:
+            wcs = WCS(header)
+            position = SkyCoord(ra=ra, dec=dec, unit='deg', frame="fk5")
+            cutout = Cutout2D(data, position, cutout_size*u.deg, wcs=wcs, mode='strict', copy=True)
+        except ValueError:
+            # - Raised by strict mode for partial/no overlap
+            return None, None
 
-        # - Read fits image
-        data, header = Utils.read_fits(filename)
-        wcs = WCS(header)
-        dx = abs(header['CDELT1'])  # in deg
-        dy = abs(header['CDELT2'])  # in deg
-        pix_size = max(dx, dy)  # in deg
+        # - Shift reference pixel to the slice origin
+        xmin, ymin = cutout.origin_original
+        cutout_header = header.copy()
+        cutout_header['CRPIX1'] = header['CRPIX1'] - xmin
+        cutout_header['CRPIX2'] = header['CRPIX2'] - ymin
+
+        return cutout.data, cutout_header
+
+    @classmethod
+    def cropData(cls, data, wcs, x0, y0, crop_size_pix, nanfill=True, nanfill_mode='imgmin', nanfill_val=0):
+        """ Crop data of size crop_size_pix around pixel (x0,y0) and return cropped data and wcs.
+            If the crop box is fully inside the image and contains no nan to be filled the returned data is a view of the input data (no copy).
+            Otherwise the crop box is padded with nan and, if nanfill is enabled, nans are replaced with image min (nanfill_mode='imgmin') or nanfill_val.
+        """
+
+        # - Extract cutout. With option 'partial' when cutout size is larger than image size the cutout will be padded with nan.
+        #   Cutout2D returns a view of data when the box is fully contained.
+        cutout = Cutout2D(data, (x0, y0), (crop_size_pix, crop_size_pix), mode='partial', wcs=wcs, copy=False)
+        output_data = cutout.data
+        is_view = np.may_share_memory(output_data, data)
+
+        # - Fill NAN? (copy first if data is a view)
+        if nanfill:
+            nan_mask = np.isnan(output_data)
+            if nan_mask.any():
+                if is_view:
+                    output_data = output_data.copy()
+                if nanfill_mode == 'imgmin':
+                    output_data[nan_mask] = np.nanmin(output_data)
+                else:
+                    output_data[nan_mask] = nanfill_val
+
+        return output_data, cutout.wcs
+
+    @classmethod
+    def cropImage(cls, filename, ra, dec, crop_mode, crop_size, outfile, source_size=-1, nanfill=True, nanfill_mode='imgmin', nanfill_val=0, dtype=None, data=None, wcs=None, header=None):
+        """ Crop image (read from filename or given as in-memory data & wcs, or data & header) around (ra,dec) by crop_size """
+
+        # - Read fits image unless data are given
+        if data is None:
+            data, header = Utils.read_fits(filename, dtype)
+            wcs = WCS(header)
+        elif header is not None:
+            header = header.copy()
+            wcs = WCS(header)
+        else:
+            header = wcs.to_header()
+        pix_size = max(proj_plane_pixel_scales(wcs.celestial))  # in deg
         data_shape= data.shape 
         ndim= data.ndim
         
@@ -1187,14 +1346,18 @@ class Utils(object):
         is_galactic= (wcs_axis_types[0]=='GLON') and (wcs_axis_types[1]=='GLAT')
 
         # - Check if crop size is cutting part of the source
+        source_size_pix = -1
         if source_size != -1:
             source_size_pix = source_size/pix_size
 
         crop_size_pix = 0
 
         if crop_mode == 'pixel':
-            crop_size_pix = crop_size
-            if source_size_pix >= crop_size_pix:
+            if isinstance(crop_size, u.Quantity):
+                crop_size_pix = crop_size.to_value(u.deg)/pix_size
+            else:
+                crop_size_pix = crop_size
+            if source_size != -1 and source_size_pix >= crop_size_pix:
                 logger.warning("Requested crop size (%d) smaller than source size (size=%d arcsec, %d pix), won't write cropped fits file!" % (crop_size_pix, source_size*3600, source_size_pix))
                 return -1
         elif crop_mode == 'factor':
@@ -1232,27 +1395,17 @@ class Utils(object):
             logger.warning(errmsg)
             raise Exception(errmsg)
         
-        # - Extract cutout. With option 'partial' when cutout size is larger than image size the cutout will be filled with nan (or specified value)
+        # - Extract cutout
         try:
-            cutout = Cutout2D(data, (x0, y0), (crop_size_pix,crop_size_pix), mode='partial', wcs=wcs)
+            output_data, output_wcs = Utils.cropData(data, wcs, x0, y0, crop_size_pix, nanfill, nanfill_mode, nanfill_val)
         except Exception as e:
             logger.error("Failed to create cutout (err=%s)!" % str(e))
             return -1
 
-        output_data = cutout.data
-
-        # - Fill NAN?
-        if nanfill:
-            if nanfill_mode == 'imgmin':
-                img_min = np.nanmin(output_data)
-                output_data[np.isnan(output_data)] = img_min
-            else:
-                output_data[np.isnan(output_data)] = nanfill_val
-
         # - Create new header copying old one but overriding NAXIS keywords
         #   NB: Not working, need to change also CRPIX, use cutout.wcs.to_header()
         output_header= header
-        output_header.update(cutout.wcs.to_header())
+        output_header.update(output_wcs.to_header())
         #output_header['NAXIS']= 2
         #output_header['NAXIS1']= output_data.shape[1]
         #output_header['NAXIS2']= output_data.shape[0]
@@ -1265,57 +1418,525 @@ class Utils(object):
         return 0
 
     @classmethod
-    def estimateBkgFromAnnulus(cls, filename, ra, dec, R1, R2, method='sigmaclip', max_nan_thr=0.1):
+    def getLocalPixelCoords(cls, wcs, ra, dec, offset=1.):
+        """ Return pixel coordinates (x,y) and local pixel scale (deg/pixel) at sky positions ra/dec (deg, scalars or arrays) """
+
+        # - Convert positions to pixel coordinates (handles celestial frame of the image)
+        wcs_cel = wcs.celestial
+        center = SkyCoord(np.atleast_1d(ra)*u.deg, np.atleast_1d(dec)*u.deg, frame='fk5')
+        x0, y0 = wcs_cel.world_to_pixel(center)
+
+        # - Compute local pixel scale from the pixel distance of a point offset by a small angle
+        center_off = center.directional_offset_by(0.*u.deg, offset*u.arcsec)
+        x1, y1 = wcs_cel.world_to_pixel(center_off)
+        pixscale = (offset/3600.)/np.hypot(x1-x0, y1-y0)
+
+        return np.atleast_1d(x0), np.atleast_1d(y0), pixscale
+
+    @classmethod
+    def getAnnulusPixels(cls, data, x0, y0, r1, r2):
+        """ Return data values of pixels with center inside the annulus of radii r1<=r<r2 (in pixels) around (x0,y0) """
+
+        # - Return empty selection for undefined centers (e.g. positions outside the WCS projection)
+        if not np.isfinite(x0) or not np.isfinite(y0):
+            return np.empty(0, dtype=data.dtype)
+
+        # - Compute annulus bounding box, clipped to image
+        ny, nx = data.shape
+        xmin = max(int(np.floor(x0-r2)), 0)
+        xmax = min(int(np.ceil(x0+r2)), nx-1)
+        ymin = max(int(np.floor(y0-r2)), 0)
+        ymax = min(int(np.ceil(y0+r2)), ny-1)
+        if xmin > xmax or ymin > ymax:
+            return np.empty(0, dtype=data.dtype)
+
+        # - Select pixels by distance from center within the box
+        dy, dx = np.ogrid[ymin-y0:ymax+1-y0, xmin-x0:xmax+1-x0]
+        d2 = dx*dx + dy*dy
+        mask = (d2 >= r1*r1) & (d2 < r2*r2)
+
+        return data[ymin:ymax+1, xmin:xmax+1][mask]
+
+    @classmethod
+    def fastMedian(cls, samples):
+        """ Return the nan-ignoring median of a 1D sample, or of each row of a 2D stack of (nan-padded) samples """
+
+        x = np.asarray(samples)
+        if x.ndim == 1:
+            x = x[~np.isnan(x)]
+            n = x.size
+            if n == 0:
+                return np.nan
+            lo = (n-1)//2
+            hi = n//2
+            x = np.partition(x, [lo, hi])
+            return 0.5*(x[lo] + x[hi])
+
+        # - Nans are partitioned to the end of each row, so order statistics are taken from the valid counts
+        n = np.count_nonzero(~np.isnan(x), axis=1)
+        lo = np.maximum((n-1)//2, 0)
+        hi = n//2
+        hi[n == 0] = 0
+        x = np.partition(x, np.unique(np.concatenate((lo, hi))), axis=1)
+        rows = np.arange(x.shape[0])
+        median = 0.5*(x[rows, lo] + x[rows, hi])
+        median[n == 0] = np.nan
+
+        return median
+
+    @classmethod
+    def fastSigmaClippedStats(cls, samples, nsigma=3, maxiters=5):
+        """ Return the nan-ignoring median and rms of a 1D sample (or of each row of a 2D stack of samples)
+            after iterative clipping at nsigma times the rms around the median (as in astropy sigma_clipped_stats)
+        """
+
+        x = np.array(samples, dtype=np.float64)
+        is_1d = (x.ndim == 1)
+        x = np.atleast_2d(x)
+
+        for i in range(maxiters):
+            median = Utils.fastMedian(x)
+            absdev = np.abs(x - median[:, np.newaxis])
+            rms = Utils.__nanRms(x)
+            with np.errstate(invalid='ignore'):
+                clipped = absdev > nsigma*rms[:, np.newaxis]
+            if not clipped.any():
+                break
+            x[clipped] = np.nan
+
+        median = Utils.fastMedian(x)
+        rms = Utils.__nanRms(x)
+        if is_1d:
+            return median[0], rms[0]
+
+        return median, rms
+
+    @classmethod
+    def __nanRms(cls, x):
+        """ Return the nan-ignoring standard deviation of each row of a 2D stack (nan for empty rows) """
+        n = np.count_nonzero(~np.isnan(x), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(x, axis=1)/n
+            return np.sqrt(np.nansum((x - mean[:, np.newaxis])**2, axis=1)/n)
+
+    @classmethod
+    def fastSigmaClippedMedian(cls, samples, nsigma=3, maxiters=5):
+        """ Return the nan-ignoring median of a 1D sample (or of each row of a 2D stack of samples)
+            after iterative clipping at nsigma times the rms around the median
+        """
+        return Utils.fastSigmaClippedStats(samples, nsigma, maxiters)[0]
+
+    @classmethod
+    def estimateBkgFromAnnulus(cls, filename, ra, dec, R1, R2, method='sigmaclip', max_nan_thr=0.1, dtype=None):
         """ Estimate bkg from annulus around given sky position """
 
         # - Read fits image
-        data, header = Utils.read_fits(filename)
+        data, header = Utils.read_fits(filename, dtype)
         wcs = WCS(header)
 
-        # - Define sky annulus region
-        center = SkyCoord(ra*u.deg, dec*u.deg, frame='fk5')
-        annulus_sky = CircleAnnulusSkyRegion(
-            center=center,
-            inner_radius=R1*u.arcsec,
-            outer_radius=R2*u.arcsec
-        )
-
-        # - Convert sky annulus to pixel annulus
-        annulus_pix = annulus_sky.to_pixel(wcs)
-
-        # - Get mask corresponding to annulus and array of pixel values in the mask
-        mask = annulus_pix.to_mask()
-        mask_data = mask.to_image(shape=data.shape)
-        aperture_pixel_data = data[mask_data == 1]
+        # - Compute bkg in annulus
+        bkg, nan_fract = Utils.estimateBkgFromAnnuli(data, wcs, ra, dec, R1, R2, method, max_nan_thr)
+        if bkg is None:
+            logger.error("Failed to estimate bkg in annulus of image %s, returning -1!" % (filename))
+            return -1
 
-        # - Integrity check before computing stats
-        npixels = aperture_pixel_data.size
-        if npixels == 0:
-            logger.warning("Pixel mask is empty, returning zero!")
+        if nan_fract[0] > max_nan_thr:
+            logger.warning("Pixel mask is empty or fraction of nan pixels in mask (%s) exceeding max threshold (%s), returning zero!" % (
+                str(nan_fract[0]), str(max_nan_thr)))
             return 0
 
-        nan_counts = np.count_nonzero(np.isnan(aperture_pixel_data))
-        nan_fract = float(nan_counts)/float(npixels)
-        if nan_fract > max_nan_thr:
-            logger.warning("Fraction of nan pixels in mask (%s) exceeding max threshold (%s), returning zero!" % (
-                str(nan_fract), str(max_nan_thr)))
-            return 0
+        return bkg[0]
 
-        # - Compute median or 3-sigma clipped value as bkg estimator
-        bkg = 0
+    @classmethod
+    def estimateBkgFromAnnuli(cls, data, wcs, ra, dec, R1, R2, method='sigmaclip', max_nan_thr=0.1):
+        """ Estimate bkg from annuli (radii R1/R2 in arcsec) around many sky positions of the same image.
+            Return arrays of bkg and fraction of nan pixels in each annulus (1 for empty annuli).
+            Bkg is set to zero where the nan fraction exceeds max_nan_thr.
+        """
+
+        # - Check method
+        if method not in ['median', 'sigmaclip']:
+            logger.error(
+                "Invalid bkg estimation method (%s) given!" % (method))
+            return None, None
+
+        # - Convert all annulus centers and radii to pixel coordinates at once
+        ra = np.atleast_1d(ra)
+        dec = np.atleast_1d(dec)
+        nsources = ra.size
+        x0, y0, pixscale = Utils.getLocalPixelCoords(wcs, ra, dec)
+        r1_pix = np.broadcast_to(R1, (nsources,))/3600./pixscale
+        r2_pix = np.broadcast_to(R2, (nsources,))/3600./pixscale
+
+        # - Collect annulus pixels passing integrity checks
+        bkg = np.zeros(nsources)
+        nan_fract = np.ones(nsources)
         nsigma = 3
-        if method == 'median':
-            bkg = np.median(aperture_pixel_data)
-        elif method == 'sigmaclip':
-            mean, median, rms = sigma_clipped_stats(
-                aperture_pixel_data, sigma=nsigma)
-            bkg = median
+        good_indices = []
+        good_samples = []
+
+        for i in range(nsources):
+            aperture_pixel_data = Utils.getAnnulusPixels(data, x0[i], y0[i], r1_pix[i], r2_pix[i])
+
+            npixels = aperture_pixel_data.size
+            if npixels == 0:
+                continue
+
+            nan_counts = np.count_nonzero(np.isnan(aperture_pixel_data))
+            nan_fract[i] = float(nan_counts)/float(npixels)
+            if nan_fract[i] > max_nan_thr:
+                continue
+
+            good_indices.append(i)
+            good_samples.append(aperture_pixel_data)
+
+        # - Compute median or 3-sigma clipped median as bkg estimator, processing annuli in nan-padded stacks
+        chunk_size = 256
+        for start in range(0, len(good_indices), chunk_size):
+            samples = good_samples[start:start+chunk_size]
+            stack = np.full((len(samples), max(sample.size for sample in samples)), np.nan)
+            for k, sample in enumerate(samples):
+                stack[k, :sample.size] = sample
+
+            if method == 'median':
+                bkg[good_indices[start:start+chunk_size]] = Utils.fastMedian(stack)
+            else:
+                bkg[good_indices[start:start+chunk_size]] = Utils.fastSigmaClippedMedian(stack, nsigma=nsigma)
+
+        return bkg, nan_fract
+
+    @classmethod
+    def computeBkgMesh(cls, data, box_size, nsigma=3, max_nan_thr=0.5):
+        """ Compute coarse bkg and rms meshes of an image as sigma-clipped median/rms in boxes of box_size x box_size pixels.
+            Boxes with a nan pixel fraction above max_nan_thr are set to nan.
+        """
+
+        ny, nx = data.shape
+        nby = int(np.ceil(ny/float(box_size)))
+        nbx = int(np.ceil(nx/float(box_size)))
+        bkg_mesh = np.full((nby, nbx), np.nan)
+        rms_mesh = np.full((nby, nbx), np.nan)
+
+        # - Process one row of boxes at a time as a stack of samples, padding image borders with nan
+        for j in range(nby):
+            rows = np.full((box_size, nbx*box_size), np.nan)
+            block = data[j*box_size:(j+1)*box_size, :]
+            rows[:block.shape[0], :nx] = block
+            stack = rows.reshape(box_size, nbx, box_size).transpose(1, 0, 2).reshape(nbx, box_size*box_size)
+
+            nvalid = np.count_nonzero(~np.isnan(stack), axis=1)
+            nan_fract = 1. - nvalid/float(box_size*box_size)
+            good = nan_fract <= max_nan_thr
+            if not good.any():
+                continue
+
+            median, rms = Utils.fastSigmaClippedStats(stack[good], nsigma=nsigma)
+            bkg_mesh[j, good] = median
+            rms_mesh[j, good] = rms
+
+        return bkg_mesh, rms_mesh
+
+    @classmethod
+    def interpolateBkgMesh(cls, mesh, box_size, x, y):
+        """ Bilinearly interpolate mesh (computed with computeBkgMesh) at image pixel coordinates x/y (nan if close to invalid boxes).
+            Positions beyond the outer box centers take the value of the nearest edge box.
+        """
+        from scipy.ndimage import map_coordinates
+
+        # - Box centers are at pixel (j+0.5)*box_size-0.5
+        xm = (np.atleast_1d(x) + 0.5)/float(box_size) - 0.5
+        ym = (np.atleast_1d(y) + 0.5)/float(box_size) - 0.5
+        values = map_coordinates(mesh, [ym, xm], order=1, mode='nearest')
+
+        return values
+
+    @classmethod
+    def getBkgMesh(cls, filename, box_size, cache_dir, nsigma=3, max_nan_thr=0.5):
+        """ Return bkg & rms meshes and celestial WCS of given image, reading them from cache in cache_dir if up to date,
+            or computing and caching them otherwise. Return None in case of failure.
+        """
+
+        # - Check if an up-to-date cached mesh exists
+        try:
+            tile_stat = os.stat(filename)
+        except OSError:
+            logger.error("Cannot access image file " + filename + "!")
+            return None
+
+        # - Cache file is keyed by tile path, mtime & size, so a modified or different tile with the same name never hits it
+        tile_key = '%s:%d:%d' % (os.path.abspath(filename), tile_stat.st_mtime_ns, tile_stat.st_size)
+        tile_hash = hashlib.sha1(tile_key.encode('utf-8')).hexdigest()[:16]
+        mesh_file = Utils.getBaseFileNoExt(filename) + '_' + tile_hash + '_bkgmesh' + str(box_size) + '.fits'
+        mesh_file_fullpath = os.path.join(cache_dir, mesh_file)
+
+        # - Meshes already computed or read in this process are not read again (also if they could not be written to cache)
+        memo_key = (tile_hash, box_size)
+        if memo_key in cls.bkg_meshes:
+            return cls.bkg_meshes[memo_key]
+
+        if os.path.isfile(mesh_file_fullpath):
+            try:
+                with fits.open(mesh_file_fullpath, memmap=False) as hdul:
+                    header = hdul[0].header
+                    if header['TILEMTIM'] == int(tile_stat.st_mtime) and header['TILESIZE'] == tile_stat.st_size:
+                        cls.bkg_meshes[memo_key] = (hdul[0].data.astype(np.float64), hdul['RMS'].data.astype(np.float64), WCS(header))
+                        return cls.bkg_meshes[memo_key]
+                logger.info("Cached bkg mesh " + mesh_file_fullpath + " is stale, recomputing it ...")
+            except Exception as e:
+                logger.warning("Failed to read cached bkg mesh " + mesh_file_fullpath + " (err=" + str(e) + "), recomputing it ...")
+
+        # - Compute mesh
+        logger.info("Computing bkg mesh (box=%d pix) for image %s ..." % (box_size, filename))
+        try:
+            data, header = Utils.read_fits(filename, dtype=np.float32)
+        except Exception as e:
+            logger.error("Failed to read image " + filename + " (err=" + str(e) + ")!")
+            return None
+
+        wcs = WCS(header).celestial
+        bkg_mesh, rms_mesh = Utils.computeBkgMesh(data, box_size, nsigma, max_nan_thr)
+
+        # - Write mesh to cache (write to tmp file and rename, to be safe with concurrent writers)
+        mesh_header = wcs.to_header()
+        mesh_header['BOXSIZE'] = box_size
+        mesh_header['TILEMTIM'] = int(tile_stat.st_mtime)
+        mesh_header['TILESIZE'] = tile_stat.st_size
+        hdul = fits.HDUList([
+            fits.PrimaryHDU(bkg_mesh.astype(np.float32), mesh_header),
+            fits.ImageHDU(rms_mesh.astype(np.float32), name='RMS')
+        ])
+
+        try:
+            Utils.mkdir(cache_dir)
+            mesh_file_tmp = mesh_file_fullpath + '.' + str(os.getpid()) + '.tmp'
+            hdul.writeto(mesh_file_tmp, overwrite=True)
+            os.replace(mesh_file_tmp, mesh_file_fullpath)
+        except Exception as e:
+            logger.warning("Failed to write bkg mesh cache file " + mesh_file_fullpath + " (err=" + str(e) + ")!")
         else:
-            logger.error(
-                "Invalid bkg estimation method (%s) given, returning zero!" % (method))
-            return -1
+            # - Remove meshes cached for previous versions of the tile (same name, other hash)
+            stale_pattern = Utils.getBaseFileNoExt(filename) + '_' + '[0-9a-f]'*16 + '_bkgmesh*.fits'
+            for stale_file in fnmatch.filter(os.listdir(cache_dir), stale_pattern):
+                if stale_file.startswith(Utils.getBaseFileNoExt(filename) + '_' + tile_hash + '_'):
+                    continue
+                logger.info("Removing stale bkg mesh cache file " + stale_file + " ...")
+                try:
+                    os.remove(os.path.join(cache_dir, stale_file))
+                except OSError:
+                    pass
+
+        cls.bkg_meshes[memo_key] = (bkg_mesh, rms_mesh, wcs)
+
+        return cls.bkg_meshes[memo_key]
+
+    @classmethod
+    def estimateBkgFromMesh(cls, filename, ra, dec, box_size, cache_dir):
+        """ Estimate bkg & rms at given sky positions by interpolating the (cached) bkg mesh of image. Return (None,None) on failure. """
+
+        res = Utils.getBkgMesh(filename, box_size, cache_dir)
+        if res is None:
+            return None, None
+        bkg_mesh, rms_mesh, wcs = res
+
+        x0, y0, pixscale = Utils.getLocalPixelCoords(wcs, ra, dec)
+        ny, nx = bkg_mesh.shape
+        outside = (x0 < -0.5) | (y0 < -0.5) | (x0 > nx*box_size-0.5) | (y0 > ny*box_size-0.5)
+        bkg = Utils.interpolateBkgMesh(bkg_mesh, box_size, x0, y0)
+        rms = Utils.interpolateBkgMesh(rms_mesh, box_size, x0, y0)
+        bkg[outside] = np.nan
+        rms[outside] = np.nan
+
+        return bkg, rms
+
+    @classmethod
+    def getPositionGroups(cls, ra, dec, tolerance, radii=None, radius_tolerance=0.):
+        """ Group sky positions ra/dec (deg) lying within tolerance (deg) of a group leader and, if radii are given, with a radius
+            within radius_tolerance (relative) of the leader radius. Leaders are taken in input order. Return the index of the group leader of each position.
+        """
+        from scipy.spatial import cKDTree
+
+        ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+        dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+        leaders = np.full(ra.size, -1, dtype=int)
+        if ra.size == 0:
+            return leaders
+
+        # - Search neighbours on unit vectors (chord distance), avoiding RA wrap & pole issues
+        xyz = np.column_stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)))
+        chord = 2*np.sin(np.radians(tolerance)/2)
+        neighbours = cKDTree(xyz).query_ball_point(xyz, chord)
+
+        for index in range(ra.size):
+            if leaders[index] >= 0:
+                continue
+            leaders[index] = index
+            for neighbour in neighbours[index]:
+                if leaders[neighbour] >= 0:
+                    continue
+                if radii is not None and abs(radii[neighbour] - radii[index]) > radius_tolerance*abs(radii[index]):
+                    continue
+                leaders[neighbour] = index
+
+        return leaders
+
+    @classmethod
+    def getFoFGroups(cls, ra, dec, sizes):
+        """ Friends-of-friends grouping of square cutouts of given sizes (deg) centred on ra/dec (deg): two cutouts are linked
+            if their centers are closer than half the sum of their sizes. Return the group label (smallest index in group) of each cutout.
+        """
+        from scipy.spatial import cKDTree
+
+        ra = np.radians(np.atleast_1d(np.asarray(ra, dtype=float)))
+        dec = np.radians(np.atleast_1d(np.asarray(dec, dtype=float)))
+        sizes = np.atleast_1d(np.asarray(sizes, dtype=float))
+        parents = np.arange(ra.size)
+        if ra.size == 0:
+            return parents
+
+        def find(index):
+            while parents[index] != index:
+                parents[index] = parents[parents[index]]
+                index = parents[index]
+            return index
+
+        # - Find candidate pairs within the max linking length on unit vectors, then apply pair linking length
+        xyz = np.column_stack((np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)))
+        max_chord = 2*np.sin(np.radians(sizes.max())/2)
+        pairs = cKDTree(xyz).query_pairs(max_chord, output_type='ndarray')
+        if pairs.size > 0:
+            chords = np.linalg.norm(xyz[pairs[:, 0]] - xyz[pairs[:, 1]], axis=1)
+            link_chords = 2*np.sin(np.radians(0.5*(sizes[pairs[:, 0]] + sizes[pairs[:, 1]]))/2)
+            for i, j in pairs[chords < link_chords]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+
+        return np.array([find(index) for index in range(ra.size)])
+
+    @classmethod
+    def getClusterFootprint(cls, ra, dec, sizes):
+        """ Return center ra/dec (deg) and size (deg) of the smallest square (in the tangent plane at the mean position) containing
+            the square cutouts of given sizes (deg) centred on ra/dec
+        """
+
+        ra = np.atleast_1d(np.asarray(ra, dtype=float))
+        dec = np.atleast_1d(np.asarray(dec, dtype=float))
+        sizes = np.atleast_1d(np.asarray(sizes, dtype=float))
+
+        # - Offsets from first position (wrapping RA), scaled by cos(dec) at mean dec
+        dec0 = np.mean(dec)
+        ra_offsets = (ra - ra[0] + 180.) % 360. - 180.
+        ra0 = ra[0] + np.mean(ra_offsets)
+        cosdec = np.cos(np.radians(dec0))
+        dx = (ra_offsets - np.mean(ra_offsets))*cosdec
+        dy = dec - dec0
+
+        xmin, xmax = np.min(dx - sizes/2), np.max(dx + sizes/2)
+        ymin, ymax = np.min(dy - sizes/2), np.max(dy + sizes/2)
+        ra_c = (ra0 + 0.5*(xmin + xmax)/cosdec) % 360.
+        dec_c = dec0 + 0.5*(ymin + ymax)
+        size = max(xmax - xmin, ymax - ymin)
+
+        return ra_c, dec_c, size
+
+    @classmethod
+    def getHilbertIndex(cls, ra, dec, order=16):
+        """ Return the index of sky positions ra/dec (deg) along a Hilbert curve of given order
+            covering the (ra, sin(dec)) plane, i.e. a grid of 2^order x 2^order equal-area cells
+        """
+
+        # - Map positions to integer cell coordinates
+        n = 1 << order
+        ra = np.mod(np.atleast_1d(np.asarray(ra, dtype=np.float64)), 360.)
+        dec = np.atleast_1d(np.asarray(dec, dtype=np.float64))
+        x = np.clip((ra/360.*n).astype(np.int64), 0, n-1)
+        y = np.clip((0.5*(np.sin(np.radians(dec))+1.)*n).astype(np.int64), 0, n-1)
+
+        # - Compute curve index, rotating the quadrant at each level
+        index = np.zeros(x.shape, dtype=np.int64)
+        s = n >> 1
+        while s > 0:
+            rx = ((x & s) > 0).astype(np.int64)
+            ry = ((y & s) > 0).astype(np.int64)
+            index += s*s*((3*rx) ^ ry)
+
+            flip = (ry == 0) & (rx == 1)
+            x = np.where(flip, n-1-x, x)
+            y = np.where(flip, n-1-y, y)
+            swap = (ry == 0)
+            x, y = np.where(swap, y, x), np.where(swap, x, y)
+            s >>= 1
+
+        return index
+
+    @classmethod
+    def getSkyShardIndices(cls, ra, dec, nshards, cell_order=6):
+        """ Return the shard index (0..nshards-1) of sky positions ra/dec (deg). Shards are contiguous
+            ranges along a Hilbert curve with balanced source counts, never splitting sky cells of given order.
+        """
+
+        cells = Utils.getHilbertIndex(ra, dec, order=cell_order)
+        if cells.size == 0:
+            return cells
+
+        # - Assign each cell to the shard containing the first source of the cell in curve order
+        ucells, counts = np.unique(cells, return_counts=True)
+        nbefore = np.cumsum(counts) - counts
+        cell_shards = (nshards*nbefore)//cells.size
+
+        return cell_shards[np.searchsorted(ucells, cells)]
+
+    @classmethod
+    def getTileReuseRatio(cls, tile_lists, window=1):
+        """ Return the fraction of tile accesses (one list of tiles per source, in processing order)
+            hitting a tile already read by one of the previous `window` sources
+        """
+
+        naccesses = 0
+        nreused = 0
+        for index, tiles in enumerate(tile_lists):
+            recent_tiles = set()
+            for prev_tiles in tile_lists[max(index-window, 0):index]:
+                recent_tiles.update(prev_tiles)
+            naccesses += len(tiles)
+            nreused += sum([1 for tile in tiles if tile in recent_tiles])
+
+        if naccesses == 0:
+            return 0.
+
+        return float(nreused)/naccesses
+
+    @classmethod
+    def getSurveyPixelScale(cls, metadata_tbl):
+        """ Return the median pixel scale (deg) of the survey images listed in a Montage metadata table (None if not available) """
+
+        try:
+            table = ascii.read(metadata_tbl)
+            pixscales = np.abs(np.asarray(table['cdelt2'], dtype=np.float64))
+        except Exception as ex:
+            logger.warning("Failed to read pixel scale from metadata table %s (err=%s)!" % (metadata_tbl, str(ex)))
+            return None
+
+        pixscales = pixscales[pixscales > 0]
+        if pixscales.size == 0:
+            return None
+
+        return float(np.median(pixscales))
+
+    @classmethod
+    def estimateCutoutMemory(cls, cutout_size, pixscales, regrid=True, itemsize=4):
+        """ Return the estimated peak memory (bytes) needed to process cutouts of given size (deg) from surveys with given pixel scales (deg).
+            Raw cutouts are read one at a time, while regridded/convolved cutouts on the common grid (finest pixel if regridding)
+            are counted three times each (input, output and working copy).
+        """
+
+        if not pixscales:
+            return 0
+
+        npix = [(cutout_size/pixscale)**2 for pixscale in pixscales]
+        npix_common = (cutout_size/min(pixscales))**2 if regrid else max(npix)
 
-        return bkg
+        return int(itemsize*(max(npix) + 3*len(pixscales)*npix_common))
 
     @classmethod
     def makeMosaic(cls, input_tbl, output, combine="mean", background_match=False, bitpix=-32, exact=False):
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+##################################################
+###          MODULE IMPORT
+##################################################
+## STANDARD MODULES
+import os
+import sys
+import json
+import time
+import sqlite3
+import logging
+
+##############################
+##     GLOBAL VARS
+##############################
+logger = logging.getLogger(__name__)
+
+
+###########################
+##     CLASS DEFINITIONS
+###########################
+class WorkQueue(object):
+	""" Source work queue stored in a SQLite database.
+	    Processes (on the same host or on hosts sharing the filesystem) lease pending sources, renew their leases while processing and mark them as done or failed.
+	    Sources with expired leases (e.g. owner process crashed) are leased again, up to a max number of attempts.
+	    The default rollback journal is used (WAL mode is not safe on network filesystems).
+	    Operations failing with database errors (e.g. database locked for longer than the connection timeout) are retried with exponential backoff.
+	"""
+
+	def __init__(self,filename,lease_timeout=600.,max_attempts=3,max_retries=5,retry_delay=1.):
+		""" Return a work queue object """
+
+		self.filename= filename
+		self.lease_timeout= lease_timeout
+		self.max_attempts= max_attempts
+		self.max_retries= max_retries
+		self.retry_delay= retry_delay
+		self.conn= None
+
+	#==============================
+	#     OPEN QUEUE
+	#==============================
+	def open(self):
+		""" Open (creating if not existing) queue database """
+
+		try:
+			self.conn= sqlite3.connect(self.filename,timeout=60.,isolation_level=None)
+			self.conn.execute(
+				"CREATE TABLE IF NOT EXISTS sources ("
+				"id INTEGER PRIMARY KEY AUTOINCREMENT, obj_name TEXT UNIQUE, ra REAL, dec REAL, radius REAL, "
+				"status TEXT DEFAULT 'pending', owner TEXT, lease_expiry REAL, attempts INTEGER DEFAULT 0, "
+				"errmsg TEXT DEFAULT '', elapsed REAL DEFAULT 0, outputs TEXT DEFAULT '[]')"
+			)
+			self.conn.execute("CREATE INDEX IF NOT EXISTS sources_status ON sources (status)")
+			self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+		except Exception as e:
+			logger.error("Failed to open work queue %s (err=%s)!" % (self.filename,str(e)))
+			return -1
+
+		return 0
+
+	def close(self):
+		""" Close queue database """
+		if self.conn is not None:
+			self.conn.close()
+			self.conn= None
+
+	#==============================
+	#     RETRY OPERATIONS
+	#==============================
+	def __retry(self,func,*args):
+		""" Call func(*args), retrying with exponential backoff if it fails with a database error. The last error is raised after max_retries attempts. """
+
+		delay= self.retry_delay
+		for attempt in range(1,self.max_retries+1):
+			try:
+				return func(*args)
+			except sqlite3.OperationalError as e:
+				if attempt>=self.max_retries:
+					logger.error("Work queue %s operation failed %d times (err=%s), giving up!" % (self.filename,attempt,str(e)))
+					raise
+				logger.warn("Work queue %s operation failed (err=%s), retrying in %.1f s (attempt %d/%d) ..." % (self.filename,str(e),delay,attempt,self.max_retries))
+				time.sleep(delay)
+				delay*= 2
+
+	def __rollback(self):
+		""" Rollback current transaction, if any """
+		if self.conn.in_transaction:
+			self.conn.execute("ROLLBACK")
+
+	#==============================
+	#     ADD SOURCES
+	#==============================
+	def add_sources(self,sources,config_hash):
+		""" Add sources (ra,dec,obj_name,radius) not already present in queue. Fails if queue was created with different processing options. """
+
+		try:
+			res= self.__retry(self.__add_sources,sources,config_hash)
+		except Exception as e:
+			logger.error("Failed to add sources to work queue %s (err=%s)!" % (self.filename,str(e)))
+			return -1
+
+		if res is None:
+			logger.error("Work queue %s was created with different config options, cannot add sources!" % (self.filename))
+			return -1
+
+		nsources_before, nsources= res
+		logger.info("Added %d new sources to work queue %s (%d sources in queue) ..." % (nsources-nsources_before,self.filename,nsources))
+
+		return 0
+
+	def __add_sources(self,sources,config_hash):
+		""" Add sources in a single transaction. Return number of sources in queue before and after adding them, or None if config hash does not match. """
+
+		try:
+			self.conn.execute("BEGIN IMMEDIATE")
+			row= self.conn.execute("SELECT value FROM meta WHERE key='config_hash'").fetchone()
+			if row is None:
+				self.conn.execute("INSERT INTO meta (key,value) VALUES ('config_hash',?)",(config_hash,))
+			elif row[0]!=config_hash:
+				self.conn.execute("ROLLBACK")
+				return None
+
+			nsources_before= self.conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+			self.conn.executemany(
+				"INSERT OR IGNORE INTO sources (obj_name,ra,dec,radius) VALUES (?,?,?,?)",
+				[(obj_name,ra,dec,radius) for ra, dec, obj_name, radius in sources]
+			)
+			nsources= self.conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+			self.conn.execute("COMMIT")
+		except:
+			self.__rollback()
+			raise
+
+		return nsources_before, nsources
+
+	#==============================
+	#     LEASE SOURCES
+	#==============================
+	def lease(self,owner,nmax=1):
+		""" Lease up to nmax pending (or expired) sources to owner. Return list of (id,(ra,dec,obj_name,radius)). """
+		return self.__retry(self.__lease,owner,nmax)
+
+	def __lease(self,owner,nmax):
+		""" Lease sources in a single transaction """
+
+		now= time.time()
+
+		try:
+			self.conn.execute("BEGIN IMMEDIATE")
+
+			# - Give up sources whose leases expired too many times
+			self.conn.execute(
+				"UPDATE sources SET status='failed', errmsg='Lease expired too many times' "
+				"WHERE status='leased' AND lease_expiry<? AND attempts>=?",
+				(now,self.max_attempts)
+			)
+
+			rows= self.conn.execute(
+				"SELECT id, ra, dec, obj_name, radius FROM sources "
+				"WHERE status='pending' OR (status='leased' AND lease_expiry<?) ORDER BY id LIMIT ?",
+				(now,nmax)
+			).fetchall()
+
+			self.conn.executemany(
+				"UPDATE sources SET status='leased', owner=?, lease_expiry=?, attempts=attempts+1 WHERE id=?",
+				[(owner,now+self.lease_timeout,row[0]) for row in rows]
+			)
+			self.conn.execute("COMMIT")
+		except:
+			self.__rollback()
+			raise
+
+		return [(row[0],(row[1],row[2],row[3],row[4])) for row in rows]
+
+	def renew(self,owner):
+		""" Extend the leases held by owner """
+		self.__retry(self.__renew,owner)
+
+	def __renew(self,owner):
+		""" Extend leases """
+		self.conn.execute(
+			"UPDATE sources SET lease_expiry=? WHERE status='leased' AND owner=?",
+			(time.time()+self.lease_timeout,owner)
+		)
+
+	#==============================
+	#     COMPLETE SOURCE
+	#==============================
+	def complete(self,source_id,owner,result):
+		""" Store result of leased source. Results for leases lost by owner (expired and leased again) are discarded. """
+
+		cur= self.__retry(
+			self.conn.execute,
+			"UPDATE sources SET status=?, errmsg=?, elapsed=?, outputs=? WHERE id=? AND owner=? AND status='leased'",
+			(result['status'],result['errmsg'],result['elapsed'],json.dumps(result['outputs']),source_id,owner)
+		)
+		if cur.rowcount!=1:
+			logger.warn("Lease of source %s was lost by %s, discarding its result ..." % (result['obj_name'],owner))
+			return -1
+
+		return 0
+
+	#==============================
+	#     QUEUE STATUS
+	#==============================
+	def get_counts(self):
+		""" Return dictionary with number of sources per status """
+		rows= self.__retry(lambda: self.conn.execute("SELECT status, COUNT(*) FROM sources GROUP BY status").fetchall())
+		return dict(rows)
+
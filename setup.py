@@ -29,7 +29,6 @@ reqs.append('numpy>=1.10')
 reqs.append('astropy')
 reqs.append('montage-wrapper')
 reqs.append('radio-beam')
-reqs.append('regions')
 
 if PY_MAJOR_VERSION<=2:
 	print("PYTHON 2 detected")
@@ -62,7 +61,8 @@ setup(
 	long_description_content_type='text/markdown',
 	packages=['scutout'],
 	install_requires=reqs,
-	scripts=['scripts/run_scutout.py'],
+	extras_require={'mpi': ['mpi4py']},
+	scripts=['scripts/run_scutout.py','scripts/merge_scutout_manifests.py','scripts/gc_scutout_cache.py','scripts/get_scutout_hdf5_cutouts.py'],
 	classifiers=[
     'Development Status :: 5 - Production/Stable',
     'Intended Audience :: Science/Research',
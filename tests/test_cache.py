@@ -0,0 +1,273 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import importlib.util
+import numpy as np
+from astropy.io import fits
+from unittest.mock import patch
+from . import context
+from scutout.cache import CutoutCache, RawCutoutCache
+from scutout.utils import Utils
+
+
+class CutoutCacheTest(unittest.TestCase):
+    """Tests for 'cache' module"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.workdir, 'cache')
+        self.tile = self._writeFile('tile.fits', 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _writeFile(self, filename, nbytes):
+        filename = os.path.join(self.workdir, filename)
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(nbytes))
+        return filename
+
+    def _store(self, cache, key, nbytes=1000):
+        filename = self._writeFile(key + '.fits', nbytes)
+        self.assertEqual(cache.store(key, {'first': filename}, obj_name=key), 0)
+        return filename
+
+    def _setAccessTime(self, cache, key, atime):
+        meta_file = os.path.join(self.cache_dir, key[:2], key, 'meta.json')
+        os.utime(meta_file, (atime, atime))
+
+    def test_get_key(self):
+        key = CutoutCache.get_key([self.tile], 10.0, -5.0, 0.1, 'abc')
+        self.assertEqual(key, CutoutCache.get_key([self.tile, self.tile], 10.0, -5.0, 0.1, 'abc'))
+        self.assertNotEqual(key, CutoutCache.get_key([self.tile], 10.0, -5.0, 0.2, 'abc'))
+        self.assertNotEqual(key, CutoutCache.get_key([self.tile], 10.0, -5.0, 0.1, 'def'))
+
+        # modified tile gives a different key, missing tile is not cached
+        stat = os.stat(self.tile)
+        os.utime(self.tile, ns=(stat.st_atime_ns, stat.st_mtime_ns+1000))
+        self.assertNotEqual(key, CutoutCache.get_key([self.tile], 10.0, -5.0, 0.1, 'abc'))
+        self.assertIsNone(CutoutCache.get_key([os.path.join(self.workdir, 'missing.fits')], 10.0, -5.0, 0.1, 'abc'))
+
+    def test_store_fetch(self):
+        cache = CutoutCache(self.cache_dir)
+        self.assertIsNone(cache.fetch('aa01'))
+
+        filename = self._store(cache, 'aa01')
+        meta = cache.fetch('aa01')
+        self.assertEqual(meta['obj_name'], 'aa01')
+        with open(filename, 'rb') as f1, open(meta['files']['first'], 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertFalse(os.access(meta['files']['first'], os.W_OK) and os.getuid() != 0)
+
+        # entries are written in tmp dir and moved in place, an existing entry is kept
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, 'tmp')), [])
+        self.assertEqual(cache.store('aa01', {'first': self._writeFile('other.fits', 10)}), 0)
+        self.assertEqual(os.path.getsize(cache.fetch('aa01')['files']['first']), 1000)
+
+        # failed store leaves no entry
+        self.assertEqual(cache.store('aa02', {'first': os.path.join(self.workdir, 'missing.fits')}), -1)
+        self.assertIsNone(cache.fetch('aa02'))
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, 'tmp')), [])
+
+        # entry with missing files is not returned
+        os.remove(meta['files']['first'])
+        self.assertIsNone(cache.fetch('aa01'))
+
+    def test_store_Eviction(self):
+        cache = CutoutCache(self.cache_dir, max_size=3500)
+        now = time.time()
+        for index, key in enumerate(['aa01', 'aa02', 'aa03']):
+            self._store(cache, key)
+            self._setAccessTime(cache, key, now-100+index)
+
+        # least recently used entry is evicted first, fetched entries are recently used
+        self.assertIsNotNone(cache.fetch('aa01'))
+        self._store(cache, 'aa04')
+        self.assertIsNone(cache.fetch('aa02'))
+        self.assertIsNotNone(cache.fetch('aa01'))
+        self.assertIsNotNone(cache.fetch('aa04'))
+        self.assertLessEqual(cache.get_size(), 3500*0.9)
+
+    def test_store_SizeIndex(self):
+        cache = CutoutCache(self.cache_dir, max_size=10000)
+        self._store(cache, 'aa01')
+
+        # cache is not scanned while the running size is below max size
+        with patch.object(CutoutCache, 'get_entries') as mock_entries:
+            self._store(cache, 'aa02')
+            self._store(cache, 'aa03')
+            mock_entries.assert_not_called()
+
+        with open(os.path.join(self.cache_dir, 'size.idx')) as f:
+            self.assertEqual(int(f.read()), cache.get_size())
+
+        # other processes storing in the same cache update the same index
+        CutoutCache(self.cache_dir, max_size=10000).store('aa04', {'first': self._writeFile('aa04.fits', 1000)})
+        with open(os.path.join(self.cache_dir, 'size.idx')) as f:
+            self.assertEqual(int(f.read()), cache.get_size())
+
+    def test_gc(self):
+        cache = CutoutCache(self.cache_dir)
+        for key in ['aa01', 'bb02']:
+            self._store(cache, key)
+        self._setAccessTime(cache, 'aa01', time.time()-100)
+
+        # stale tmp entry left by a killed run
+        stale_dir = os.path.join(self.cache_dir, 'tmp', 'cc03.host.1')
+        os.makedirs(stale_dir)
+        os.utime(stale_dir, (time.time()-7200, time.time()-7200))
+
+        self.assertEqual(cache.gc(max_size=1500, tmp_max_age=3600), 2)
+        self.assertFalse(os.path.exists(stale_dir))
+        self.assertIsNone(cache.fetch('aa01'))
+        self.assertIsNotNone(cache.fetch('bb02'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'aa')))
+
+
+def make_cutout(ra, dec, npix, pixscale=1./3600.):
+    """ Return data (pixel values = pixel index) and TAN header of a square cutout around (ra,dec) with given pixel scale (deg) """
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = npix
+    header['NAXIS2'] = npix
+    header['CTYPE1'] = 'RA---TAN'
+    header['CTYPE2'] = 'DEC--TAN'
+    header['CRVAL1'] = ra
+    header['CRVAL2'] = dec
+    header['CRPIX1'] = (npix + 1)/2.
+    header['CRPIX2'] = (npix + 1)/2.
+    header['CDELT1'] = -pixscale
+    header['CDELT2'] = pixscale
+    data = np.arange(npix*npix, dtype=np.float32).reshape(npix, npix)
+    return data, header
+
+
+class RawCutoutCacheTest(unittest.TestCase):
+    """Tests for 'cache' module in-memory raw cutout cache"""
+
+    def setUp(self):
+        # - 200x200 arcsec cutout (1 arcsec pixels, 160 kB)
+        self.data, self.header = make_cutout(10.0, 0.0, 200)
+        self.size = 200./3600.
+
+    def test_get_Contained(self):
+        cache = RawCutoutCache(10*self.data.nbytes)
+        self.assertEqual(cache.get('tile1', 10.0, 0.0, 60./3600.), (None, None))
+        cache.add('tile1', 10.0, 0.0, self.size, self.data, self.header)
+
+        # nested cutout sliced from the cached one, keeping the pixel grid
+        data, header = cache.get('tile1', 10.0 + 30./3600., 0.0, 60./3600.)
+        self.assertIsNotNone(data)
+        self.assertLessEqual(abs(data.shape[0] - 60), 1)
+        self.assertLessEqual(abs(data.shape[1] - 60), 1)
+        x0 = int(round(self.header['CRPIX1'] - header['CRPIX1']))
+        y0 = int(round(self.header['CRPIX2'] - header['CRPIX2']))
+        self.assertTrue(np.array_equal(data, self.data[y0:y0+data.shape[0], x0:x0+data.shape[1]]))
+        self.assertEqual(header['CDELT1'], self.header['CDELT1'])
+
+        # other tile, larger cutout or cutout crossing the cached cutout border are not served
+        self.assertEqual(cache.get('tile2', 10.0, 0.0, 60./3600.), (None, None))
+        self.assertEqual(cache.get('tile1', 10.0, 0.0, 300./3600.), (None, None))
+        self.assertEqual(cache.get('tile1', 10.0 + 80./3600., 0.0, 60./3600.), (None, None))
+        self.assertEqual((cache.nhits, cache.nmisses), (1, 4))
+
+    def test_get_QuickReject(self):
+        cache = RawCutoutCache(10*self.data.nbytes)
+        cache.add('tile1', 10.0, 0.0, self.size, self.data, self.header)
+
+        with patch('scutout.cache.Utils.sliceContainedCutout', wraps=Utils.sliceContainedCutout) as mock_slice:
+            # cutouts far from the cached cutout are rejected without slicing
+            self.assertEqual(cache.get('tile1', 10.0 + 110./3600., 0.0, 60./3600.), (None, None))
+            mock_slice.assert_not_called()
+
+            # contained cutout in a corner, farther than the half-size difference from the center, is not rejected
+            data, header = cache.get('tile1', 10.0 + 60./3600., 60./3600., 60./3600.)
+            self.assertIsNotNone(data)
+            self.assertEqual(mock_slice.call_count, 1)
+
+    def test_add_Eviction(self):
+        cache = RawCutoutCache(2.5*self.data.nbytes)
+        for tile in ['tile1', 'tile2', 'tile3']:
+            cache.add(tile, 10.0, 0.0, self.size, self.data, self.header)
+
+        # least recently used cutout dropped above max size, served cutouts are recently used
+        self.assertEqual(list(cache.entries.keys()), [('tile2', 10.0, 0.0, self.size), ('tile3', 10.0, 0.0, self.size)])
+        self.assertIsNotNone(cache.get('tile2', 10.0, 0.0, 60./3600.)[0])
+        cache.add('tile4', 10.0, 0.0, self.size, self.data, self.header)
+        self.assertEqual([key[0] for key in cache.entries.keys()], ['tile2', 'tile4'])
+        self.assertEqual(cache.size, 2*self.data.nbytes)
+
+        # re-added cutout is not counted twice, cutout larger than max size is not cached
+        cache.add('tile4', 10.0, 0.0, self.size, self.data, self.header)
+        self.assertEqual(cache.size, 2*self.data.nbytes)
+        big_data, big_header = make_cutout(10.0, 0.0, 400)
+        cache.add('tile5', 10.0, 0.0, 400./3600., big_data, big_header)
+        self.assertEqual([key[0] for key in cache.entries.keys()], ['tile2', 'tile4'])
+
+    def test_ThreadSafety(self):
+        cache = RawCutoutCache(3*self.data.nbytes)
+        errors = []
+
+        def run(index):
+            try:
+                for n in range(20):
+                    cache.add('tile%d' % ((index + n) % 5), 10.0, 0.0, self.size, self.data, self.header)
+                    data, header = cache.get('tile%d' % (n % 5), 10.0, 0.0, 60./3600.)
+                    if data is not None and data.shape != (60, 60):
+                        errors.append(data.shape)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(cache.nhits + cache.nmisses, 8*20)
+        self.assertEqual(cache.size, sum([entry['data'].nbytes for entry in cache.entries.values()]))
+        self.assertLessEqual(cache.size, cache.max_size)
+
+
+class GcCacheScriptTest(unittest.TestCase):
+    """Tests for 'gc_scutout_cache.py' script"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.workdir, 'cache')
+        script = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'gc_scutout_cache.py')
+        spec = importlib.util.spec_from_file_location('gc_scutout_cache', script)
+        self.script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.script)
+
+        cache = CutoutCache(self.cache_dir)
+        for index, key in enumerate(['aa01', 'bb02', 'cc03']):
+            filename = os.path.join(self.workdir, key + '.fits')
+            with open(filename, 'wb') as f:
+                f.write(os.urandom(100000))
+            cache.store(key, {'first': filename})
+            meta_file = os.path.join(self.cache_dir, key[:2], key, 'meta.json')
+            os.utime(meta_file, (time.time()-100+index, time.time()-100+index))
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _runScript(self, *args):
+        with patch.object(sys, 'argv', ['gc_scutout_cache.py'] + list(args)):
+            return self.script.main()
+
+    def test_gc(self):
+        self.assertEqual(self._runScript('--cache_dir', self.cache_dir, '--max_size', '0.2'), 0)
+        cache = CutoutCache(self.cache_dir)
+        self.assertIsNone(cache.fetch('aa01'))
+        self.assertIsNotNone(cache.fetch('bb02'))
+        self.assertIsNotNone(cache.fetch('cc03'))
+        self.assertLessEqual(cache.get_size(), 0.2*1024*1024)
+
+    def test_gc_MissingCacheDir(self):
+        self.assertEqual(self._runScript('--cache_dir', os.path.join(self.workdir, 'missing')), 1)
@@ -0,0 +1,97 @@
+import unittest
+import os
+import shutil
+import tempfile
+from . import context
+from scutout.config import Config
+
+
+class ConfigTest(unittest.TestCase):
+    """Tests for 'config' module"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _parseConfig(self, text):
+        filename = os.path.join(self.workdir, 'config.ini')
+        with open(filename, 'w') as f:
+            f.write(text)
+        config = Config()
+        self.assertEqual(config.parse(filename, validate=False), 0)
+        return config
+
+    def test_get_hash_RunOptionsExcluded(self):
+        config = self._parseConfig('[RUN]\nworkdir = \n\n[CUTOUT_SEARCH]\nsurveys = first\n\n[FIRST_DATA]\nmetadata = \n')
+        config_hash = config.get_hash()
+
+        # run/execution options do not change the produced cutouts
+        config.workdir = self.workdir
+        config.keep_tmpfiles = not config.keep_tmpfiles
+        config.nworkers = 8
+        config.source_order = 'hilbert'
+        config.cache_dir = self.workdir
+        self.assertEqual(config.get_hash(), config_hash)
+
+        # processing options do
+        config.crop_size = 2*config.crop_size
+        self.assertNotEqual(config.get_hash(), config_hash)
+
+    def _variantsText(self, variants=''):
+        return '[RUN]\nworkdir = %s\n\n[CUTOUT_SEARCH]\nsurveys = first\nconvolve = yes\ncrop_size = 1.2\n\n[BKG_SUBTRACTION]\nbkg_outer_radius_factor = 1.2\n\n[FIRST_DATA]\nmetadata = \n' % self.workdir + variants
+
+    def test_parse_Variants(self):
+        config = self._parseConfig(self._variantsText(
+            '\n[CUTOUT_SEARCH:base]\n'
+            '\n[CUTOUT_SEARCH:noconv]\nconvolve = no\n'
+            '\n[CUTOUT_SEARCH:widebkg]\ncrop_size = 2.0\n\n[BKG_SUBTRACTION:widebkg]\nbkg_outer_radius_factor = 1.5\n'
+        ))
+        variants = {variant.variant_name: variant for variant in config.variants}
+        self.assertEqual(list(variants.keys()), ['base', 'noconv', 'widebkg'])
+
+        # variants override base options, and write outputs in <workdir>/<name>
+        self.assertTrue(variants['base'].convolve)
+        self.assertFalse(variants['noconv'].convolve)
+        self.assertEqual(variants['noconv'].crop_size, 1.2)
+        self.assertEqual(variants['widebkg'].crop_size, 2.0)
+        self.assertEqual(variants['widebkg'].bkg_outer_radius_factor, 1.5)
+        self.assertEqual(variants['noconv'].bkg_outer_radius_factor, 1.2)
+        for name, variant in variants.items():
+            self.assertEqual(variant.workdir, os.path.join(self.workdir, name))
+            self.assertEqual(variant.surveys, ['first'])
+
+        # empty variant produces the same cutouts as the base config
+        self.assertEqual(variants['base'].get_hash(), self._parseConfig(self._variantsText()).get_hash())
+
+    def test_parse_Variants_InvalidName(self):
+        filename = os.path.join(self.workdir, 'config.ini')
+        with open(filename, 'w') as f:
+            f.write(self._variantsText('\n[CUTOUT_SEARCH:]\nconvolve = no\n'))
+        self.assertEqual(Config().parse(filename, validate=False), -1)
+
+    def test_get_hash_Variants(self):
+        config_hash = self._parseConfig(self._variantsText()).get_hash()
+        noconv_hash = self._parseConfig(self._variantsText('\n[CUTOUT_SEARCH:noconv]\nconvolve = no\n')).get_hash()
+        self.assertNotEqual(noconv_hash, config_hash)
+
+        # variant options change the hash
+        other_hash = self._parseConfig(self._variantsText('\n[CUTOUT_SEARCH:noconv]\nconvolve = no\ncrop_size = 2.0\n')).get_hash()
+        self.assertNotEqual(other_hash, noconv_hash)
+        self.assertEqual(self._parseConfig(self._variantsText('\n[CUTOUT_SEARCH:noconv]\nconvolve = no\n')).get_hash(), noconv_hash)
+
+    def test_get_hash_ClusterOptions(self):
+        config = self._parseConfig(self._variantsText())
+        config_hash = config.get_hash()
+
+        # cluster size has no effect on outputs without clustering
+        config.cluster_max_size = 2*config.cluster_max_size
+        self.assertEqual(config.get_hash(), config_hash)
+
+        # clustered outputs differ from single-source ones
+        config.cluster_sources = True
+        cluster_hash = config.get_hash()
+        self.assertNotEqual(cluster_hash, config_hash)
+        config.cluster_max_size = 2*config.cluster_max_size
+        self.assertNotEqual(config.get_hash(), cluster_hash)
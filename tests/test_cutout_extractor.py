@@ -0,0 +1,1027 @@
+import unittest
+import os
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+import types
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+from astropy.wcs import WCS
+from astropy.nddata import Cutout2D
+from astropy.coordinates import SkyCoord
+import astropy.units as u
+from unittest.mock import patch
+from . import context
+from scutout import cutout_extractor
+from scutout.config import Config
+from scutout.manifest import Manifest
+from scutout.work_queue import WorkQueue
+from scutout.hdf5_store import Hdf5CutoutStore, has_h5py
+
+
+class StubHelper(object):
+    """Stub cutout helper running the pipeline phases of a source without survey data"""
+
+    STAGE_OPTIONS = cutout_extractor.CutoutHelper.STAGE_OPTIONS
+
+    def __init__(self, config, ra, dec, obj_name, radius=-1):
+        self.config = config
+        self.sname = obj_name
+        self.img_files = {}
+        self.reused_stages = []
+        self.output_files = []
+        self.cache_hit = False
+        self.tile_reads_saved = 0
+
+    def get_tile_files(self):
+        return []
+
+    def get_process_state(self):
+        return {'img_files': dict(self.img_files), 'reused_stages': list(self.reused_stages)}
+
+    def set_process_state(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def extract(self):
+        time.sleep(0.02*random.random())
+        if self.sname == 'S2':
+            return -1
+        self.img_files = {'first': 'raw'}
+        return 0
+
+    def process(self):
+        time.sleep(0.05*random.random())
+        if self.sname == 'S5':
+            raise ValueError('process error')
+        if self.sname == 'S7':
+            return -1
+        self.img_files = {'first': self.img_files['first'] + ',processed in %d' % os.getpid()}
+        self.reused_stages = ['extract']
+        return 0
+
+    def finalize(self):
+        if self.sname == 'S8':
+            return -1
+        outfile = os.path.join(self.config.workdir, self.sname + '.txt')
+        with open(outfile, 'w') as f:
+            f.write(self.img_files['first'])
+        self.output_files = [outfile]
+        return 0
+
+
+class RecordingHelper(StubHelper):
+    """Stub cutout helper writing a single output file per source and recording the processed sources"""
+
+    def run(self):
+        with open(os.path.join(self.config.workdir, 'processed.txt'), 'a') as f:
+            f.write(self.sname + '\n')
+        outfile = os.path.join(self.config.workdir, self.sname + '.txt')
+        with open(outfile, 'w') as f:
+            f.write('cutout of ' + self.sname)
+        self.output_files = [outfile]
+        return 0
+
+
+class SourceDirHelper(RecordingHelper):
+    """Stub cutout helper writing its output file in the source dir of the work dir, as the cutout helper does"""
+
+    def run(self):
+        outdir = os.path.join(self.config.workdir, self.sname)
+        os.makedirs(outdir, exist_ok=True)
+        with open(os.path.join(self.config.workdir, 'processed.txt'), 'a') as f:
+            f.write(self.sname + '\n')
+        outfile = os.path.join(outdir, self.sname + '_first.fits')
+        with open(outfile, 'w') as f:
+            f.write('cutout of ' + self.sname)
+        self.output_files = [outfile]
+        return 0
+
+
+class KillingHelper(RecordingHelper):
+    """Stub cutout helper whose worker process dies (as if killed by the OS) on source S3"""
+
+    def run(self):
+        if self.sname == 'S3':
+            os._exit(1)
+        time.sleep(0.05)
+        return RecordingHelper.run(self)
+
+
+class HangingHelper(StubHelper):
+    """Stub cutout helper whose extract stage hangs in a subprocess for the multi input image modes in hang_modes"""
+
+    hang_modes = []
+
+    def run(self):
+        with open(os.path.join(self.config.workdir, 'attempts.txt'), 'a') as f:
+            f.write(self.config.multi_input_img_mode + '\n')
+        self.stage_callback('extract')
+
+        if self.config.multi_input_img_mode in self.hang_modes:
+            proc = subprocess.Popen(['sleep', '60'])
+            with open(os.path.join(self.config.workdir, 'pids.txt'), 'a') as f:
+                f.write('%d\n' % proc.pid)
+            proc.wait()
+
+        self.output_files = [os.path.join(self.config.workdir, self.sname + '.txt')]
+        return 0
+
+
+class FakeStatus(object):
+    """Fake MPI status, set by the fake communicator on receive"""
+
+    def __init__(self):
+        self.source = -1
+        self.tag = -1
+
+    def Get_source(self):
+        return self.source
+
+    def Get_tag(self):
+        return self.tag
+
+
+FakeMPI = types.SimpleNamespace(Status=FakeStatus, ANY_SOURCE=-1, ANY_TAG=-1)
+
+
+class FakeMasterComm(object):
+    """Fake MPI communicator of rank 0, whose worker ranks return a result for each received source (the last busy rank answering first)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.sent = []
+        self.busy = []
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return self.size
+
+    def send(self, obj, dest, tag):
+        self.sent.append((dest, tag, obj))
+        if tag == cutout_extractor.MPI_TAG_WORK:
+            self.busy.append((dest, obj))
+
+    def recv(self, source, tag, status):
+        rank, obj = self.busy.pop()
+        status.source = rank
+        status.tag = tag
+        return cutout_extractor.make_source_result(obj)
+
+
+class FakeWorkerComm(object):
+    """Fake MPI communicator of a worker rank, receiving given (obj,tag) messages from rank 0"""
+
+    def __init__(self, rank, size, messages):
+        self.rank = rank
+        self.size = size
+        self.messages = list(messages)
+        self.sent = []
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    def send(self, obj, dest, tag):
+        self.sent.append((dest, tag, obj))
+
+    def recv(self, source, tag, status):
+        obj, status.tag = self.messages.pop(0)
+        status.source = source
+        return obj
+
+
+class CutoutFinderTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module search modes"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _makeConfig(self, text='', **options):
+        filename = os.path.join(self.workdir, 'config.ini')
+        with open(filename, 'w') as f:
+            f.write('[RUN]\nworkdir = \n\n[CUTOUT_SEARCH]\nsurveys = first\n\n[FIRST_DATA]\nmetadata = \n' + text)
+        config = Config()
+        self.assertEqual(config.parse(filename, validate=False), 0)
+        config.workdir = self.workdir
+        for name, value in options.items():
+            setattr(config, name, value)
+        return config
+
+    def _makeTable(self, nsources):
+        return Table({'RA': np.linspace(10, 20, nsources), 'DEC': np.zeros(nsources), 'OBJNAME': ['S%d' % i for i in range(nsources)]})
+
+    @patch('scutout.cutout_extractor.CutoutHelper', RecordingHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def _runSearch(self, config, nsources, mock_read, **kwargs):
+        """ Run search and return the list of processed sources """
+        mock_read.return_value = self._makeTable(nsources)
+        processed_file = os.path.join(self.workdir, 'processed.txt')
+        if os.path.isfile(processed_file):
+            os.remove(processed_file)
+
+        finder = cutout_extractor.CutoutFinder('sources.dat', config, **kwargs)
+        self.assertEqual(finder.run_search(), 0)
+        if not os.path.isfile(processed_file):
+            return []
+        with open(processed_file) as f:
+            return f.read().split()
+
+    def _readManifest(self):
+        manifest = Manifest(os.path.join(self.workdir, 'manifest.jsonl'))
+        self.assertEqual(manifest.read(), 0)
+        return manifest
+
+    def _countHeaders(self):
+        with open(os.path.join(self.workdir, 'manifest.jsonl')) as f:
+            return len([line for line in f if '"type": "header"' in line])
+
+    def test_run_search_Resume(self):
+        config = self._makeConfig()
+        self.assertEqual(self._runSearch(config, 4), ['S0', 'S1', 'S2', 'S3'])
+
+        # completed sources with existing outputs are skipped, and the manifest is extended
+        self.assertEqual(self._runSearch(config, 4, resume=True), [])
+        self.assertEqual(self._countHeaders(), 2)
+
+        # sources whose outputs changed size or are missing are processed again
+        with open(os.path.join(self.workdir, 'S1.txt'), 'a') as f:
+            f.write('modified')
+        os.remove(os.path.join(self.workdir, 'S2.txt'))
+        self.assertEqual(self._runSearch(config, 4, resume=True), ['S1', 'S2'])
+        self.assertEqual(sorted(self._readManifest().get_completed().keys()), ['S0', 'S1', 'S2', 'S3'])
+
+    def test_run_search_Resume_ConfigChanged(self):
+        config = self._makeConfig()
+        self.assertEqual(self._runSearch(config, 3), ['S0', 'S1', 'S2'])
+
+        # previous manifest is replaced by a new one if processing options changed
+        config.crop_size = 2*config.crop_size
+        self.assertEqual(self._runSearch(config, 3, resume=True), ['S0', 'S1', 'S2'])
+        self.assertEqual(self._countHeaders(), 1)
+        self.assertEqual(self._readManifest().header['config_hash'], config.get_hash())
+
+    def test_run_search_Resume_TruncatedManifest(self):
+        config = self._makeConfig()
+        self.assertEqual(self._runSearch(config, 3), ['S0', 'S1', 'S2'])
+
+        # run killed while writing the last record
+        manifest_file = os.path.join(self.workdir, 'manifest.jsonl')
+        with open(manifest_file) as f:
+            content = f.read()
+        with open(manifest_file, 'w') as f:
+            f.write(content[:-20])
+
+        self.assertEqual(self._runSearch(config, 3, resume=True), ['S2'])
+        self.assertEqual(sorted(self._readManifest().get_completed().keys()), ['S0', 'S1', 'S2'])
+
+    def _assertKilledWorkerRun(self, finder):
+        """ Check that a run with a killed worker records all processed sources, the killed one as failed, and writes manifest and summary """
+        with self.assertLogs('scutout', level='INFO') as logs:
+            self.assertEqual(finder.run_search(), 0)
+        self.assertTrue(any(['Processed %d sources' % len(finder.results) in line for line in logs.output]))
+
+        results = {result['obj_name']: result for result in finder.results}
+        self.assertEqual(results['S3']['status'], 'failed')
+        self.assertIn('terminated abruptly', results['S3']['errmsg'])
+        for result in finder.results:
+            if result['status'] == 'done':
+                self.assertEqual(result['outputs'], [os.path.join(self.workdir, result['obj_name'] + '.txt')])
+
+        manifest = Manifest(finder.manifest.filename)
+        self.assertEqual(manifest.read(), 0)
+        self.assertEqual(sorted([record['obj_name'] for record in manifest.records]), sorted(results.keys()))
+        return results
+
+    @patch('scutout.cutout_extractor.CutoutHelper', KillingHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Parallel_KilledWorker(self, mock_read):
+        nsources = 16
+        mock_read.return_value = self._makeTable(nsources)
+        config = self._makeConfig(nworkers=2)
+
+        # chunks in progress (at most 2 per worker, of 2 sources) when the worker died fail, the next ones are processed in a new pool
+        results = self._assertKilledWorkerRun(cutout_extractor.CutoutFinder('sources.dat', config))
+        self.assertEqual(len(results), nsources)
+        self.assertLessEqual(len([result for result in results.values() if result['status'] != 'done']), 4*config.nworkers)
+        self.assertEqual(results['S%d' % (nsources-1)]['status'], 'done')
+
+    @patch('scutout.cutout_extractor.CutoutHelper', KillingHelper)
+    @patch('scutout.cutout_extractor.Utils.getSurveyPixelScale', return_value=1./3600)
+    @patch('scutout.cutout_extractor.Utils.estimateCutoutMemory', return_value=100*1024**2)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Parallel_KilledWorkerMemoryBudget(self, mock_read, mock_memory, mock_pixscale):
+        nsources = 8
+        mock_read.return_value = self._makeTable(nsources)
+        config = self._makeConfig(nworkers=2, max_memory=250)
+
+        results = self._assertKilledWorkerRun(cutout_extractor.CutoutFinder('sources.dat', config))
+        self.assertEqual(len(results), nsources)
+        self.assertEqual(results['S%d' % (nsources-1)]['status'], 'done')
+
+    @patch('scutout.cutout_extractor.CutoutHelper', KillingHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Queue_KilledWorker(self, mock_read):
+        nsources = 8
+        mock_read.return_value = self._makeTable(nsources)
+        config = self._makeConfig(nworkers=2)
+        queue_file = os.path.join(self.workdir, 'queue.db')
+
+        # leasing stops, sources in progress are completed as failed and the others left pending for other processes
+        results = self._assertKilledWorkerRun(cutout_extractor.CutoutFinder('sources.dat', config, queue_file=queue_file))
+        queue = WorkQueue(queue_file)
+        self.assertEqual(queue.open(), 0)
+        counts = queue.get_counts()
+        queue.close()
+        self.assertNotIn('leased', counts)
+        self.assertEqual(counts.get('pending', 0), nsources-len(results))
+        self.assertEqual(counts.get('failed', 0), len([result for result in results.values() if result['status'] == 'failed']))
+
+    @patch('scutout.cutout_extractor.Utils.getSurveyPixelScale', return_value=1./3600)
+    @patch('scutout.cutout_extractor.Utils.estimateCutoutMemory')
+    def test_get_chunks(self, mock_memory, mock_pixscale):
+        MB = 1024**2
+        mock_memory.side_effect = [10*MB, 20*MB, 300*MB, 10*MB, 40*MB, 10*MB, 10*MB]
+        finder = cutout_extractor.CutoutFinder('sources.dat', self._makeConfig())
+        finder.sources = [(10.0, 0.0, 'S%d' % i, -1) for i in range(7)]
+        get_chunks = finder._CutoutFinder__get_chunks
+
+        # chunk memory is the max among its sources, oversize sources run alone in their own chunk
+        chunks = get_chunks(3, 100*MB)
+        self.assertEqual([[source[2] for source in chunk] for chunk, memory in chunks], [['S0', 'S1'], ['S2'], ['S3', 'S4', 'S5'], ['S6']])
+        self.assertEqual([memory for chunk, memory in chunks], [20*MB, 300*MB, 40*MB, 10*MB])
+
+        # without memory budget sources are split in chunks of given size
+        chunks = get_chunks(3, 0)
+        self.assertEqual([len(chunk) for chunk, memory in chunks], [3, 3, 1])
+        self.assertEqual([memory for chunk, memory in chunks], [0, 0, 0])
+
+    def _makeMPIFinder(self, comm, config=None):
+        with patch.object(cutout_extractor, 'MPI', types.SimpleNamespace(COMM_WORLD=comm), create=True):
+            return cutout_extractor.CutoutFinder('sources.dat', config or self._makeConfig(), use_mpi=True)
+
+    def _getMessages(self, comm, tag):
+        return [(dest, obj) for dest, msg_tag, obj in comm.sent if msg_tag == tag]
+
+    @patch.object(cutout_extractor, 'MPI', FakeMPI, create=True)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_MPIMaster(self, mock_read):
+        nsources = 5
+        mock_read.return_value = self._makeTable(nsources)
+        comm = FakeMasterComm(3)
+        finder = self._makeMPIFinder(comm)
+        self.assertEqual(finder.run_search(), 0)
+
+        # each source sent once to an idle worker rank, and all results collected in manifest
+        work = self._getMessages(comm, cutout_extractor.MPI_TAG_WORK)
+        self.assertEqual(sorted([source[2] for dest, source in work]), ['S%d' % i for i in range(nsources)])
+        self.assertEqual([dest for dest, source in work[:2]], [1, 2])
+        self.assertTrue(all([dest in [1, 2] for dest, source in work]))
+        self.assertEqual(sorted([result['obj_name'] for result in finder.results]), ['S%d' % i for i in range(nsources)])
+        self.assertEqual(sorted([record['obj_name'] for record in self._readManifest().records]), ['S%d' % i for i in range(nsources)])
+
+        # each worker rank stopped once, after its last source
+        stops = self._getMessages(comm, cutout_extractor.MPI_TAG_STOP)
+        self.assertEqual(sorted([dest for dest, obj in stops]), [1, 2])
+        self.assertEqual(comm.sent[-2:], [(dest, cutout_extractor.MPI_TAG_STOP, None) for dest, obj in stops])
+
+    @patch.object(cutout_extractor, 'MPI', FakeMPI, create=True)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_MPIMaster_MoreRanksThanSources(self, mock_read):
+        mock_read.return_value = self._makeTable(2)
+        comm = FakeMasterComm(5)
+        finder = self._makeMPIFinder(comm)
+        self.assertEqual(finder.run_search(), 0)
+
+        self.assertEqual(len(finder.results), 2)
+        self.assertEqual(sorted([dest for dest, obj in self._getMessages(comm, cutout_extractor.MPI_TAG_STOP)]), [1, 2, 3, 4])
+
+    @patch.object(cutout_extractor, 'MPI', FakeMPI, create=True)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_MPIMaster_ReadFailure(self, mock_read):
+        # master failing before dispatching sources releases worker ranks
+        mock_read.return_value = None
+        comm = FakeMasterComm(3)
+        finder = self._makeMPIFinder(comm)
+        self.assertEqual(finder.run_search(), -1)
+        self.assertEqual(comm.sent, [(1, cutout_extractor.MPI_TAG_STOP, None), (2, cutout_extractor.MPI_TAG_STOP, None)])
+
+    @patch.object(cutout_extractor, 'MPI', FakeMPI, create=True)
+    @patch('scutout.cutout_extractor.CutoutHelper', RecordingHelper)
+    def test_run_search_MPIWorker(self):
+        sources = [(10.0, 0.0, 'S0', -1), (12.0, 0.0, 'S1', -1)]
+        messages = [(source, cutout_extractor.MPI_TAG_WORK) for source in sources] + [(None, cutout_extractor.MPI_TAG_STOP)]
+        comm = FakeWorkerComm(2, 3, messages)
+        finder = self._makeMPIFinder(comm)
+
+        # worker processes received sources until stopped, sending results to rank 0 (no table read, no manifest)
+        self.assertEqual(finder.run_search(), 0)
+        self.assertEqual(comm.messages, [])
+        self.assertEqual([(dest, tag) for dest, tag, result in comm.sent], [(0, cutout_extractor.MPI_TAG_RESULT)]*2)
+        self.assertEqual([result['obj_name'] for dest, tag, result in comm.sent], ['S0', 'S1'])
+        self.assertEqual([result['status'] for dest, tag, result in comm.sent], ['done', 'done'])
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, 'manifest.jsonl')))
+
+    @patch.object(cutout_extractor, 'MPI', FakeMPI, create=True)
+    @patch('scutout.cutout_extractor.CutoutHelper', RecordingHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_MPISingleRank(self, mock_read):
+        # single rank: sources processed serially by rank 0, no messages sent
+        mock_read.return_value = self._makeTable(3)
+        comm = FakeMasterComm(1)
+        finder = self._makeMPIFinder(comm)
+        self.assertEqual(finder.run_search(), 0)
+        self.assertFalse(finder.use_mpi)
+        self.assertEqual(comm.sent, [])
+        with open(os.path.join(self.workdir, 'processed.txt')) as f:
+            self.assertEqual(f.read().split(), ['S0', 'S1', 'S2'])
+        self.assertEqual(len(self._readManifest().records), 3)
+
+    @patch('scutout.cutout_extractor.CutoutHelper', SourceDirHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Coalesce(self, mock_read):
+        # S1 within tolerance of S0 and with close radius (across a 1 arcsec rounding boundary), S2 with a different radius, S3 far away
+        mock_read.return_value = Table({
+            'RA': [10., 10., 10., 20.],
+            'DEC': [0., 0.5/3600, 0., 0.],
+            'OBJNAME': ['S0', 'S1', 'S2', 'S3'],
+            'RADIUS': [25.49, 25.51, 30., 25.5]
+        })
+        config = self._makeConfig(coalesce_tolerance=1.0, use_same_radius=False)
+
+        finder = cutout_extractor.CutoutFinder('sources.dat', config)
+        self.assertEqual(finder.run_search(), 0)
+        with open(os.path.join(self.workdir, 'processed.txt')) as f:
+            self.assertEqual(sorted(f.read().split()), ['S0', 'S2', 'S3'])
+
+        # outputs of the group leader are linked to the member source dir
+        results = {result['obj_name']: result for result in finder.results}
+        self.assertEqual(results['S1']['status'], 'done')
+        self.assertEqual(results['S1']['coalesced_with'], 'S0')
+        self.assertEqual(results['S1']['outputs'], [os.path.join(self.workdir, 'S1', 'S1_first.fits')])
+        with open(results['S1']['outputs'][0]) as f:
+            self.assertEqual(f.read(), 'cutout of S0')
+
+    @patch('scutout.cutout_extractor.CutoutHelper', SourceDirHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Variants(self, mock_read):
+        mock_read.return_value = self._makeTable(2)
+        config = self._makeConfig('\n[CUTOUT_SEARCH:base]\n\n[CUTOUT_SEARCH:noconv]\nconvolve = no\n')
+        for variant in config.variants:
+            variant.workdir = os.path.join(self.workdir, variant.variant_name)
+
+        finder = cutout_extractor.CutoutFinder('sources.dat', config)
+        self.assertEqual(finder.run_search(), 0)
+
+        # each source processed with all variants, outputs written in the variant output roots
+        self.assertEqual([result['status'] for result in finder.results], ['done', 'done'])
+        for result in finder.results:
+            name = result['obj_name']
+            self.assertEqual(result['outputs'], [
+                os.path.join(self.workdir, 'base', name, name + '_first.fits'),
+                os.path.join(self.workdir, 'noconv', name, name + '_first.fits')
+            ])
+        self.assertFalse(os.path.exists(os.path.join(self.workdir, 'S0')))
+
+    @patch('scutout.cutout_extractor.CutoutHelper', StubHelper)
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Pipeline(self, mock_read):
+        nsources = 12
+        mock_read.return_value = self._makeTable(nsources)
+        config = self._makeConfig(nworkers=3)
+
+        finder = cutout_extractor.CutoutFinder('sources.dat', config, use_pipeline=True)
+        self.assertEqual(finder.run_search(), 0)
+
+        # results in source order, with failures recorded per source
+        self.assertEqual([result['obj_name'] for result in finder.results], ['S%d' % i for i in range(nsources)])
+        failed = {result['obj_name']: result['errmsg'] for result in finder.results if result['status'] != 'done'}
+        self.assertEqual(failed, {
+            'S2': 'Raw cutout extraction failed',
+            'S5': 'process error',
+            'S7': 'Cutout processing failed',
+            'S8': 'Cutout writing failed'
+        })
+
+        # process phase runs in worker processes, and its state is returned to the write stage
+        for result in finder.results:
+            if result['status'] != 'done':
+                self.assertEqual(result['outputs'], [])
+                continue
+            self.assertEqual(result['outputs'], [os.path.join(self.workdir, result['obj_name'] + '.txt')])
+            self.assertEqual(result['reused_stages'], ['extract'])
+            with open(result['outputs'][0]) as f:
+                content = f.read()
+            self.assertTrue(content.startswith('raw,processed in '))
+            self.assertNotEqual(content, 'raw,processed in %d' % os.getpid())
+            self.assertEqual(result['output_sizes'], [len(content)])
+
+
+class StageCacheTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module stage cache"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.tile = os.path.join(self.workdir, 'tile.fits')
+        with open(self.tile, 'w') as f:
+            f.write('tile')
+        self.config = Config()
+        self.config.workdir = self.workdir
+        self.config.surveys = ['first']
+        self.config.stage_cache_dir = os.path.join(self.workdir, 'stage_cache')
+        self.config.subtract_bkg = True
+        self.config.regrid = True
+        self.config.convolve = True
+        self.config.crop_mode = 'pixel'
+        self.config.crop_size = 100
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _compute_coverage(self, helper, survey):
+        helper.coverage_tables[survey] = Table({'fname': [self.tile]})
+        return 0
+
+    def _makeStage(self, stage, option):
+        """ Return a stage method writing the previous stage product plus the stage name and option value """
+        def run_stage(helper):
+            self.calls.append(stage)
+            outdir = os.path.join(helper.tmpdir, stage)
+            os.makedirs(outdir, exist_ok=True)
+            for survey in helper.surveys:
+                content = ''
+                if survey in helper.img_files:
+                    with open(helper.img_files[survey]) as f:
+                        content = f.read()
+                filename = os.path.join(outdir, helper.sname + '_' + survey + '.fits')
+                with open(filename, 'w') as f:
+                    f.write(content + '|%s=%s' % (stage, getattr(helper.config, option)))
+                helper.img_files[survey] = filename
+                if stage == 'extract':
+                    helper.tile_files[survey] = [self.tile]
+                    helper.input_files[survey] = self.tile
+            return 0
+        return run_stage
+
+    def _runSource(self):
+        """ Run extract and process phases of a source and return the helper """
+        self.calls = []
+        shutil.rmtree(os.path.join(self.workdir, 'S1'), ignore_errors=True)
+
+        stages = {
+            '_CutoutHelper__compute_coverage': lambda helper, survey: self._compute_coverage(helper, survey),
+            '_CutoutHelper__extract_raw_cutouts': self._makeStage('extract', 'multi_input_img_mode'),
+            '_CutoutHelper__subtract_bkg': self._makeStage('subtract_bkg', 'bkg_outer_radius_factor'),
+            '_CutoutHelper__regrid_cutouts': self._makeStage('regrid', 'data_type'),
+            '_CutoutHelper__convolve_to_same_resolution': self._makeStage('convolve', 'data_type'),
+            '_CutoutHelper__crop': self._makeStage('crop', 'crop_size'),
+        }
+        patchers = [patch.object(cutout_extractor.CutoutHelper, name, func) for name, func in stages.items()]
+        for patcher in patchers:
+            patcher.start()
+        try:
+            helper = cutout_extractor.CutoutHelper(self.config, 10.0, 0.0, 'S1', 20.0)
+            self.assertEqual(helper.extract(), 0)
+            self.assertEqual(helper.process(), 0)
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+        return helper
+
+    def _readProduct(self, helper):
+        with open(helper.img_files['first']) as f:
+            return f.read()
+
+    def test_process_StageReuse(self):
+        helper = self._runSource()
+        self.assertEqual(self.calls, ['extract', 'subtract_bkg', 'regrid', 'convolve', 'crop'])
+        self.assertEqual(helper.reused_stages, [])
+
+        # unchanged options reuse all stages
+        helper = self._runSource()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(helper.reused_stages, ['extract', 'subtract_bkg', 'regrid', 'convolve', 'crop'])
+
+        # changing crop options only recomputes the crop stage
+        self.config.crop_size = 50
+        helper = self._runSource()
+        self.assertEqual(self.calls, ['crop'])
+        self.assertEqual(helper.reused_stages, ['extract', 'subtract_bkg', 'regrid', 'convolve'])
+        self.assertTrue(self._readProduct(helper).endswith('|crop=50'))
+
+    def test_process_StageInvalidation(self):
+        self._runSource()
+
+        # changing bkg options invalidates the bkg stage and all downstream stages
+        self.config.bkg_outer_radius_factor = 2*self.config.bkg_outer_radius_factor
+        helper = self._runSource()
+        self.assertEqual(self.calls, ['subtract_bkg', 'regrid', 'convolve', 'crop'])
+        self.assertEqual(helper.reused_stages, ['extract'])
+        self.assertIn('|subtract_bkg=%s|' % self.config.bkg_outer_radius_factor, self._readProduct(helper))
+
+        # tile changes invalidate all stages
+        with open(self.tile, 'a') as f:
+            f.write('modified')
+        helper = self._runSource()
+        self.assertEqual(self.calls, ['extract', 'subtract_bkg', 'regrid', 'convolve', 'crop'])
+        self.assertEqual(helper.reused_stages, [])
+
+
+class SurveyThreadsTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module surveys processed in a thread pool"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.workdir = self.workdir
+        self.config.surveys = ['first', 'mgps', 'nvss', 'vlass']
+        self.failing = []
+        self.completed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _extract_raw_cutout(self, helper, survey):
+        """ Stub raw cutout extraction, finishing in reverse survey order if run concurrently """
+        time.sleep(0.05*(len(helper.surveys) - helper.surveys.index(survey)))
+        self.completed.append(survey)
+        if survey in self.failing:
+            return -1
+        helper.img_files[survey] = os.path.join(self.workdir, survey + '.fits')
+        helper.input_files[survey] = os.path.join(self.workdir, survey + '_tile.fits')
+        return 0
+
+    def _extractRawCutouts(self, nthreads):
+        """ Run raw cutout extraction with given number of threads and return status, helper and error logs """
+        self.config.nthreads = nthreads
+        self.completed = []
+        helper = cutout_extractor.CutoutHelper(self.config, 10.0, 0.0, 'S1', 20.0)
+        with patch.object(cutout_extractor.CutoutHelper, '_CutoutHelper__extract_raw_cutout', lambda helper, survey: self._extract_raw_cutout(helper, survey)):
+            with self.assertLogs('scutout', level='INFO') as logs:
+                status = helper._CutoutHelper__extract_raw_cutouts()
+        errors = [record.getMessage() for record in logs.records if record.levelname == 'ERROR']
+        return status, helper, errors
+
+    def test_extract_raw_cutouts_Threads(self):
+        status, helper, errors = self._extractRawCutouts(1)
+        self.assertEqual(status, 0)
+        self.assertEqual(self.completed, self.config.surveys)
+
+        # surveys completing out of order are sorted back in survey order
+        status_threads, helper_threads, errors_threads = self._extractRawCutouts(4)
+        self.assertEqual(status_threads, 0)
+        self.assertEqual(self.completed, self.config.surveys[::-1])
+        self.assertEqual(list(helper_threads.img_files.items()), list(helper.img_files.items()))
+        self.assertEqual(list(helper_threads.input_files.items()), list(helper.input_files.items()))
+        self.assertEqual(list(helper_threads.img_files.keys()), self.config.surveys)
+        self.assertEqual(errors_threads, [])
+
+    def test_extract_raw_cutouts_ThreadsFailure(self):
+        self.failing = ['mgps', 'vlass']
+        status, helper, errors = self._extractRawCutouts(1)
+        self.assertEqual(status, -1)
+        self.assertEqual(self.completed, ['first', 'mgps'])
+        self.assertEqual(errors, ['Raw cutout extraction for source S1 for survey mgps failed!'])
+
+        # all surveys run concurrently, the first failed survey in survey order is reported as in sequential mode
+        status_threads, helper_threads, errors_threads = self._extractRawCutouts(4)
+        self.assertEqual(status_threads, -1)
+        self.assertEqual(sorted(self.completed), sorted(self.config.surveys))
+        self.assertEqual(self.completed[0], 'vlass')
+        self.assertEqual(errors_threads, errors)
+
+
+class RawCutoutCacheTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module raw cutouts served from the in-memory raw cutout cache"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.tile = os.path.join(self.workdir, 'tile.fits')
+        self.wcs = WCS(naxis=2)
+        self.wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+        self.wcs.wcs.crval = [10.0, 0.0]
+        self.wcs.wcs.crpix = [200.5, 200.5]
+        self.wcs.wcs.cdelt = [-1./3600., 1./3600.]
+        self.tile_data = np.arange(400*400, dtype=np.float32).reshape(400, 400)
+        fits.PrimaryHDU(self.tile_data, self.wcs.to_header()).writeto(self.tile)
+        self.config = Config()
+        self.config.workdir = self.workdir
+        self.config.surveys = ['first']
+        self.config.convert_to_jypix_units = False
+        self.config.raw_cutout_cache_size = 10
+        self.nreads = 0
+        cutout_extractor.raw_cutout_cache = None
+
+    def tearDown(self):
+        cutout_extractor.raw_cutout_cache = None
+        shutil.rmtree(self.workdir)
+
+    def _mSubimage(self, in_image, out_image, ra, dec, xsize):
+        """ Stub Montage cutout extraction from the tile """
+        self.nreads += 1
+        with fits.open(in_image) as hdul:
+            cutout = Cutout2D(hdul[0].data, SkyCoord(ra, dec, unit='deg'), xsize*u.deg, wcs=WCS(hdul[0].header), mode='trim')
+        fits.PrimaryHDU(cutout.data, cutout.wcs.to_header()).writeto(out_image)
+
+    def _extractRawCutout(self, ra, radius, obj_name):
+        helper = cutout_extractor.CutoutHelper(self.config, ra, 0.0, obj_name, radius)
+        helper.coverage_tables['first'] = Table({'fname': [self.tile]})
+        self.assertEqual(helper._CutoutHelper__initialize(), 0)
+        helper.coverage_tables['first'].write(os.path.join(helper.tmpdir, 'coverage_first.tbl'), format='ascii.ipac')
+        with patch.object(cutout_extractor.montage, 'mSubimage', self._mSubimage, create=True):
+            self.assertEqual(helper._CutoutHelper__extract_raw_cutout('first'), 0)
+        return helper
+
+    def _assertTileValues(self, filename):
+        """ Check that cutout pixels have the tile values at the same sky positions """
+        with fits.open(filename) as hdul:
+            data = hdul[0].data
+            ra, dec = WCS(hdul[0].header).wcs_pix2world([[0, 0], [data.shape[1]-1, data.shape[0]-1]], 0).T
+        x, y = np.round(self.wcs.wcs_world2pix(ra, dec, 0)).astype(int)
+        self.assertEqual(data[0, 0], self.tile_data[y[0], x[0]])
+        self.assertEqual(data[-1, -1], self.tile_data[y[1], x[1]])
+
+    def test_extract_raw_cutout_NestedSource(self):
+        # 200 arcsec cutout read from tile
+        helper = self._extractRawCutout(10.0, 20.0, 'S1')
+        self.assertEqual(self.nreads, 1)
+        self.assertEqual(helper.tile_reads_saved, 0)
+
+        # 80 arcsec cutout of a nested source sliced from the cached cutout, without reading the tile
+        helper = self._extractRawCutout(10.0 + 20./3600., 8.0, 'S2')
+        self.assertEqual(self.nreads, 1)
+        self.assertEqual(helper.tile_reads_saved, 1)
+        self.assertEqual(cutout_extractor.raw_cutout_cache.nhits, 1)
+        self.assertEqual(fits.getdata(helper.img_files['first']).shape, (80, 80))
+        self._assertTileValues(helper.img_files['first'])
+
+        # source partially outside the cached cutout read from tile
+        helper = self._extractRawCutout(10.0 + 80./3600., 8.0, 'S3')
+        self.assertEqual(self.nreads, 2)
+        self.assertEqual(helper.tile_reads_saved, 0)
+        self._assertTileValues(helper.img_files['first'])
+
+
+class ClusterTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module source clusters processed with super-cutouts"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.tile = os.path.join(self.workdir, 'tile.fits')
+        with open(self.tile, 'w') as f:
+            f.write('tile')
+        self.config = Config()
+        self.config.workdir = self.workdir
+        self.config.surveys = ['first']
+        self.config.source_radius = 20
+        self.config.use_same_radius = True
+        self.config.subtract_bkg = True
+        self.config.regrid = False
+        self.config.convolve = False
+        self.config.crop_mode = 'factor'
+        self.config.crop_size = 2.0
+        self.config.cluster_sources = True
+        self.sources = [(10.0, 0.0, 'S0', -1), (10.0, 5./3600, 'S1', -1), (12.0, 0.0, 'S2', -1)]
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _compute_coverage(self, helper, survey):
+        helper.coverage_tables[survey] = Table({'fname': [self.tile]})
+        return 0
+
+    def _extract_raw_cutouts(self, helper):
+        """ Write raw cutouts (1 arcsec pixels, bkg=1) covering the helper cutout size """
+        outdir = os.path.join(helper.tmpdir, 'raw_cutouts')
+        os.makedirs(outdir, exist_ok=True)
+        npix = int(np.ceil(helper.cutout_size*3600)) + 1
+        header = fits.Header()
+        header['CTYPE1'], header['CTYPE2'] = 'RA---TAN', 'DEC--TAN'
+        header['CRVAL1'], header['CRVAL2'] = helper.ra, helper.dec
+        header['CRPIX1'], header['CRPIX2'] = (npix+1)/2., (npix+1)/2.
+        header['CDELT1'], header['CDELT2'] = -1./3600, 1./3600
+        for survey in helper.surveys:
+            filename = os.path.join(outdir, helper.sname + '_' + survey + '.fits')
+            data = 1 + 0.01*np.random.RandomState(1).normal(size=(npix, npix))
+            fits.PrimaryHDU(data.astype(np.float32), header).writeto(filename, overwrite=True)
+            helper.img_files[survey] = filename
+            helper.input_files[survey] = self.tile
+            helper.tile_files[survey] = [self.tile]
+        return 0
+
+    def _patchStages(self):
+        stages = {
+            '_CutoutHelper__compute_coverage': lambda helper, survey: self._compute_coverage(helper, survey),
+            '_CutoutHelper__extract_raw_cutouts': lambda helper: self._extract_raw_cutouts(helper),
+        }
+        patchers = [patch.object(cutout_extractor.CutoutHelper, name, func) for name, func in stages.items()]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _assertOutput(self, result):
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(result['outputs'], [os.path.join(self.workdir, result['obj_name'], result['obj_name'] + '_first.fits')])
+        with fits.open(result['outputs'][0]) as hdul:
+            data = hdul[0].data
+
+        # cropped to crop_size times the source diameter (1 arcsec pixels), bkg subtracted
+        self.assertLessEqual(abs(data.shape[0] - 2*self.config.crop_size*self.config.source_radius), 2)
+        self.assertLess(abs(np.nanmean(data)), 0.01)
+
+    def test_process_cluster(self):
+        self._patchStages()
+        results = cutout_extractor.process_cluster(self.config, ('cluster_S0', self.sources[:2]))
+        self.assertEqual([result['obj_name'] for result in results], ['S0', 'S1'])
+        for result in results:
+            self.assertEqual(result['cluster'], 'cluster_S0')
+            self._assertOutput(result)
+
+        # member cutouts have the same size as single source ones
+        with fits.open(results[1]['outputs'][0]) as hdul:
+            member_data = hdul[0].data
+        single_result = cutout_extractor.process_source(self.config, self.sources[1])
+        self._assertOutput(single_result)
+        with fits.open(single_result['outputs'][0]) as hdul:
+            self.assertEqual(hdul[0].data.shape, member_data.shape)
+
+    def test_process_cluster_MemberFallback(self):
+        self._patchStages()
+
+        # member cutout crop failure: member processed individually
+        crop_image = cutout_extractor.Utils.cropImage
+
+        def crop_member(*args, **kwargs):
+            if kwargs.get('data') is not None and 'S1_first' in kwargs['outfile']:
+                return -1
+            return crop_image(*args, **kwargs)
+
+        with patch('scutout.cutout_extractor.Utils.cropImage', side_effect=crop_member):
+            results = cutout_extractor.process_cluster(self.config, ('cluster_S0', self.sources[:2]))
+        self.assertEqual([result['cluster'] for result in results], ['cluster_S0', ''])
+        for result in results:
+            self._assertOutput(result)
+
+    def test_process_cluster_ClusterFallback(self):
+        self._patchStages()
+
+        # super-cutout spanning several survey images: sources processed individually
+        with patch.object(cutout_extractor.CutoutHelper, '_CutoutHelper__compute_coverage', lambda helper, survey: helper.coverage_tables.update({survey: Table({'fname': [self.tile]*(2 if helper.members else 1)})}) or 0):
+            results = cutout_extractor.process_cluster(self.config, ('cluster_S0', self.sources[:2]))
+        self.assertEqual([result['cluster'] for result in results], ['', ''])
+        for result in results:
+            self._assertOutput(result)
+
+    @patch('scutout.cutout_extractor.Utils.read_ascii_table')
+    def test_run_search_Clusters(self, mock_read):
+        self._patchStages()
+        mock_read.return_value = Table({'RA': [source[0] for source in self.sources], 'DEC': [source[1] for source in self.sources], 'OBJNAME': [source[2] for source in self.sources]})
+
+        for nworkers in [1, 2]:
+            self.config.nworkers = nworkers
+            finder = cutout_extractor.CutoutFinder('sources.dat', self.config)
+            self.assertEqual(finder.run_search(), 0)
+            results = {result['obj_name']: result for result in finder.results}
+            self.assertEqual({name: result['cluster'] for name, result in results.items()}, {'S0': 'cluster_S0', 'S1': 'cluster_S0', 'S2': ''})
+            for result in finder.results:
+                self._assertOutput(result)
+
+
+@unittest.skipUnless(has_h5py, 'h5py not available')
+class Hdf5OutputTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module HDF5 output mode"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.workdir = os.path.join(self.workdir, 'run')
+        self.config.scratch_dir = os.path.join(self.workdir, 'scratch')
+        self.config.surveys = ['first']
+        self.config.output_format = 'hdf5'
+        self.config.keep_tmpfiles = True
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_finalize_ScratchDirRemoved(self):
+        helper = cutout_extractor.CutoutHelper(self.config, 10.0, 0.0, 'S1', 20.0)
+        scratch_dir = cutout_extractor.get_scratch_dir(self.config)
+        self.assertEqual(helper.tmpdir, os.path.join(scratch_dir, 'S1', 'tmpfiles'))
+
+        os.makedirs(helper.tmpdir)
+        filename = os.path.join(helper.tmpdir, 'S1_first_cropped.fits')
+        fits.PrimaryHDU(np.ones((10, 10), dtype=np.float32)).writeto(filename)
+        helper.img_files = {'first': filename}
+
+        # intermediate files are removed from scratch dir once added to HDF5 file, even if tmp files are kept
+        self.assertEqual(helper.finalize(), 0)
+        store_file = os.path.join(self.config.workdir, 'cutouts.h5')
+        self.assertEqual(helper.output_files, [store_file + '::S1/first'])
+        self.assertTrue(np.all(Hdf5CutoutStore(store_file).get('S1', 'first')[0] == 1))
+        self.assertEqual(os.listdir(self.config.scratch_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.config.workdir, 'S1')))
+
+    @patch.object(cutout_extractor.CutoutHelper, '_CutoutHelper__compute_coverage', lambda helper, survey: -1)
+    def test_run_source_ScratchDirRemovedOnFailure(self):
+        result = cutout_extractor.run_source(self.config, (10.0, 0.0, 'S1', 20.0))
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(os.listdir(self.config.scratch_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self.config.workdir, 'S1')))
+
+    def test_get_scratch_dir(self):
+        # same scratch dir for all processes of a run, different for runs with other work dirs
+        scratch_dir = cutout_extractor.get_scratch_dir(self.config)
+        self.assertEqual(os.path.dirname(scratch_dir), self.config.scratch_dir)
+        other_config = Config()
+        other_config.workdir = os.path.join(self.workdir, 'other_run')
+        other_config.scratch_dir = self.config.scratch_dir
+        self.assertNotEqual(cutout_extractor.get_scratch_dir(other_config), scratch_dir)
+
+
+class WatchdogTest(unittest.TestCase):
+    """Tests for 'cutout_extractor' module source watchdog"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.config = Config()
+        self.config.workdir = self.workdir
+        self.config.stage_timeout = 1.0
+        self.config.multi_input_img_mode = 'best'
+        self.config.timeout_fallback_mode = 'first'
+        self.source = (10.0, 0.0, 'S1', -1)
+
+    def tearDown(self):
+        HangingHelper.hang_modes = []
+        shutil.rmtree(self.workdir)
+
+    def _readLines(self, filename):
+        filename = os.path.join(self.workdir, filename)
+        if not os.path.isfile(filename):
+            return []
+        with open(filename) as f:
+            return f.read().split()
+
+    def _isRunning(self, pid):
+        """ Return True if process is running (not exited or zombie, as killed orphans may not be reaped in containers) """
+        try:
+            with open('/proc/%d/stat' % pid) as f:
+                return f.read().rsplit(')', 1)[1].split()[0] not in ['Z', 'X']
+        except IOError:
+            return False
+
+    def _assertKilled(self, pids):
+        self.assertTrue(pids)
+        t0 = time.time()
+        while any([self._isRunning(int(pid)) for pid in pids]) and time.time()-t0 < 5:
+            time.sleep(0.1)
+        for pid in pids:
+            self.assertFalse(self._isRunning(int(pid)))
+
+    @patch('scutout.cutout_extractor.CutoutHelper', HangingHelper)
+    def test_process_source_watched(self):
+        HangingHelper.hang_modes = []
+        result = cutout_extractor.process_source_watched(self.config, self.source)
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(result['outputs'], [os.path.join(self.workdir, 'S1.txt')])
+        self.assertEqual(self._readLines('attempts.txt'), ['best'])
+
+    @patch('scutout.cutout_extractor.CutoutHelper', HangingHelper)
+    def test_process_source_watched_StageTimeout(self):
+        HangingHelper.hang_modes = ['best']
+        result = cutout_extractor.process_source_watched(self.config, self.source)
+
+        # stage timed out, process group (including subprocesses) killed and source retried once in fallback mode
+        self._assertKilled(self._readLines('pids.txt'))
+        self.assertEqual(self._readLines('attempts.txt'), ['best', 'first'])
+        self.assertEqual(result['status'], 'done')
+        self.assertIn('retried with first mode after: Timeout in stage extract', result['errmsg'])
+        self.assertGreater(result['elapsed'], self.config.stage_timeout)
+
+    @patch('scutout.cutout_extractor.CutoutHelper', HangingHelper)
+    def test_process_source_watched_FallbackTimeout(self):
+        HangingHelper.hang_modes = ['best', 'first']
+        result = cutout_extractor.process_source_watched(self.config, self.source)
+
+        self._assertKilled(self._readLines('pids.txt'))
+        self.assertEqual(len(self._readLines('pids.txt')), 2)
+        self.assertEqual(self._readLines('attempts.txt'), ['best', 'first'])
+        self.assertEqual(result['status'], 'timeout')
+        self.assertEqual(result['outputs'], [])
+
+        # without fallback mode the source is not retried
+        os.remove(os.path.join(self.workdir, 'attempts.txt'))
+        self.config.timeout_fallback_mode = ''
+        result = cutout_extractor.process_source_watched(self.config, self.source)
+        self.assertEqual(result['status'], 'timeout')
+        self.assertEqual(self._readLines('attempts.txt'), ['best'])
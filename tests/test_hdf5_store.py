@@ -0,0 +1,127 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from astropy.io import fits
+from . import context
+from scutout.hdf5_store import Hdf5CutoutStore, has_h5py
+
+
+@unittest.skipUnless(has_h5py, 'h5py not available')
+class Hdf5CutoutStoreTest(unittest.TestCase):
+    """Tests for 'hdf5_store' module"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, 'cutouts.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _writeFITS(self, name, value, shape=(40, 30)):
+        filename = os.path.join(self.workdir, name + '.fits')
+        header = fits.Header()
+        header['BUNIT'] = 'Jy/pixel'
+        header['CDELT1'] = -0.001
+        header['HISTORY'] = 'cutout of ' + name
+        fits.PrimaryHDU(np.full(shape, value, dtype=np.float32), header).writeto(filename)
+        return filename
+
+    def test_add_get(self):
+        store = Hdf5CutoutStore(self.filename)
+        files = {'first': self._writeFITS('S1_first', 1.0), 'mgps': self._writeFITS('S1_mgps', 2.0)}
+        outputs = store.add('S1', files, ra=10.0, dec=-5.0)
+        self.assertEqual(outputs, [self.filename + '::S1/first', self.filename + '::S1/mgps'])
+        self.assertEqual(Hdf5CutoutStore.split_output_name(outputs[0]), (self.filename, 'S1', 'first'))
+        self.assertIsNone(Hdf5CutoutStore.split_output_name(files['first']))
+
+        data, header = store.get('S1', 'mgps')
+        self.assertEqual(data.shape, (40, 30))
+        self.assertTrue(np.all(data == 2.0))
+        self.assertEqual(header['BUNIT'], 'Jy/pixel')
+        self.assertEqual(header['CDELT1'], -0.001)
+        self.assertEqual(store.get_surveys('S1'), ['first', 'mgps'])
+
+    def test_add_Replace(self):
+        store = Hdf5CutoutStore(self.filename)
+        store.add('S1', {'first': self._writeFITS('S1_first', 1.0), 'mgps': self._writeFITS('S1_mgps', 2.0)})
+
+        # reprocessed source replaces its previous cutouts
+        store.add('S1', {'first': self._writeFITS('S1_first_new', 3.0)})
+        self.assertEqual(store.get_surveys('S1'), ['first'])
+        self.assertTrue(np.all(store.get('S1', 'first')[0] == 3.0))
+
+    def test_link(self):
+        store = Hdf5CutoutStore(self.filename)
+        store.add('S1', {'first': self._writeFITS('S1_first', 1.0)})
+        output = store.link('S2', 'first', 'S1', ra=10.0, dec=-5.0)
+        self.assertEqual(output, self.filename + '::S2/first')
+        self.assertEqual(store.get_sources(), ['S1', 'S2'])
+        self.assertTrue(np.all(store.get('S2', 'first')[0] == 1.0))
+
+    def test_get_sizes(self):
+        store = Hdf5CutoutStore(self.filename)
+        self.assertEqual(store.get_sizes([('S1', 'first')]), [-1])
+
+        store.add('S1', {'first': self._writeFITS('S1_first', 1.0, shape=(200, 200))})
+        sizes = store.get_sizes([('S1', 'first'), ('S1', 'mgps'), ('S2', 'first')])
+        self.assertGreater(sizes[0], 0)
+        self.assertLess(sizes[0], 200*200*4)  # compressed
+        self.assertEqual(sizes[1:], [-1, -1])
+
+    def test_reopen(self):
+        Hdf5CutoutStore(self.filename).add('S1', {'first': self._writeFITS('S1_first', 1.0)})
+
+        # sources are appended to an existing file, also by other store objects (e.g. in other processes)
+        store = Hdf5CutoutStore(self.filename)
+        store.add('S2', {'first': self._writeFITS('S2_first', 2.0)})
+        self.assertEqual(store.get_sources(), ['S1', 'S2'])
+        self.assertTrue(np.all(Hdf5CutoutStore(self.filename).get('S1', 'first')[0] == 1.0))
+
+
+@unittest.skipUnless(has_h5py, 'h5py not available')
+class GetHdf5CutoutsScriptTest(unittest.TestCase):
+    """Tests for 'get_scutout_hdf5_cutouts.py' script"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.rootdir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        self.script = os.path.join(self.rootdir, 'scripts', 'get_scutout_hdf5_cutouts.py')
+        self.filename = os.path.join(self.workdir, 'cutouts.h5')
+        self.outdir = os.path.join(self.workdir, 'out')
+
+        store = Hdf5CutoutStore(self.filename)
+        for index, name in enumerate(['S1', 'S2']):
+            filename = os.path.join(self.workdir, name + '.fits')
+            header = fits.Header()
+            header['BUNIT'] = 'Jy/pixel'
+            fits.PrimaryHDU(np.full((20, 20), index, dtype=np.float32), header).writeto(filename)
+            store.add(name, {'first': filename})
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _runScript(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = self.rootdir + os.pathsep + env.get('PYTHONPATH', '')
+        cmd = [sys.executable, self.script, '--input', self.filename, '--outdir', self.outdir] + list(args)
+        return subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode
+
+    def test_AllSources(self):
+        self.assertEqual(self._runScript(), 0)
+        self.assertEqual(sorted(os.listdir(self.outdir)), ['S1', 'S2'])
+        with fits.open(os.path.join(self.outdir, 'S2', 'S2_first.fits')) as hdul:
+            self.assertTrue(np.all(hdul[0].data == 1))
+            self.assertEqual(hdul[0].header['BUNIT'], 'Jy/pixel')
+
+    def test_Objnames(self):
+        self.assertEqual(self._runScript('--objnames', 'S2,S3'), 0)
+        self.assertEqual(os.listdir(self.outdir), ['S2'])
+        self.assertEqual(os.listdir(os.path.join(self.outdir, 'S2')), ['S2_first.fits'])
+
+    def test_MissingInput(self):
+        self.filename = os.path.join(self.workdir, 'missing.h5')
+        self.assertEqual(self._runScript(), 1)
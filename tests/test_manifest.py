@@ -0,0 +1,140 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from . import context
+from scutout.manifest import Manifest, merge_manifests
+
+
+class ManifestTest(unittest.TestCase):
+    """Tests for 'manifest' module"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, 'manifest.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _writeManifest(self, filename, config_hash, records):
+        manifest = Manifest(filename)
+        self.assertEqual(manifest.create(config_hash, shard='1/1'), 0)
+        for record in records:
+            manifest.add(record)
+        manifest.close()
+
+    def _readLines(self, filename):
+        with open(filename, 'r') as f:
+            return [json.loads(line) for line in f]
+
+    def test_create(self):
+        self._writeManifest(self.filename, 'abc', [{'obj_name': 'S1', 'status': 'done'}])
+
+        lines = self._readLines(self.filename)
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['type'], 'header')
+        self.assertEqual(lines[0]['config_hash'], 'abc')
+        self.assertEqual(lines[0]['shard'], '1/1')
+        self.assertEqual(lines[1], {'obj_name': 'S1', 'status': 'done', 'type': 'source'})
+
+    def test_append(self):
+        self._writeManifest(self.filename, 'abc', [{'obj_name': 'S1', 'status': 'failed'}])
+
+        manifest = Manifest(self.filename)
+        self.assertEqual(manifest.create('abc', append=True), 0)
+        manifest.add({'obj_name': 'S1', 'status': 'done'})
+        manifest.close()
+
+        manifest = Manifest(self.filename)
+        self.assertEqual(manifest.read(), 0)
+        self.assertEqual(len(manifest.records), 2)
+        self.assertEqual(list(manifest.get_completed().keys()), ['S1'])
+        self.assertEqual(manifest.get_summary(), {'failed': 1, 'done': 1})
+
+    def test_read_TruncatedLastLine(self):
+        self._writeManifest(self.filename, 'abc', [{'obj_name': 'S1', 'status': 'done'}])
+        with open(self.filename, 'a') as f:
+            f.write('{"obj_name": "S2", "sta')
+
+        manifest = Manifest(self.filename)
+        self.assertEqual(manifest.read(), 0)
+        self.assertEqual(manifest.header['config_hash'], 'abc')
+        self.assertEqual([record['obj_name'] for record in manifest.records], ['S1'])
+
+        # appending terminates the truncated record first
+        self.assertEqual(manifest.create('abc', append=True), 0)
+        manifest.add({'obj_name': 'S2', 'status': 'done'})
+        manifest.close()
+        self.assertEqual(manifest.read(), 0)
+        self.assertEqual(sorted(manifest.get_completed().keys()), ['S1', 'S2'])
+
+    def test_read_NoHeader(self):
+        with open(self.filename, 'w') as f:
+            f.write('{"obj_name": "S1", "status": "done", "type": "source"}\n')
+        self.assertEqual(Manifest(self.filename).read(), -1)
+        self.assertEqual(Manifest(os.path.join(self.workdir, 'missing.jsonl')).read(), -1)
+
+    def test_merge_manifests(self):
+        shard1 = os.path.join(self.workdir, 'shard1.jsonl')
+        shard2 = os.path.join(self.workdir, 'shard2.jsonl')
+        self._writeManifest(shard1, 'abc', [{'obj_name': 'S1', 'status': 'done'}, {'obj_name': 'S2', 'status': 'failed'}])
+        self._writeManifest(shard2, 'abc', [{'obj_name': 'S2', 'status': 'done'}, {'obj_name': 'S1', 'status': 'failed'}])
+
+        self.assertEqual(merge_manifests([shard1, shard2], self.filename), 0)
+        manifest = Manifest(self.filename)
+        self.assertEqual(manifest.read(), 0)
+        self.assertEqual(manifest.header['config_hash'], 'abc')
+        self.assertEqual(sorted(manifest.get_completed().keys()), ['S1', 'S2'])
+        self.assertEqual(len(manifest.records), 2)
+
+    def test_merge_manifests_HashMismatch(self):
+        shard1 = os.path.join(self.workdir, 'shard1.jsonl')
+        shard2 = os.path.join(self.workdir, 'shard2.jsonl')
+        self._writeManifest(shard1, 'abc', [{'obj_name': 'S1', 'status': 'done'}])
+        self._writeManifest(shard2, 'def', [{'obj_name': 'S2', 'status': 'done'}])
+
+        self.assertEqual(merge_manifests([shard1, shard2], self.filename), -1)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(merge_manifests([shard1, shard2], self.filename, force=True), 0)
+        self.assertTrue(os.path.exists(self.filename))
+
+
+class MergeManifestsScriptTest(unittest.TestCase):
+    """Tests for 'merge_scutout_manifests.py' script"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.rootdir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        self.script = os.path.join(self.rootdir, 'scripts', 'merge_scutout_manifests.py')
+        self.shards = []
+        for index, config_hash in enumerate(['abc', 'def']):
+            filename = os.path.join(self.workdir, 'shard%d.jsonl' % (index+1))
+            manifest = Manifest(filename)
+            manifest.create(config_hash)
+            manifest.add({'obj_name': 'S%d' % (index+1), 'status': 'done'})
+            manifest.close()
+            self.shards.append(filename)
+        self.output = os.path.join(self.workdir, 'merged.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def _runScript(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = self.rootdir + os.pathsep + env.get('PYTHONPATH', '')
+        cmd = [sys.executable, self.script, '--inputs'] + self.shards + ['--output', self.output] + list(args)
+        return subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE).returncode
+
+    def test_HashMismatch(self):
+        self.assertEqual(self._runScript(), 1)
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_HashMismatch_Force(self):
+        self.assertEqual(self._runScript('--force'), 0)
+        manifest = Manifest(self.output)
+        self.assertEqual(manifest.read(), 0)
+        self.assertEqual(sorted(manifest.get_completed().keys()), ['S1', 'S2'])
+
@@ -3,9 +3,13 @@ import logging
 import builtins
 import copy
 import sys
+import os
+import shutil
+import tempfile
 import numpy as np
 from astropy.io import fits
 from astropy import units as u
+from astropy.table import Table
 from unittest.mock import patch
 from .context import utils
 
@@ -81,6 +85,25 @@ class UtilsTest(unittest.TestCase):
         # self.assertFalse(self.utils.has_patterns_in_string('test_string','test_string'))
         self.assertFalse(self.utils.has_patterns_in_string('test_string', '?'))
 
+    @patch('utils.shutil')
+    @patch('utils.os')
+    def test_linkOrCopy(self, mock_os, mock_shutil):
+        # Existing destination is replaced by a hard link
+        mock_os.path.lexists.return_value = True
+        self.assertEqual(self.utils.linkOrCopy('/cache/a.fits', '/out/a.fits'), 0)
+        mock_os.remove.assert_called_with('/out/a.fits')
+        mock_os.link.assert_called_with('/cache/a.fits', '/out/a.fits')
+        assert not mock_shutil.copy.called
+
+        # Fallback to copy if linking fails
+        mock_os.link.side_effect = OSError('cross-device link')
+        self.assertEqual(self.utils.linkOrCopy('/cache/a.fits', '/out/a.fits'), 0)
+        mock_shutil.copy.assert_called_with('/cache/a.fits', '/out/a.fits')
+
+        # Failure if copy fails too
+        mock_shutil.copy.side_effect = IOError('no space left')
+        self.assertEqual(self.utils.linkOrCopy('/cache/a.fits', '/out/a.fits'), -1)
+
     def test_crop_img_Basic(self):
         hdu = self._createDummyFITS()
 
@@ -301,6 +324,43 @@ class UtilsTest(unittest.TestCase):
         hdu.header['BMIN'] = 1
         self.assertTrue(self.utils.hasBeamInfo(hdu.header))
 
+    def test_isBeamContained(self):
+        self.assertTrue(self.utils.isBeamContained((2, 2, 0), (1, 1, 0)))
+        self.assertTrue(self.utils.isBeamContained((2, 2, 0), (2, 2, 0)))
+        self.assertTrue(self.utils.isBeamContained((3, 2, 0), (2, 1, 0)))
+        self.assertFalse(self.utils.isBeamContained((3, 2, 0), (3, 1, 90)))
+        self.assertFalse(self.utils.isBeamContained((1, 1, 0), (2, 2, 0)))
+
+    def test_findContainingBeam_Circular(self):
+        beams = [(1, 1, 0), (3, 3, 0), (2, 2, 0)]
+        self.assertEqual(self.utils.findContainingBeam(beams), 1)
+
+    def test_findContainingBeam_Elliptical(self):
+        beams = [(1, 1, 0), (4, 3, 30), (3, 1, 20)]
+        self.assertEqual(self.utils.findContainingBeam(beams), 1)
+
+        # crossed elliptical beams: no beam contains the others
+        beams = [(3, 1, 0), (3, 1, 90)]
+        self.assertEqual(self.utils.findContainingBeam(beams), -1)
+        self.assertEqual(self.utils.findContainingBeam([]), -1)
+
+    def test_getSeparableKernel(self):
+        y, x = np.mgrid[-10:11, -10:11]
+
+        # axis-aligned gaussian is separable
+        kernel = np.exp(-0.5*(x**2/3.**2 + y**2/1.5**2))
+        kernel /= kernel.sum()
+        sep_kernel = self.utils.getSeparableKernel(kernel)
+        self.assertIsNotNone(sep_kernel)
+        kx, ky = sep_kernel
+        np.testing.assert_allclose(np.outer(ky, kx), kernel, atol=1e-12)
+
+        # rotated gaussian is not
+        xr = (x + y)/np.sqrt(2)
+        yr = (y - x)/np.sqrt(2)
+        kernel = np.exp(-0.5*(xr**2/3.**2 + yr**2/1.5**2))
+        self.assertIsNone(self.utils.getSeparableKernel(kernel))
+
     @patch('utils.Utils.write_fits')
     @patch('utils.fits.open')
     def test_fixImgAxisAndUnits_Input2DFits(self, mock_read, mock_write):
@@ -401,6 +461,26 @@ class UtilsTest(unittest.TestCase):
         self.assertAlmostEqual(fixed_hdu_data[0, 0] -
                                hdu.data[0, 0], 1500+hdu.data[0, 0], places=1)   # check that output flux is BZERO+BSCALE*input flux
 
+    def test_toNativeFloat(self):
+        data = np.arange(6, dtype='>i2').reshape(2, 3)
+        header = fits.Header()
+        header['BSCALE'] = 2.0
+        header['BZERO'] = 10.0
+        header['BLANK'] = 5
+
+        data_conv = self.utils.toNativeFloat(data, header)
+        self.assertEqual(data_conv.dtype, np.dtype(np.float32))
+        self.assertTrue(data_conv.dtype.isnative)
+        self.assertEqual(data_conv[0, 1], 12.0)
+        self.assertTrue(np.isnan(data_conv[1, 2]))
+        self.assertEqual(header['BSCALE'], 1)
+        self.assertEqual(header['BZERO'], 0)
+        self.assertFalse('BLANK' in header)
+
+        data_conv = self.utils.toNativeFloat(data, dtype=np.float64)
+        self.assertEqual(data_conv.dtype, np.dtype(np.float64))
+        self.assertEqual(data_conv[1, 2], 5.0)
+
     def test_fromBrightnessTempToJyBeam(self):
         self.assertAlmostEqual(self.utils.fromBrightnessTempToJyBeam(
             nu_GHz=90.5, bmin_arcsec=0.17, bmaj_arcsec=0.20), 0.0002278, places=5)
@@ -765,7 +845,7 @@ class UtilsTest(unittest.TestCase):
 
         # crop size 1 arcmin == 10 pixels
         self.assertEqual(self.utils.cropImage(
-            filename=infile, ra=0, dec=0, crop_size=1*u.arcmin, outfile=outfile), 0)
+            filename=infile, ra=0, dec=0, crop_mode='pixel', crop_size=1*u.arcmin, outfile=outfile), 0)
         assert mock_read.called
         assert mock_write.called
         crop_hdu = mock_write.call_args[0]
@@ -785,7 +865,7 @@ class UtilsTest(unittest.TestCase):
 
         # crop size 10 pixels == 1 arcmin
         self.assertEqual(self.utils.cropImage(
-            filename=infile, ra=0, dec=0, crop_size=10, outfile=outfile), 0)
+            filename=infile, ra=0, dec=0, crop_mode='pixel', crop_size=10, outfile=outfile), 0)
         assert mock_read.called
         assert mock_write.called
         crop_hdu = mock_write.call_args[0]
@@ -805,7 +885,7 @@ class UtilsTest(unittest.TestCase):
 
         # crop size 10% larger than image size
         self.assertEqual(self.utils.cropImage(
-            filename=infile, ra=0, dec=0, crop_size=1.1*hdu.data.shape[0], outfile=outfile, nanfill=False), 0)
+            filename=infile, ra=0, dec=0, crop_mode='pixel', crop_size=1.1*hdu.data.shape[0], outfile=outfile, nanfill=False), 0)
         assert mock_read.called
         assert mock_write.called
         crop_hdu = mock_write.call_args[0]
@@ -826,7 +906,7 @@ class UtilsTest(unittest.TestCase):
 
         # crop size 10% larger than image size
         self.assertEqual(self.utils.cropImage(
-            filename=infile, ra=0, dec=0, crop_size=1.1*hdu.data.shape[0], outfile=outfile, nanfill=True, nanfill_mode='', nanfill_val=999), 0)
+            filename=infile, ra=0, dec=0, crop_mode='pixel', crop_size=1.1*hdu.data.shape[0], outfile=outfile, nanfill=True, nanfill_mode='', nanfill_val=999), 0)
         assert mock_read.called
         assert mock_write.called
         crop_hdu = mock_write.call_args[0]
@@ -848,7 +928,7 @@ class UtilsTest(unittest.TestCase):
 
         # crop size 10% larger than image size
         self.assertEqual(self.utils.cropImage(
-            filename=infile, ra=0, dec=0, crop_size=1.1*hdu.data.shape[0], outfile=outfile, nanfill=True, nanfill_mode='imgmin', nanfill_val=999), 0)
+            filename=infile, ra=0, dec=0, crop_mode='pixel', crop_size=1.1*hdu.data.shape[0], outfile=outfile, nanfill=True, nanfill_mode='imgmin', nanfill_val=999), 0)
         assert mock_read.called
         assert mock_write.called
         crop_hdu = mock_write.call_args[0]
@@ -860,6 +940,55 @@ class UtilsTest(unittest.TestCase):
         # all values = 0, so min = 0 (fill value ignored)
         assert np.isin(0, crop_hdu_data).all()
 
+    def test_cropData_View(self):
+        hdu = self._createDummyFITS()
+        wcs = utils.WCS(hdu.header)
+
+        # crop fully inside image: no copy
+        crop_data, crop_wcs = self.utils.cropData(hdu.data, wcs, 256, 256, 10)
+        self.assertEqual(crop_data.shape, (10, 10))
+        self.assertTrue(np.shares_memory(crop_data, hdu.data))
+
+        # nan inside crop box: filled on a copy, input untouched
+        hdu.data[256, 256] = np.nan
+        crop_data, crop_wcs = self.utils.cropData(hdu.data, wcs, 256, 256, 10, nanfill_mode='', nanfill_val=999)
+        self.assertFalse(np.shares_memory(crop_data, hdu.data))
+        self.assertTrue(np.isin(999, crop_data))
+        self.assertTrue(np.isnan(hdu.data[256, 256]))
+
+    def test_sliceContainedCutout(self):
+        hdu = self._createDummyFITS()
+        wcs = utils.WCS(hdu.header)
+
+        # contained cutout: same pixel grid, reference pixel shifted
+        ra, dec = wcs.all_pix2world(300, 200, 0)
+        cut_data, cut_header = self.utils.sliceContainedCutout(hdu.data, hdu.header, ra, dec, 0.05)
+        self.assertEqual(cut_data.shape, (30, 30))
+        self.assertEqual(cut_header['BUNIT'], hdu.header['BUNIT'])
+        cut_wcs = utils.WCS(cut_header)
+        x, y = cut_wcs.all_world2pix(ra, dec, 0)
+        self.assertEqual(cut_data[int(round(float(y))), int(round(float(x)))], hdu.data[200, 300])
+        self.assertFalse(np.shares_memory(cut_data, hdu.data))
+
+        # cutout crossing image border
+        ra, dec = wcs.all_pix2world(5, 200, 0)
+        cut_data, cut_header = self.utils.sliceContainedCutout(hdu.data, hdu.header, ra, dec, 0.05)
+        self.assertIsNone(cut_data)
+        self.assertIsNone(cut_header)
+
+    @patch('utils.Utils.write_fits')
+    def test_cropImage_InMemory(self, mock_write):
+        hdu = self._createDummyFITS()
+        wcs = utils.WCS(hdu.header)
+        outfile = 'test_out.fits'
+
+        self.assertEqual(self.utils.cropImage(
+            filename='', ra=0, dec=0, crop_mode='pixel', crop_size=10, outfile=outfile, data=hdu.data, wcs=wcs), 0)
+        assert mock_write.called
+        crop_hdu = mock_write.call_args[0]
+        self.assertEqual(crop_hdu[0].shape, (10, 10))
+        self.assertEqual(crop_hdu[1], outfile)
+
     @patch('utils.Utils.write_fits')
     @patch('utils.Utils.read_fits')
     def test_cropImage_CropLargerThanSourceSize(self, mock_read, mock_write):
@@ -870,10 +999,50 @@ class UtilsTest(unittest.TestCase):
         mock_read.return_value = (hdu.data, hdu.header)
 
         self.assertEqual(self.utils.cropImage(
-            filename=infile, ra=0, dec=0, crop_size=10, source_size=20, outfile=outfile, nanfill=False), -1)
+            filename=infile, ra=0, dec=0, crop_mode='pixel', crop_size=10, source_size=20, outfile=outfile, nanfill=False), -1)
         assert mock_read.called
         assert not mock_write.called
 
+    def test_getAnnulusPixels(self):
+        data = np.ones((101, 101))
+
+        pixels = self.utils.getAnnulusPixels(data, 50, 50, 10, 20)
+        self.assertAlmostEqual(pixels.size, np.pi*(20**2-10**2), delta=0.02*pixels.size)
+
+        # annulus partially and fully outside image
+        pixels_edge = self.utils.getAnnulusPixels(data, 0, 50, 10, 20)
+        self.assertLess(pixels_edge.size, pixels.size)
+        self.assertEqual(self.utils.getAnnulusPixels(data, 500, 500, 10, 20).size, 0)
+        self.assertEqual(self.utils.getAnnulusPixels(data, np.nan, 50, 10, 20).size, 0)
+        self.assertEqual(self.utils.getAnnulusPixels(data, 50, np.inf, 10, 20).size, 0)
+
+    def test_fastMedian(self):
+        data = np.random.randn(101)
+        data[3] = np.nan
+        self.assertAlmostEqual(self.utils.fastMedian(data), np.nanmedian(data))
+        self.assertTrue(np.isnan(self.utils.fastMedian(np.array([np.nan]))))
+
+        # stack of nan-padded samples with different sizes
+        stack = np.full((3, 50), np.nan)
+        stack[0, :10] = np.random.randn(10)
+        stack[1, :49] = np.random.randn(49)
+        medians = self.utils.fastMedian(stack)
+        self.assertAlmostEqual(medians[0], np.nanmedian(stack[0]))
+        self.assertAlmostEqual(medians[1], np.nanmedian(stack[1]))
+        self.assertTrue(np.isnan(medians[2]))
+
+    def test_fastSigmaClippedMedian(self):
+        from astropy.stats import sigma_clipped_stats
+        data = 1.0 + 0.5*np.random.randn(4, 2000)
+        data[:, :100] += 20     # outliers
+
+        medians = self.utils.fastSigmaClippedMedian(data)
+        self.assertEqual(medians.shape, (4,))
+        for i in range(data.shape[0]):
+            mean, median, rms = sigma_clipped_stats(data[i], sigma=3)
+            self.assertAlmostEqual(medians[i], median, delta=0.05)
+            self.assertAlmostEqual(self.utils.fastSigmaClippedMedian(data[i]), medians[i])
+
     @patch('utils.fits.open')
     def test_estimateBkgFromAnnulus_PositiveBkg(self, mock_read):
         bkg = 1.0
@@ -960,6 +1129,107 @@ class UtilsTest(unittest.TestCase):
             'test.fits', 1, 1, 12, 24), 0)     # Out of bounds => all pixels masked
         mock_read.assert_called()
 
+    def test_estimateBkgFromAnnuli(self):
+        bkg = 1.0
+        hdu = self._createDummyFITS(size=512, bkg_mean=bkg)
+        wcs = utils.WCS(hdu.header)
+
+        # second source off-centre, third out of bounds
+        ra = np.array([0, 0.3, 1])
+        dec = np.array([0, 0, 1])
+        bkgs, nan_fract = self.utils.estimateBkgFromAnnuli(
+            hdu.data, wcs, ra, dec, 12, 24, method='sigmaclip')
+        self.assertEqual(bkgs.shape, (3,))
+        self.assertAlmostEqual(bkgs[0], bkg, places=0)
+        self.assertAlmostEqual(bkgs[1], bkg, places=0)
+        self.assertEqual(bkgs[2], 0)
+        self.assertEqual(nan_fract[0], 0)
+        self.assertEqual(nan_fract[2], 1)
+
+        # unknown method
+        bkgs, nan_fract = self.utils.estimateBkgFromAnnuli(
+            hdu.data, wcs, ra, dec, 12, 24, method='unknown')
+        self.assertIsNone(bkgs)
+
+    def test_computeBkgMesh(self):
+        bkg = 1.0
+        hdu = self._createDummyFITS(size=200, bkg_mean=bkg, bkg_std=0.1)
+        hdu.data[:, 100:] += 1.0    # bkg step in right half
+        hdu.data[:50, :50] = np.nan  # blanked corner
+
+        bkg_mesh, rms_mesh = self.utils.computeBkgMesh(hdu.data, 50)
+        self.assertEqual(bkg_mesh.shape, (4, 4))
+        self.assertTrue(np.isnan(bkg_mesh[0, 0]))
+        self.assertAlmostEqual(bkg_mesh[1, 0], bkg, places=1)
+        self.assertAlmostEqual(bkg_mesh[1, 3], bkg+1, places=1)
+        self.assertAlmostEqual(rms_mesh[1, 0], 0.1, places=1)
+
+        # interpolation at box centers and between boxes
+        values = self.utils.interpolateBkgMesh(bkg_mesh, 50, np.array([24.5, 99.5]), np.array([124.5, 124.5]))
+        self.assertAlmostEqual(values[0], bkg_mesh[2, 0])
+        self.assertAlmostEqual(values[1], 0.5*(bkg_mesh[2, 1]+bkg_mesh[2, 2]))
+
+    def test_getBkgMesh_CacheKey(self):
+        workdir = tempfile.mkdtemp()
+        self.utils.bkg_meshes.clear()
+        try:
+            tile = os.path.join(workdir, 'tile.fits')
+            cache_dir = os.path.join(workdir, 'bkg_meshes')
+            hdu = self._createDummyFITS(size=100, bkg_mean=1.0, bkg_std=0.1)
+            hdu.writeto(tile)
+
+            bkg_mesh, rms_mesh, wcs = self.utils.getBkgMesh(tile, 50, cache_dir)
+            self.assertEqual(bkg_mesh.shape, (2, 2))
+            mesh_files = os.listdir(cache_dir)
+            self.assertEqual(len(mesh_files), 1)
+
+            # mesh memoized in this process is not read again
+            with patch('utils.fits.open') as mock_open:
+                self.assertIs(self.utils.getBkgMesh(tile, 50, cache_dir)[0], bkg_mesh)
+                mock_open.assert_not_called()
+
+            # cache hit does not read the tile
+            self.utils.bkg_meshes.clear()
+            with patch('utils.Utils.read_fits') as mock_read:
+                cached_mesh = self.utils.getBkgMesh(tile, 50, cache_dir)[0]
+                mock_read.assert_not_called()
+            np.testing.assert_allclose(cached_mesh, bkg_mesh, rtol=1e-6)
+
+            # modified tile gets a new cache entry, replacing the stale ones of the previous tile (meshes of other tiles are kept)
+            other_mesh_file = os.path.join(cache_dir, 'tile2_0123456789abcdef_bkgmesh50.fits')
+            shutil.copy(os.path.join(cache_dir, mesh_files[0]), other_mesh_file)
+            shutil.copy(os.path.join(cache_dir, mesh_files[0]), os.path.join(cache_dir, mesh_files[0].replace('bkgmesh50', 'bkgmesh20')))
+            hdu.data += 1.0
+            hdu.writeto(tile, overwrite=True)
+            modified_mesh = self.utils.getBkgMesh(tile, 50, cache_dir)[0]
+            self.assertAlmostEqual(modified_mesh[0, 0], bkg_mesh[0, 0]+1.0, places=3)
+            modified_mesh_files = sorted(os.listdir(cache_dir))
+            self.assertEqual(len(modified_mesh_files), 2)
+            self.assertNotIn(mesh_files[0], modified_mesh_files)
+            self.assertIn(os.path.basename(other_mesh_file), modified_mesh_files)
+        finally:
+            self.utils.bkg_meshes.clear()
+            shutil.rmtree(workdir)
+
+    def test_getBkgMesh_WriteFailure(self):
+        workdir = tempfile.mkdtemp()
+        self.utils.bkg_meshes.clear()
+        try:
+            tile = os.path.join(workdir, 'tile.fits')
+            hdu = self._createDummyFITS(size=100, bkg_mean=1.0, bkg_std=0.1)
+            hdu.writeto(tile)
+
+            # cache dir not writable: mesh is returned and memoized, not computed again
+            with patch('utils.fits.HDUList.writeto', side_effect=OSError('read-only file system')):
+                bkg_mesh = self.utils.getBkgMesh(tile, 50, os.path.join(workdir, 'bkg_meshes'))[0]
+            self.assertEqual(bkg_mesh.shape, (2, 2))
+            with patch('utils.Utils.read_fits') as mock_read:
+                self.assertIs(self.utils.getBkgMesh(tile, 50, os.path.join(workdir, 'bkg_meshes'))[0], bkg_mesh)
+                mock_read.assert_not_called()
+        finally:
+            self.utils.bkg_meshes.clear()
+            shutil.rmtree(workdir)
+
     @patch('utils.fits.open')
     def test_estimateBkgFromAnnulus_UnknownMethod(self, mock_read):
         bkg = 1.0
@@ -968,3 +1238,101 @@ class UtilsTest(unittest.TestCase):
         self.assertEqual(self.utils.estimateBkgFromAnnulus(
             'test.fits', 0, 0, 12, 24, method='unknown'), -1)
         mock_read.assert_called()
+
+    def test_getPositionGroups(self):
+        tol = 1./3600
+        ra = [10., 10. + 0.5*tol, 10. + 5*tol, 359.99999, 0.00001, 50., 50.]
+        dec = [0., 0., 0., 0., 0., 10., 10.]
+        leaders = self.utils.getPositionGroups(ra, dec, tol)
+        self.assertEqual(list(leaders), [0, 0, 2, 3, 3, 5, 5])
+
+        # positions with different radii are not grouped
+        radii = [20., 20., 20., 20., 20., 20., 30.]
+        leaders = self.utils.getPositionGroups(ra, dec, tol, radii=radii)
+        self.assertEqual(list(leaders), [0, 0, 2, 3, 3, 5, 6])
+
+        # radii are compared with the leader radius within the relative tolerance
+        radii = [20., 20.4, 20., 20., 20., 20., 20.1]
+        leaders = self.utils.getPositionGroups(ra, dec, tol, radii=radii, radius_tolerance=0.01)
+        self.assertEqual(list(leaders), [0, 1, 2, 3, 3, 5, 5])
+
+        # close radii across a rounding boundary (25.49 -> 25, 25.51 -> 26) are grouped
+        radii = [25.49, 25.51, 20., 20., 20., 20., 20.]
+        leaders = self.utils.getPositionGroups(ra, dec, tol, radii=radii, radius_tolerance=0.01)
+        self.assertEqual(list(leaders), [0, 0, 2, 3, 3, 5, 5])
+
+        self.assertEqual(self.utils.getPositionGroups([], [], tol).size, 0)
+
+    def test_getFoFGroups(self):
+        # chain a-b-c linked through overlapping cutouts, d isolated, e-f across RA=0
+        ra = [10., 10.08, 10.16, 20., 359.98, 0.02]
+        dec = [0., 0., 0., 0., 0., 0.]
+        sizes = [0.1, 0.1, 0.1, 0.1, 0.05, 0.05]
+        labels = self.utils.getFoFGroups(ra, dec, sizes)
+        self.assertEqual(list(labels), [0, 0, 0, 3, 4, 4])
+
+        # smaller cutouts do not overlap
+        labels = self.utils.getFoFGroups(ra, dec, [0.03]*6)
+        self.assertEqual(list(labels), [0, 1, 2, 3, 4, 5])
+
+    def test_getClusterFootprint(self):
+        ra_c, dec_c, size = self.utils.getClusterFootprint([10., 10.2], [0., 0.], [0.1, 0.1])
+        self.assertAlmostEqual(ra_c, 10.1)
+        self.assertAlmostEqual(dec_c, 0.)
+        self.assertAlmostEqual(size, 0.3)
+
+        # across RA=0
+        ra_c, dec_c, size = self.utils.getClusterFootprint([359.9, 0.1], [0., 0.1], [0.1, 0.1])
+        self.assertAlmostEqual(ra_c % 360., 0.)
+        self.assertAlmostEqual(dec_c, 0.05)
+        self.assertAlmostEqual(size, 0.3, places=5)
+
+    def test_getHilbertIndex(self):
+        # cell centers of a 8x8 grid: indices are a permutation, consecutive cells are adjacent
+        n = 8
+        iy, ix = np.mgrid[0:n, 0:n]
+        ra = (ix.ravel()+0.5)/n*360.
+        dec = np.degrees(np.arcsin((iy.ravel()+0.5)/n*2.-1.))
+        index = self.utils.getHilbertIndex(ra, dec, order=3)
+        self.assertEqual(sorted(index), list(range(n*n)))
+        order = np.argsort(index)
+        steps = np.abs(np.diff(ix.ravel()[order])) + np.abs(np.diff(iy.ravel()[order]))
+        self.assertTrue(np.all(steps == 1))
+
+    def test_getSkyShardIndices(self):
+        np.random.seed(1)
+        ra = np.random.uniform(0, 360, 5000)
+        dec = np.degrees(np.arcsin(np.random.uniform(-1, 1, 5000)))
+        shards = self.utils.getSkyShardIndices(ra, dec, 4)
+        self.assertEqual(shards.min(), 0)
+        self.assertEqual(shards.max(), 3)
+        self.assertLess(np.ptp(np.bincount(shards)), 100)   # balanced counts
+
+        # sources in the same sky cell always end up in the same shard
+        cells = self.utils.getHilbertIndex(ra, dec, order=6)
+        for cell in np.unique(cells):
+            self.assertEqual(len(np.unique(shards[cells == cell])), 1)
+        np.testing.assert_array_equal(shards, self.utils.getSkyShardIndices(ra, dec, 4))
+
+    @patch('utils.ascii.read')
+    def test_getSurveyPixelScale(self, mock_read):
+        mock_read.return_value = Table({'cdelt1': [-0.001, -0.001, -0.002], 'cdelt2': [0.001, 0.001, 0.002]})
+        self.assertAlmostEqual(self.utils.getSurveyPixelScale('survey.tbl'), 0.001)
+        mock_read.side_effect = IOError('missing file')
+        self.assertIsNone(self.utils.getSurveyPixelScale('survey.tbl'))
+
+    def test_estimateCutoutMemory(self):
+        # 1 deg cutouts from surveys with 0.01 and 0.02 deg pixels: 100x100 and 50x50 raw pixels
+        memory = self.utils.estimateCutoutMemory(1., [0.01, 0.02], regrid=True, itemsize=4)
+        self.assertEqual(memory, 4*(100**2 + 3*2*100**2))
+        memory = self.utils.estimateCutoutMemory(1., [0.01, 0.02], regrid=False, itemsize=8)
+        self.assertEqual(memory, 8*(100**2 + 3*2*100**2))
+        self.assertEqual(self.utils.estimateCutoutMemory(1., []), 0)
+        self.assertGreater(self.utils.estimateCutoutMemory(2., [0.01]), self.utils.estimateCutoutMemory(1., [0.01]))
+
+    def test_getTileReuseRatio(self):
+        tile_lists = [['a'], ['a'], ['b'], ['a', 'b'], []]
+        self.assertAlmostEqual(self.utils.getTileReuseRatio(tile_lists), 2./5)
+        self.assertAlmostEqual(self.utils.getTileReuseRatio(tile_lists, window=2), 3./5)
+        self.assertAlmostEqual(self.utils.getTileReuseRatio([['a'], ['b'], ['a']], window=2), 1./3)
+        self.assertEqual(self.utils.getTileReuseRatio([]), 0.)
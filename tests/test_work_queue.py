@@ -0,0 +1,125 @@
+import unittest
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+from unittest.mock import MagicMock
+from . import context
+from scutout.work_queue import WorkQueue
+
+
+class WorkQueueTest(unittest.TestCase):
+    """Tests for 'work_queue' module"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.workdir, 'queue.db')
+        self.sources = [(10.0+i, -5.0, 'S%d' % i, 20.0) for i in range(3)]
+        self.queue = self._openQueue()
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.workdir)
+
+    def _openQueue(self, **kwargs):
+        kwargs.setdefault('retry_delay', 0.01)
+        queue = WorkQueue(self.filename, **kwargs)
+        self.assertEqual(queue.open(), 0)
+        return queue
+
+    def _result(self, obj_name, status='done'):
+        return {'obj_name': obj_name, 'status': status, 'errmsg': '', 'elapsed': 1.0, 'outputs': ['a.fits']}
+
+    def test_add_sources(self):
+        self.assertEqual(self.queue.add_sources(self.sources, 'abc'), 0)
+        self.assertEqual(self.queue.get_counts(), {'pending': 3})
+
+        # sources already in queue are not added twice, also by another process
+        queue = self._openQueue()
+        self.assertEqual(queue.add_sources(self.sources + [(0., 0., 'S3', 20.)], 'abc'), 0)
+        self.assertEqual(queue.get_counts(), {'pending': 4})
+        queue.close()
+
+    def test_add_sources_ConfigHashMismatch(self):
+        self.assertEqual(self.queue.add_sources(self.sources, 'abc'), 0)
+        self.assertEqual(self.queue.add_sources([(0., 0., 'S3', 20.)], 'def'), -1)
+        self.assertEqual(self.queue.get_counts(), {'pending': 3})
+
+    def test_lease(self):
+        self.queue.add_sources(self.sources, 'abc')
+
+        leased = self.queue.lease('owner1', 2)
+        self.assertEqual([source for source_id, source in leased], self.sources[:2])
+        leased_other = self.queue.lease('owner2', 2)
+        self.assertEqual([source for source_id, source in leased_other], self.sources[2:])
+        self.assertEqual(self.queue.lease('owner2', 2), [])
+        self.assertEqual(self.queue.get_counts(), {'leased': 3})
+
+        source_id, source = leased[0]
+        self.assertEqual(self.queue.complete(source_id, 'owner1', self._result(source[2])), 0)
+        self.assertEqual(self.queue.get_counts(), {'leased': 2, 'done': 1})
+
+    def test_lease_Expired(self):
+        self.queue.close()
+        self.queue = self._openQueue(lease_timeout=0.05)
+        self.queue.add_sources(self.sources[:1], 'abc')
+
+        source_id, source = self.queue.lease('owner1')[0]
+        self.assertEqual(self.queue.lease('owner2'), [])
+
+        # expired lease is leased again, and the result of the previous owner is discarded
+        time.sleep(0.1)
+        self.assertEqual(self.queue.lease('owner2'), [(source_id, source)])
+        self.assertEqual(self.queue.complete(source_id, 'owner1', self._result(source[2])), -1)
+        self.assertEqual(self.queue.complete(source_id, 'owner2', self._result(source[2])), 0)
+        self.assertEqual(self.queue.get_counts(), {'done': 1})
+
+    def test_lease_Renew(self):
+        self.queue.close()
+        self.queue = self._openQueue(lease_timeout=0.5)
+        self.queue.add_sources(self.sources[:1], 'abc')
+
+        self.queue.lease('owner1')
+        time.sleep(0.3)
+        self.queue.renew('owner1')
+        time.sleep(0.3)
+        self.assertEqual(self.queue.lease('owner2'), [])
+
+    def test_lease_MaxAttempts(self):
+        self.queue.close()
+        self.queue = self._openQueue(lease_timeout=0.05, max_attempts=2)
+        self.queue.add_sources(self.sources[:1], 'abc')
+
+        self.assertEqual(len(self.queue.lease('owner1')), 1)
+        time.sleep(0.1)
+        self.assertEqual(len(self.queue.lease('owner2')), 1)
+        time.sleep(0.1)
+        self.assertEqual(self.queue.lease('owner3'), [])
+        self.assertEqual(self.queue.get_counts(), {'failed': 1})
+
+    def test_lease_RetryOnDatabaseError(self):
+        self.queue.add_sources(self.sources, 'abc')
+
+        # first attempt fails (e.g. database locked by another process), second succeeds
+        conn = self.queue.conn
+        nfailures = [1]
+
+        def execute(*args):
+            if nfailures[0] > 0:
+                nfailures[0] -= 1
+                raise sqlite3.OperationalError('database is locked')
+            return conn.execute(*args)
+
+        self.queue.conn = MagicMock(in_transaction=False)
+        self.queue.conn.execute.side_effect = execute
+        self.queue.conn.executemany.side_effect = conn.executemany
+        self.assertEqual(len(self.queue.lease('owner1', 1)), 1)
+
+        # persistent failures are raised after max retries
+        nfailures[0] = 100
+        self.assertRaises(sqlite3.OperationalError, self.queue.renew, 'owner1')
+        self.assertEqual(nfailures[0], 100-self.queue.max_retries)
+
+        self.queue.conn = conn
+        self.assertEqual(self.queue.get_counts(), {'leased': 1, 'pending': 2})